@@ -13,15 +13,50 @@ class Config:
     ALLOW_INTERRUPTION = os.getenv("ALLOW_INTERRUPTION", "False").lower() == "true"
     ALLOW_WAKE_WORD = os.getenv("ALLOW_WAKE_WORD", "False").lower() == "true"
     DEVICE = os.getenv("DEVICE", "raspi5").strip()
+    # True = حلقة المحادثة على asyncio (assistant_async.py) بدل MainThread/InterruptionThread
+    ASYNC_LOOP = os.getenv("ASYNC_LOOP", "False").strip().lower() in ("true", "1", "yes")
     EYE_MODEL = os.getenv("EYE_MODEL", "img").strip()
 
 
     SERVER_API_URL = os.getenv("SERVER_API_URL", "http://127.0.0.1:5055").strip()
 
+    # === Streaming STT ===
+    # True = رفع الصوت للسيرفر أثناء التسجيل (chunked upload على /stt/stream)
+    STT_STREAMING = os.getenv("STT_STREAMING", "False").strip().lower() in ("true", "1", "yes")
+    # True = STT تخميني على الصوت عند بداية الصمت (قبل انتهاء end_frames + post_silence_hold)
+    STT_SPECULATIVE = os.getenv("STT_SPECULATIVE", "True").strip().lower() in ("true", "1", "yes")
+    # صيغة رفع الصوت على /stt: auto (flac ثم adpcm ثم ulaw حسب ما يعلنه السيرفر في /stt/formats)
+    # أو flac / opus / adpcm / ulaw (أو قائمة بالترتيب "opus,flac")، wav = بدون ضغط ولا handshake
+    STT_UPLOAD_CODEC = os.getenv("STT_UPLOAD_CODEC", "auto").strip().lower()
+
     # === API Keys (Required for ElevenLabs only) ===
     N8N_URL = os.getenv("N8N_URL", "").strip()
     HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "60"))
     RETRIES = int(os.getenv("RETRIES", "3"))
+    # === Shared HTTP transport (connect / read timeouts بالثواني) ===
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+    STT_TIMEOUT = float(os.getenv("STT_TIMEOUT", "120"))
+    TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "120"))
+    HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.3"))
+    HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.2"))
+    # فتح اتصالات STT/TTS/n8n مسبقًا عند الإقلاع
+    HTTP_PREWARM = os.getenv("HTTP_PREWARM", "True").strip().lower() in ("true", "1", "yes")
+    # True = استهلاك رد n8n كـ stream (SSE / JSON lines) ونطق الجمل فور اكتمالها
+    N8N_STREAM = os.getenv("N8N_STREAM", "False").strip().lower() in ("true", "1", "yes")
+    # Cache لردود n8n (نفس السؤال بعد التطبيع = نفس الرد بدون رحلة للسحابة)
+    N8N_CACHE = os.getenv("N8N_CACHE", "False").strip().lower() in ("true", "1", "yes")
+    N8N_CACHE_PATH = os.getenv("N8N_CACHE_PATH", "cache/n8n_answers.json").strip()
+    N8N_CACHE_TTL = float(os.getenv("N8N_CACHE_TTL", "86400"))          # ثواني
+    N8N_CACHE_MAX_ITEMS = int(os.getenv("N8N_CACHE_MAX_ITEMS", "256"))
+    # أسئلة أقصر من هذا (بالكلمات) لا تُخزّن: "yes" / "tell me more" تعتمد على سياق المحادثة
+    N8N_CACHE_MIN_WORDS = int(os.getenv("N8N_CACHE_MIN_WORDS", "4"))
+    # Cache صوت TTS على القرص (content-addressed) + توليد الردود المحلية مسبقًا عند الإقلاع
+    TTS_CACHE = os.getenv("TTS_CACHE", "False").strip().lower() in ("true", "1", "yes")
+    TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "cache/tts").strip()
+    TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "64"))
+    TTS_CACHE_WARMUP = os.getenv("TTS_CACHE_WARMUP", "True").strip().lower() in ("true", "1", "yes")
+    # الوقت/التاريخ يُنطقان من كلمات مولّدة مسبقًا (spoken_phrases.py) بدل طلب TTS كل مرة
+    TTS_PHRASE_FRAGMENTS = os.getenv("TTS_PHRASE_FRAGMENTS", "False").strip().lower() in ("true", "1", "yes")
 
 
     # === Recorder Settings (16k/mono/16-bit) ===
@@ -33,6 +68,37 @@ class Config:
     
     # ✅ Chunk size محسّن: أصغر = استجابة أسرع
     REC_CHUNK = int(os.getenv("REC_CHUNK", "256"))  # كان 512
+    # VAD engine: rms (الأصلي) / spectral (NumPy, يرفض المراوح والنغمات) / webrtc (pip install webrtcvad)
+    VAD_ENGINE = os.getenv("VAD_ENGINE", "rms").strip().lower()
+    # ثواني الصوت المحفوظة في ring buffer ثريد الالتقاط (pre-roll + قراء متأخرون)
+    REC_RING_SECONDS = float(os.getenv("REC_RING_SECONDS", "10"))
+    # تتبّع ضوضاء الغرفة باستمرار في ثريد الالتقاط → لا انتظار معايرة (0.8s) في كل دور
+    REC_NOISE_TRACKING = os.getenv("REC_NOISE_TRACKING", "True").strip().lower() in ("true", "1", "yes")
+    # callback = PortAudio يدفع الصوت في الـ ring (لا read() يحجز الـ GIL) / blocking = ثريد stream.read()
+    REC_CAPTURE_MODE = os.getenv("REC_CAPTURE_MODE", "callback").strip().lower()
+
+    # === Local keyword spotting (keyword_spotter.py) ===
+    # True = wake word / stop تُكتشف على الجهاز، والصوت لا يذهب للسيرفر إلا بعد hit
+    KWS_ENABLED = os.getenv("KWS_ENABLED", "False").strip().lower() in ("true", "1", "yes")
+    KWS_DIR = os.getenv("KWS_DIR", "Resources/kws").strip()
+    KWS_THRESHOLD = float(os.getenv("KWS_THRESHOLD", "2.0"))
+    # أسماء المجلدات داخل KWS_DIR (مفصولة بفواصل)
+    KWS_WAKE_WORDS = os.getenv("KWS_WAKE_WORDS", "zico,ziko,زيكو").strip()
+    KWS_STOP_WORDS = os.getenv("KWS_STOP_WORDS", "stop,توقف,وقف").strip()
+
+    # === Echo cancellation (echo_canceller.py) ===
+    # True = صوت الروبوت يُطرح من المايك قبل VAD/STT (barge-in بعتبات منخفضة)
+    AEC_ENABLED = os.getenv("AEC_ENABLED", "False").strip().lower() in ("true", "1", "yes")
+    AEC_TAPS = int(os.getenv("AEC_TAPS", "256"))
+    # مستوى صوت الروبوت فور سماع المستخدم أثناء الكلام (1.0 = بدون خفض؛ يعمل مع AEC_ENABLED فقط)
+    BARGE_IN_DUCK_GAIN = float(os.getenv("BARGE_IN_DUCK_GAIN", "0.3"))
+    # أقل rms للمايك (بعد إلغاء الصدى) يُعتبر كلام مستخدم يستحق خفض الصوت
+    BARGE_IN_DUCK_RMS = float(os.getenv("BARGE_IN_DUCK_RMS", "250"))
+
+    # === Latency tracing (latency_trace.py) ===
+    # True = spans لكل دور تُحفظ كـ JSONL عند الإغلاق + ملخص p50/p95/p99
+    LATENCY_TRACE = os.getenv("LATENCY_TRACE", "False").strip().lower() in ("true", "1", "yes")
+    LATENCY_TRACE_PATH = os.getenv("LATENCY_TRACE_PATH", "latency_trace.jsonl")
     
     # ============ SESSION SETTINGS ============
     SESSION_ID = os.getenv("SESSION_ID", "robot-1").strip()
@@ -1,44 +1,185 @@
 ﻿# ai_n8n.py
-# تحسينات: Connection pooling، أفضل error handling، retry logic محسّن
+# تحسينات: Connection pooling (shared transport)، أفضل error handling، retry logic محسّن
+# + AnswerCache اختياري: الأسئلة المكررة تُجاب من الذاكرة/القرص بدون رحلة n8n
 
+import os
 import time
+import json
+import threading
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
 from Config import Config
+from http_transport import HttpTransport, get_transport
+from latency_trace import TRACE
+from local_commands import LocalCommandHandler
+from utilities import SentenceBuffer, normalize_arabic
+
+
+class AnswerCache:
+    """
+    n8n answers keyed by the normalized prompt.
+
+    - المفتاح: normalize_arabic + LocalCommandHandler.normalize_text
+      ("Tell me a story!" و "tell me a story" = نفس المفتاح)
+    - TTL بالثواني + LRU بحد أقصى للعناصر
+    - الأسئلة الأقصر من `min_words` كلمة لا تُخزّن ولا يُبحث عنها: n8n يحفظ ذاكرة
+      المحادثة، فردود مثل "yes" / "tell me more" / "نعم" تعتمد على ما قبلها
+    - يُحفظ كـ JSON على القرص (كتابة ذرية: tmp ثم os.replace) → يبقى بعد إعادة التشغيل؛
+      الكتابة مؤجلة `save_delay` ثانية في ثريد Timer (لا على مسار الرد) + flush() عند الإغلاق
+    """
+
+    def __init__(self, path: Optional[str] = None, max_items: int = 256, ttl: float = 86400.0,
+                 min_words: int = 4, save_delay: float = 5.0):
+        self.path = path
+        self.max_items = max_items
+        self.ttl = ttl
+        self.min_words = min_words
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()   # key → (answer, stored_at)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self._load()
+
+    # علامات ترقيم عربية داخل نطاق \u0600-\u06FF (لا يحذفها normalize_text)
+    _AR_PUNCT = str.maketrans({"؟": " ", "،": " ", "؛": " ", "٪": " "})
+
+    @staticmethod
+    def key(message: str) -> str:
+        text = normalize_arabic(message or "").translate(AnswerCache._AR_PUNCT)
+        return LocalCommandHandler.normalize_text(text)
+
+    def cacheable(self, key: str) -> bool:
+        """Long enough to stand on its own (not a context-dependent follow-up)."""
+        return len(key.split()) >= self.min_words
+
+    def get(self, message: str) -> Optional[str]:
+        k = self.key(message)
+        if not self.cacheable(k):
+            return None
+        with self._lock:
+            item = self._items.get(k)
+            if item is not None and time.time() - item[1] > self.ttl:
+                del self._items[k]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(k)
+            self.hits += 1
+            return item[0]
+
+    def put(self, message: str, answer: str) -> None:
+        k = self.key(message)
+        if not self.cacheable(k) or not answer or not answer.strip():
+            return
+        with self._lock:
+            self._items[k] = (answer, time.time())
+            self._items.move_to_end(k)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        self._schedule_save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+        self._schedule_save()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0.0
+        return f"{len(self._items)} answers, {self.hits} hits / {self.misses} misses ({rate:.0f}%)"
+
+    # ---------------- Disk ----------------
+
+    def _schedule_save(self) -> None:
+        """Mark dirty; one delayed save() covers all puts in the next `save_delay` s."""
+        if not self.path:
+            return
+        with self._lock:
+            self._dirty = True
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.save_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """Write pending changes now (called by the timer and on close)."""
+        with self._lock:
+            timer, self._timer = self._timer, None
+            dirty, self._dirty = self._dirty, False
+        if timer is not None:
+            timer.cancel()
+        if dirty:
+            self.save()
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            data = [[k, a, t] for k, (a, t) in self._items.items()]   # ترتيب LRU محفوظ
+        try:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[n8n] ⚠️ Answer cache not saved: {e}")
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[n8n] ⚠️ Answer cache ignored ({e})")
+            return
+        now = time.time()
+        try:
+            for k, answer, stored_at in data:
+                if now - stored_at <= self.ttl:
+                    self._items[k] = (answer, stored_at)
+        except (TypeError, ValueError) as e:
+            print(f"[n8n] ⚠️ Answer cache ignored (malformed: {e})")
+            self._items.clear()
+            return
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
 
 class N8nClient:
-    def __init__(self, config: Config = None):
+    def __init__(self, config: Config = None, transport: Optional[HttpTransport] = None):
         self.cfg = config or Config()
         self.url = self.cfg.N8N_URL
         self.timeout = self.cfg.HTTP_TIMEOUT
         self.max_retries = self.cfg.RETRIES
 
-        # ✅ Session مع connection pooling للسرعة
-        self.session = requests.Session()
-        
-        # ✅ Retry strategy محسّنة
-        retry_strategy = Retry(
-            total=self.max_retries,
-            backoff_factor=0.3,  # 0.3s, 0.6s, 1.2s
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["POST"]
-        )
-        
-        adapter = HTTPAdapter(
-            max_retries=retry_strategy,
-            pool_connections=2,  # عدد الـ connections المفتوحة
-            pool_maxsize=5       # أقصى حجم للـ pool
-        )
-        
-        self.session.mount("https://", adapter)
-        self.session.mount("http://", adapter)
-        
-        # ✅ Headers ثابتة
-        self.session.headers.update({
-            "Content-Type": "application/json",
-            "User-Agent": "AI-Robot/1.0"
-        })
+        # ✅ Session مشتركة مع STT/TTS: connection pooling + retry مع jitter
+        # (Content-Type يضبطه json= لكل طلب، لا يوضع على الـ session المشتركة)
+        self.transport = transport or get_transport(self.cfg)
+        self.session = self.transport.session
+        self.transport.register("n8n", self.url, read_timeout=self.timeout, pool_maxsize=5)
+
+        # ✅ Cache اختياري للأسئلة المكررة (N8N_CACHE)
+        self.cache: Optional[AnswerCache] = None
+        if getattr(self.cfg, "N8N_CACHE", False):
+            self.cache = AnswerCache(
+                path=self.cfg.N8N_CACHE_PATH,
+                max_items=self.cfg.N8N_CACHE_MAX_ITEMS,
+                ttl=self.cfg.N8N_CACHE_TTL,
+                min_words=getattr(self.cfg, "N8N_CACHE_MIN_WORDS", 4)
+            )
 
     def chat(self, userId: str, message: str) -> str:
         """
@@ -54,6 +195,12 @@ class N8nClient:
         if not message or not message.strip():
             return ""
 
+        if self.cache is not None:
+            cached = self.cache.get(message)
+            if cached is not None:
+                print(f"[n8n] ⚡ Cached answer ({self.cache.stats()})")
+                return cached
+
         payload = {
             "userId": userId,
             "activeAgent":"general",
@@ -61,16 +208,19 @@ class N8nClient:
         }
 
         start_time = time.time()
+        t0 = TRACE.now()
 
         try:
             # ✅ استخدام session للـ connection reuse
             resp = self.session.post(
                 self.url,
-                json=payload,
-                timeout=self.timeout
+                json=payload
             )
             
             elapsed = time.time() - start_time
+            # resp.elapsed = حتى وصول الـ headers (≈ أول byte)
+            TRACE.record("n8n_first_byte", t0, t0 + resp.elapsed.total_seconds())
+            TRACE.record("n8n", t0, t0 + elapsed)
             
             # ✅ معالجة أفضل للـ status codes
             if resp.status_code == 200:
@@ -81,30 +231,17 @@ class N8nClient:
                     output = resp.text.strip()
                     print(f"[n8n] ✅ Response (text) in {elapsed:.2f}s")
                     print(f"[n8n] ✅ Response (text) in {resp}")
+                    if self.cache is not None:
+                        self.cache.put(message, output)
                     return output
 
                 # ✅ محاولة استخراج الرد من JSON
-                if isinstance(js, dict):
-                    # Try multiple possible keys
-                    output = (
-                        js.get("output") or 
-                        js.get("message") or 
-                        js.get("response") or 
-                        js.get("text") or
-                        ""
-                    )
-                    
-                    if output:
-                        print(f"[n8n] ✅ Response (JSON) in {elapsed:.2f}s")
-                        return str(output).strip()
-                    
-                    # إذا لم نجد الرد، نطبع JSON للتشخيص
-                    print(f"[n8n] ⚠️ Unexpected JSON structure: {js}")
-                    return str(js).strip()
-
-                # JSON ليس dict
-                print(f"[n8n] ⚠️ Non-dict JSON: {js}")
-                return str(js).strip()
+                output = self._extract_output(js)
+                if isinstance(js, dict) and output:
+                    print(f"[n8n] ✅ Response (JSON) in {elapsed:.2f}s")
+                if self.cache is not None:
+                    self.cache.put(message, output)
+                return output
 
             elif resp.status_code == 429:
                 print(f"[n8n] ⚠️ Rate limited (429)")
@@ -134,10 +271,229 @@ class N8nClient:
             print(f"[n8n] ❌ Unexpected error: {e}")
             return ""
 
+    @staticmethod
+    def _extract_output(js) -> str:
+        """استخراج نص الرد من JSON غير متدفق (output/message/response/text)."""
+        if isinstance(js, dict):
+            # Try multiple possible keys
+            output = (
+                js.get("output") or 
+                js.get("message") or 
+                js.get("response") or 
+                js.get("text") or
+                ""
+            )
+            if output:
+                return str(output).strip()
+
+            # إذا لم نجد الرد، نطبع JSON للتشخيص
+            print(f"[n8n] ⚠️ Unexpected JSON structure: {js}")
+            return str(js).strip()
+
+        # JSON ليس dict
+        print(f"[n8n] ⚠️ Non-dict JSON: {js}")
+        return str(js).strip()
+
+    # ==================== Streaming ====================
+
+    # أنواع chunks في n8n streaming (Respond to Webhook / AI Agent)
+    _N8N_CHUNK_TYPES = ("begin", "item", "end", "error")
+
+    @staticmethod
+    def _delta_from_event(obj) -> Optional[str]:
+        """
+        Text delta from one streamed event, or None if the event has no text.
+        Supports n8n chunks ({"type": "item", "content": ...}),
+        OpenAI-style deltas and plain {"text"/"output": ...} events.
+        """
+        if isinstance(obj, str):
+            return obj
+        if not isinstance(obj, dict):
+            return None
+        if obj.get("type") in N8nClient._N8N_CHUNK_TYPES:
+            if obj.get("type") == "error":
+                print(f"[n8n] ❌ Stream error: {obj.get('content') or obj}")
+                return None
+            content = obj.get("content")
+            return content if isinstance(content, str) and obj.get("type") == "item" else None
+        choices = obj.get("choices")
+        if isinstance(choices, list) and choices:
+            delta = (choices[0] or {}).get("delta") or {}
+            content = delta.get("content")
+            return content if isinstance(content, str) else None
+        for key in ("delta", "content", "output", "message", "response", "text"):
+            value = obj.get(key)
+            if isinstance(value, str):
+                return value
+        return None
+
+    def chat_stream(self, userId: str, message: str) -> Iterator[str]:
+        """
+        Streaming variant of chat(): yields text deltas as n8n produces them.
+
+        Handles:
+          - SSE (text/event-stream): `data: {...}` lines, `[DONE]` terminator
+          - n8n streaming: JSON lines with type begin/item/end
+          - chunked plain text
+          - non-streaming webhooks: whole body → same key extraction as chat()
+        Errors are printed and end the stream (like chat() returning "").
+        """
+        if not message or not message.strip():
+            return
+
+        if self.cache is not None:
+            cached = self.cache.get(message)
+            if cached is not None:
+                print(f"[n8n] ⚡ Cached answer ({self.cache.stats()})")
+                yield cached
+                return
+
+        payload = {
+            "userId": userId,
+            "activeAgent":"general",
+            "message": message.strip()
+        }
+        headers = {"Accept": "text/event-stream, application/x-ndjson, application/json;q=0.9, */*;q=0.8"}
+
+        start_time = time.time()
+        t0 = TRACE.now()
+        turn = TRACE.turn
+        first_byte = None
+        parts = []
+        try:
+            with self.session.post(self.url, json=payload, headers=headers,
+                                   stream=True) as resp:
+                if resp.status_code != 200:
+                    print(f"[n8n] ❌ Unexpected status: {resp.status_code}")
+                    return
+                if resp.encoding is None:
+                    resp.encoding = "utf-8"
+
+                ctype = resp.headers.get("Content-Type", "").lower()
+                if "text/event-stream" in ctype:
+                    chunks = self._iter_sse(resp)
+                elif "text/plain" in ctype:
+                    chunks = (c for c in resp.iter_content(chunk_size=None, decode_unicode=True) if c)
+                else:
+                    chunks = self._iter_json_lines(resp)
+
+                for delta in chunks:
+                    if first_byte is None:
+                        first_byte = time.time() - start_time
+                        TRACE.record("n8n_first_byte", t0, t0 + first_byte, turn)
+                        print(f"[n8n] ⚡ First token in {first_byte:.2f}s")
+                    if self.cache is not None:
+                        parts.append(delta)
+                    yield delta
+
+            TRACE.record("n8n", t0, TRACE.now(), turn)
+            # الرد كامل فقط (توقف التشغيل مبكرًا = GeneratorExit قبل هذا السطر)
+            if self.cache is not None:
+                self.cache.put(message, "".join(parts))
+            print(f"[n8n] ✅ Stream finished in {time.time() - start_time:.2f}s")
+
+        except requests.Timeout:
+            print(f"[n8n] ⏱️ Timeout after {self.timeout}s")
+        except requests.ConnectionError as e:
+            print(f"[n8n] 🔌 Connection error: {e}")
+        except requests.RequestException as e:
+            print(f"[n8n] ❌ Request error: {e}")
+
+    def chat_sentences(self, userId: str, message: str, min_chars: int = 12) -> Iterator[str]:
+        """chat_stream() regrouped into complete sentences (ready for TTS)."""
+        buf = SentenceBuffer(min_chars=min_chars)
+        for delta in self.chat_stream(userId, message):
+            for sentence in buf.feed(delta):
+                yield sentence
+        for sentence in buf.flush():
+            yield sentence
+
+    def _iter_sse(self, resp) -> Iterator[str]:
+        data_lines = []
+        for line in resp.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == "":
+                # نهاية event
+                if data_lines:
+                    data = "\n".join(data_lines)
+                    data_lines = []
+                    if data.strip() == "[DONE]":
+                        return
+                    try:
+                        delta = self._delta_from_event(json.loads(data))
+                    except ValueError:
+                        delta = data
+                    if delta:
+                        yield delta
+                continue
+            if line.startswith(":"):
+                continue  # تعليق / keep-alive
+            if line.startswith("data:"):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(" ") else value)
+        if data_lines:
+            data = "\n".join(data_lines)
+            if data.strip() != "[DONE]":
+                try:
+                    delta = self._delta_from_event(json.loads(data))
+                except ValueError:
+                    delta = data
+                if delta:
+                    yield delta
+
+    def _iter_json_lines(self, resp) -> Iterator[str]:
+        """
+        n8n JSON-lines stream, or a normal JSON body (fallback).
+        نقرر من أول سطر: لو chunk من n8n نكمل بث، وإلا نجمع الجسم كاملًا.
+        """
+        lines = resp.iter_lines(decode_unicode=True)
+        body = []
+        streaming = None
+        for line in lines:
+            if streaming is None:
+                if not line or not line.strip():
+                    continue
+                try:
+                    obj = json.loads(line)
+                    streaming = isinstance(obj, dict) and obj.get("type") in self._N8N_CHUNK_TYPES
+                except ValueError:
+                    streaming = False
+                if not streaming:
+                    body.append(line)
+                    continue
+            elif not streaming:
+                body.append(line)
+                continue
+            else:
+                if not line or not line.strip():
+                    continue
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue
+
+            delta = self._delta_from_event(obj)
+            if delta:
+                yield delta
+
+        if body:
+            text = "\n".join(body).strip()
+            try:
+                output = self._extract_output(json.loads(text))
+            except ValueError:
+                output = text
+            if output:
+                yield output
+
     def close(self):
-        """إغلاق الـ session"""
+        """إغلاق اتصالات n8n فقط (الـ session مشتركة مع STT/TTS)"""
+        cache = getattr(self, "cache", None)
+        if cache is not None:
+            cache.flush()   # كتابة الـ cache المؤجلة
         try:
-            self.session.close()
+            if self.url:
+                self.session.get_adapter(self.url).close()
         except Exception:
             pass
 
@@ -148,8 +504,6 @@ class N8nClient:
 
 # ✅ Test function
 if __name__ == "__main__":
-    import os
-    
     # تأكد من وجود N8N_URL في البيئة
     if not os.getenv("N8N_URL"):
         print("❌ Please set N8N_URL environment variable")
@@ -0,0 +1,466 @@
+# assistant_async.py
+# -------------------------------------------------------------------
+# asyncio conversation loop (بديل MainThread + InterruptionThread)
+# - كل دور (تسجيل → STT → أوامر محلية → n8n → TTS → تشغيل) = Task واحدة
+# - barge-in = إلغاء الـ Task: طلبات HTTP الجارية تُقطع فورًا (CancelScope)
+#   والتشغيل يتوقف بدون انتظار رد requests
+# - لا توجد متغيرات global مشتركة ولا time.sleep polling
+# -------------------------------------------------------------------
+
+import asyncio
+import threading
+import traceback
+from typing import Callable, Optional
+
+from audio_player import CHANNEL_SPEECH, barge_in_ducker
+from http_transport import CancelScope
+from keyword_spotter import KeywordGate
+from latency_trace import TRACE
+from speech_to_text import SpeculativeTranscriber
+
+
+async def run_blocking(fn: Callable, *args, on_cancel: Optional[Callable[[], None]] = None, **kwargs):
+    """
+    Run a blocking call in the default executor, cancellable from asyncio.
+    On task cancellation every HTTP request made by `fn` is aborted
+    (CancelScope) and `on_cancel` is called (stop playback, stop recording…).
+    """
+    loop = asyncio.get_running_loop()
+    scope = CancelScope()
+
+    def call():
+        with scope:
+            return fn(*args, **kwargs)
+
+    future = loop.run_in_executor(None, call)
+    try:
+        return await future
+    except asyncio.CancelledError:
+        scope.cancel()
+        if on_cancel is not None:
+            try:
+                on_cancel()
+            except Exception:
+                pass
+        raise
+
+
+class AsyncAssistant:
+    """
+    Cooperative-task version of the voice loop in main.py.
+
+    States (كانت flags في SystemState):
+      - "speaking / waiting for AI"  → self._turn_task قيد التشغيل
+      - allow_listening_to_user      → self._barge_in_task موجودة
+      - interrupt()                  → self._turn_task.cancel()
+    """
+
+    WELCOME = "Resources/voice_msgs/zico_welcome.wav"
+    BELL = "Resources/voice_msgs/bell.wav"
+    THINKING = "Resources/voice_msgs/thinking.wav"
+    GOT_IT = "Resources/voice_msgs/got_it.wav"
+    LISTENING = "Resources/voice_msgs/listening.wav"
+    YES_HOW_HELP = "Resources/voice_msgs/yes_how_help.wav"
+
+    EMPTY_PROMPT = "tell me a tiny story from arabn nights with in about 100 words"
+
+    def __init__(
+        self,
+        recorder,
+        stt,
+        n8n,
+        speech,
+        audio_player,
+        local_handler,
+        wake_detector,
+        stop_detector,
+        config,
+        allow_wake_word: bool = True,
+        allow_interruption: bool = False,
+        user_id: str = "123456",
+        spotter=None,
+        wake_keywords=(),
+        stop_keywords=(),
+    ):
+        self.recorder = recorder
+        self.stt = stt
+        self.n8n = n8n
+        self.speech = speech
+        self.audio_player = audio_player
+        self.local_handler = local_handler
+        self.wake_detector = wake_detector
+        self.stop_detector = stop_detector
+        self.config = config
+        self.allow_wake_word = allow_wake_word
+        self.allow_interruption = allow_interruption
+        self.user_id = user_id
+        # Local keyword spotter (keyword_spotter.py) — None = كل شيء عبر STT
+        self.spotter = spotter
+        self.wake_keywords = tuple(wake_keywords)
+        self.stop_keywords = tuple(stop_keywords)
+
+        self._active = True
+        self._turn_task: Optional[asyncio.Task] = None
+        self._barge_in_task: Optional[asyncio.Task] = None
+        self._barged_in = False
+
+    # ---------------- Lifecycle ----------------
+
+    async def run(self) -> None:
+        print("=" * 60)
+        print("🚀 AI Assistant Started (asyncio) — Wake Word: Ziko / زيكو")
+        print("=" * 60)
+
+        await self._cue(self.WELCOME)
+        first = True
+        while self._active:
+            if not first:
+                await self._cue(self.BELL)
+            first = False
+
+            self._barged_in = False
+            self._turn_task = asyncio.create_task(self._turn(), name="Turn")
+            try:
+                await self._turn_task
+            except asyncio.CancelledError:
+                if not self._barged_in:
+                    if not self._active:
+                        break   # stop()
+                    raise       # إلغاء run() نفسها (Ctrl+C)
+                print("✅ All processes stopped, ready for new input")
+                await self._cue(self.LISTENING)
+            except Exception as ex:
+                print(f"❌ Loop error: {ex}")
+                traceback.print_exc()
+                await asyncio.sleep(0.2)
+            finally:
+                self._turn_task = None
+                await self._stop_barge_in()
+
+    def stop(self) -> None:
+        """Stop the loop after cancelling whatever is running (call from the loop thread)."""
+        self._active = False
+        if self._turn_task is not None:
+            self._turn_task.cancel()
+
+    def interrupt(self) -> None:
+        """Barge-in: cancel the running turn (HTTP + TTS + playback)."""
+        if self._turn_task is None or self._turn_task.done():
+            return
+        print("\n⚠️ INTERRUPT: User is speaking - stopping all processes...")
+        self._barged_in = True
+        try:
+            self.audio_player.stop_current()
+            self.audio_player.flush_queue()
+        except Exception:
+            pass
+        self._turn_task.cancel()
+
+    # ---------------- One Turn ----------------
+
+    async def _turn(self) -> None:
+        print("ℹ️ Listening...")
+        user_text = await self._listen_and_transcribe()
+        if user_text is None:
+            return
+        if not user_text.strip():
+            print("⚠️  user_text updated")
+            user_text = self.EMPTY_PROMPT
+
+        print(f"\n🎤 User: {user_text}")
+
+        # Safety stop (works without wake word)
+        if self.stop_detector.is_stop_command(user_text):
+            print("⚠️ Stop command detected, cancelled speech.")
+            return
+
+        # Wake word
+        user_message = user_text
+        if self.allow_wake_word:
+            has_wake, remaining, _wake_form = self.wake_detector.extract_after_wake(user_message)
+            if not has_wake:
+                print("⏭️ Ignored (no wake word).")
+                return
+            user_message = remaining
+
+        print(F"⏭️ user_message:{user_message}.")
+        if not user_message:
+            await self._cue(self.YES_HOW_HELP)
+            return
+
+        # Local commands THEN AI
+        try:
+            with TRACE.span("local_command"):
+                should_continue, local_response, action, pass_text = self.local_handler.handle(user_message)
+            print(f"should_continue:{should_continue} / local_response:{local_response} / action:{action}")
+        except Exception as ex:
+            print(f"❌ Local command error: {ex}")
+            should_continue, local_response, action, pass_text = True, None, None, user_message
+
+        if local_response:
+            print(f"🤖 Local Response: {local_response}")
+            await self._speak(local_response)
+
+        if not should_continue:
+            return
+
+        # من هنا يُسمح بالمقاطعة (كان resume_interruption / pause_interruption)
+        self._start_barge_in()
+        if not local_response:
+            self.audio_player.play_async(self.THINKING)
+        print("🤔 Processing with AI...")
+
+        prompt_text = pass_text if pass_text else user_message
+        if self.config.N8N_STREAM:
+            await self._speak(self._ai_sentences(prompt_text))
+            return
+
+        ai_response = await run_blocking(self.n8n.chat, self.user_id, prompt_text)
+        if ai_response and ai_response.strip():
+            print(f"🤖 AI Response: {ai_response}")
+            self.audio_player.play_async(self.GOT_IT)
+            await self._speak(ai_response)
+
+    # ---------------- Steps ----------------
+
+    async def _listen_and_transcribe(self) -> Optional[str]:
+        """Record one utterance and return its transcript (None = nothing usable)."""
+        stop_rec = threading.Event()
+        stt_session = None
+        if self.config.STT_STREAMING:
+            stt_session = self.stt.open_stream(
+                sample_rate=self.recorder.rate,
+                sample_width=self.recorder.width,
+                channels=self.recorder.channels
+            )
+
+        speculative = None
+        if stt_session is None and self.config.STT_SPECULATIVE:
+            speculative = SpeculativeTranscriber(
+                self.stt,
+                sample_rate=self.recorder.rate,
+                sample_width=self.recorder.width,
+                channels=self.recorder.channels
+            )
+
+        # الصوت أثناء التسجيل: stream STT، أو ترميز الرفع المضغوط للـ speculative STT
+        downstream = stt_session.feed if stt_session else (speculative.feed if speculative else None)
+
+        gate = None
+        if self.spotter is not None and self.allow_wake_word:
+            gate = KeywordGate(self.spotter, self.wake_keywords + self.stop_keywords,
+                               downstream=downstream)
+
+        def on_cancel():
+            stop_rec.set()
+            if stt_session is not None:
+                stt_session.abort()
+            if speculative is not None:
+                speculative.discard()
+
+        TRACE.new_turn()
+        t_capture = TRACE.now()
+        audio_pcm = await run_blocking(
+            self.recorder.record_until_silence,
+            max_duration=25.0,
+            noise_calib_duration=0.8,
+            start_frames=3,
+            end_frames=18,
+            post_silence_hold=0.35,
+            pre_roll_ms=350,
+            min_speech_after_start=1.8,
+            threshold_boost=3.0,
+            on_frame=gate.feed if gate else downstream,
+            on_silence_start=(gate.guard(speculative.submit) if gate else speculative.submit) if speculative else None,
+            on_speech_resume=speculative.discard if speculative else None,
+            cancel_event=stop_rec,
+            on_cancel=on_cancel,
+        )
+        t_vad_end = TRACE.now()
+        if audio_pcm and gate is not None and not gate.opened:
+            print("⏭️ Ignored (no local wake word).")
+            on_cancel()
+            return None
+        if not audio_pcm:
+            print("⚠️  No audio recorded")
+            on_cancel()
+            return None
+        TRACE.record("capture", t_capture, t_vad_end)
+        TRACE.record("vad_end", t_vad_end)
+
+        try:
+            if stt_session is not None:
+                with TRACE.span("stt"):
+                    user_input = await run_blocking(stt_session.finish, on_cancel=stt_session.abort)
+            elif speculative is not None:
+                with TRACE.span("stt"):
+                    user_input = await run_blocking(speculative.result, audio_pcm, on_cancel=speculative.discard)
+            else:
+                with TRACE.span("wav_encode"):
+                    audio_wav = self.recorder.pcm_to_wav(audio_pcm)
+                with TRACE.span("stt"):
+                    user_input = await run_blocking(self.stt.transcribe, audio_wav)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            print(f"❌ STT error: {ex}")
+            return None
+
+        if isinstance(user_input, dict):
+            return user_input.get('text', '')
+        return str(user_input)
+
+    async def _speak(self, text) -> bool:
+        """Speak a reply (str or sentence iterator); cancellation stops playback at once."""
+        if not text:
+            return True
+        self.speech.stop()
+        print("🔊 Playing response...")
+        finished = await run_blocking(self.speech.speak, text, on_cancel=self.speech.stop)
+        print("✅ Playback finished\n" if finished else "⏹️ Playback stopped\n")
+        return finished
+
+    def _ai_sentences(self, prompt_text: str):
+        for sentence in self.n8n.chat_sentences(self.user_id, prompt_text):
+            print(f"🤖 AI: {sentence}")
+            yield sentence
+
+    async def _cue(self, path: str) -> None:
+        await run_blocking(self.audio_player.play_blocking, path, on_cancel=self.audio_player.stop_current)
+
+    # ---------------- Barge-in ----------------
+
+    def _start_barge_in(self) -> None:
+        if not self.allow_interruption or self._barge_in_task is not None:
+            return
+        self._barge_in_task = asyncio.create_task(self._barge_in_listener(), name="BargeIn")
+
+    async def _stop_barge_in(self) -> None:
+        task, self._barge_in_task = self._barge_in_task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _barge_in_listener(self) -> None:
+        """
+        Short-window listener for 'stop' (with/without wake word) while the
+        turn waits for AI or speaks. Runs only while the turn allows it.
+        """
+        if self.spotter is not None:
+            await self._barge_in_spotter()
+            return
+        while True:
+            stop_rec = threading.Event()
+            try:
+                audio_buf = await run_blocking(
+                    self.recorder.record_until_silence,
+                    max_duration=1.3,
+                    noise_calib_duration=0.0,
+                    start_frames=2,
+                    end_frames=8,
+                    post_silence_hold=0.0,
+                    pre_roll_ms=200,
+                    min_speech_after_start=0.2,
+                    threshold_boost=0.0,
+                    on_frame=self._ducker(),
+                    cancel_event=stop_rec,
+                    on_cancel=stop_rec.set,
+                )
+            finally:
+                self.audio_player.set_channel_gain(CHANNEL_SPEECH, 1.0)
+            if not audio_buf:
+                await asyncio.sleep(0.05)
+                continue
+
+            try:
+                partial = await run_blocking(self.stt.transcribe, self.recorder.pcm_to_wav(audio_buf))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                continue
+            if isinstance(partial, dict):
+                partial = partial.get('text', '')
+            if not partial:
+                continue
+
+            if self.stop_detector.is_stop_with_optional_wake(partial):
+                print("🛑 BARGE-IN: stop detected (with/without wake).")
+                self._barge_in_task = None   # الـ Turn سيتوقف، لا داعي لإلغاء نفسنا
+                self.interrupt()
+                return
+
+
+    def _ducker(self) -> Optional[Callable[[bytes], None]]:
+        """on_frame hook: duck the robot's voice on the first voiced chunks (before STT)."""
+        if self.recorder.echo is None:
+            return None     # بدون AEC صدى الروبوت نفسه يتخطى العتبة
+        return barge_in_ducker(self.audio_player,
+                               float(getattr(self.config, "BARGE_IN_DUCK_GAIN", 1.0)),
+                               float(getattr(self.config, "BARGE_IN_DUCK_RMS", 250.0)))
+
+    async def _barge_in_spotter(self) -> None:
+        """Barge-in on the local spotter: nothing goes to STT without a keyword hit."""
+        spotter = self.spotter.clone()
+        reader = self.recorder.reader()
+        stop_read = threading.Event()
+
+        def wait_for_keyword():
+            while not stop_read.is_set():
+                data = reader.read(self.recorder.bytes_per_chunk, timeout=0.5)
+                if data:
+                    hit = spotter.feed(data)
+                    if hit is not None:
+                        return hit
+            return None
+
+        while True:
+            hit = await run_blocking(wait_for_keyword, on_cancel=stop_read.set)
+            if hit is None:
+                return
+            stop = hit.keyword in self.stop_keywords
+            if not stop and hit.keyword in self.wake_keywords:
+                stop_rec = threading.Event()
+                audio_buf = await run_blocking(
+                    self.recorder.record_until_silence,
+                    max_duration=1.5,
+                    noise_calib_duration=0.0,
+                    start_frames=2,
+                    end_frames=8,
+                    post_silence_hold=0.0,
+                    pre_roll_ms=1000,        # يشمل كلمة النداء نفسها
+                    min_speech_after_start=0.2,
+                    threshold_boost=0.0,
+                    cancel_event=stop_rec,
+                    on_cancel=stop_rec.set,
+                )
+                reader.skip_to_now()
+                if not audio_buf:
+                    continue
+                try:
+                    partial = await run_blocking(self.stt.transcribe, self.recorder.pcm_to_wav(audio_buf))
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    continue
+                if isinstance(partial, dict):
+                    partial = partial.get('text', '')
+                stop = bool(partial) and self.stop_detector.is_stop_with_optional_wake(partial)
+
+            if stop:
+                print(f"🛑 BARGE-IN: stop detected (local keyword '{hit.keyword}').")
+                self._barge_in_task = None
+                self.interrupt()
+                return
+
+
+def run_async_assistant(assistant: AsyncAssistant) -> None:
+    """Entry point used by main.py (blocks until Ctrl+C)."""
+    try:
+        asyncio.run(assistant.run())
+    except KeyboardInterrupt:
+        print("\n⛔ KeyboardInterrupt: stopping assistant.")
+        assistant.stop()
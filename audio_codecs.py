@@ -0,0 +1,529 @@
+# audio_codecs.py
+# -------------------------------------------------------------------
+# Compressed uploads for /stt (الصوت الخام 16-bit = 32 KB لكل ثانية على الـ Wi-Fi)
+# - Encoders متدفقة: feed(pcm) من on_frame أثناء التسجيل، ثم encode(pcm) في النهاية
+#   يعيد استخدام ما تم ترميزه ولا يرمّز إلا الذيل الجديد
+#     flac   lossless (~50–60%)            soundfile / libsndfile (اختياري)
+#     opus   Ogg/Opus ~25 kbps (~10%)      soundfile / libsndfile ≥ 1.0.29 (اختياري)
+#     adpcm  IMA-ADPCM داخل WAV (~25%)     audioop (stdlib ≤ 3.12 أو audioop-lts)
+#     ulaw   G.711 μ-law داخل WAV (50%)    NumPy فقط (متاح دائمًا)
+#     wav    PCM كما هو (الـ fallback)
+# - choose_codec(): تقاطع ما يدعمه السيرفر (GET /stt/formats) مع المتاح محليًا
+# - decode(): قراءة الرفع مرة أخرى → int16 (للـ stub والاختبارات)
+#
+#   python audio_codecs.py [mbps]   # benchmark: الحجم + زمن الرفع لكل codec
+# -------------------------------------------------------------------
+
+import io
+import struct
+import threading
+import warnings
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from pcm_buffer import BytesLike, PcmBuffer, WAV_HEADER_BYTES, as_wav_parts
+
+try:
+    import soundfile as sf
+    _HAS_SOUNDFILE = True
+except Exception:
+    _HAS_SOUNDFILE = False
+    sf = None  # type: ignore
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop
+    _HAS_AUDIOOP = True
+except Exception:
+    _HAS_AUDIOOP = False
+    audioop = None  # type: ignore
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_IMA_ADPCM = 0x0011
+
+
+class EncodedAudio(NamedTuple):
+    """One upload for /stt: payload pieces + multipart metadata."""
+    codec: str
+    parts: Tuple[BytesLike, ...]
+    filename: str
+    content_type: str
+    pcm_bytes: int                      # حجم الـ PCM الأصلي (للـ logs والنسبة)
+    wav: Tuple[BytesLike, ...] = ()     # نفس الصوت كـ WAV (header + view) لو رفض السيرفر الـ codec
+
+    @property
+    def size(self) -> int:
+        return sum(len(p) for p in self.parts)
+
+
+# ==================== WAV helpers ====================
+
+def wav_format_header(format_tag: int, rate: int, channels: int, bits: int, block_align: int,
+                      byte_rate: int, data_bytes: int, frames: int, extra: bytes = b"") -> bytes:
+    """RIFF header for non-PCM WAV: fmt (with cbSize + extra) + fact + data."""
+    fmt = struct.pack("<HHIIHHH", format_tag, channels, rate, byte_rate, block_align, bits, len(extra)) + extra
+    fact = struct.pack("<4sII", b"fact", 4, frames)
+    riff_size = 4 + (8 + len(fmt)) + len(fact) + 8 + data_bytes
+    return (struct.pack("<4sI4s4sI", b"RIFF", riff_size, b"WAVE", b"fmt ", len(fmt)) + fmt + fact
+            + struct.pack("<4sI", b"data", data_bytes))
+
+
+def split_wav(parts: Tuple[BytesLike, ...]) -> Optional[Tuple[int, int, int, BytesLike]]:
+    """
+    (rate, width, channels, pcm view) of a canonical 44-byte PCM WAV
+    (pcm_to_wav / PcmBuffer.wav() / (header, pcm) parts), else None.
+    """
+    if not parts:
+        return None
+    head = bytes(parts[0][:WAV_HEADER_BYTES])
+    if len(head) < WAV_HEADER_BYTES:
+        return None
+    riff, _size, wave, fmt, fmt_len, tag, channels, rate, _br, _ba, bits, data, _n = struct.unpack(
+        "<4sI4s4sIHHIIHH4sI", head)
+    if (riff, wave, fmt, data) != (b"RIFF", b"WAVE", b"fmt ", b"data") or fmt_len != 16 or tag != WAVE_FORMAT_PCM:
+        return None
+    if len(parts) == 1:
+        pcm = memoryview(parts[0])[WAV_HEADER_BYTES:]
+    elif len(parts) == 2 and len(parts[0]) == WAV_HEADER_BYTES:
+        pcm = parts[1]
+    else:
+        return None
+    return rate, bits // 8, channels, pcm
+
+
+def _pcm_view(pcm) -> BytesLike:
+    return pcm.pcm() if isinstance(pcm, PcmBuffer) else pcm
+
+
+# ==================== Encoders ====================
+
+class AudioEncoder:
+    """
+    Streaming encoder for one utterance.
+
+        enc = create_encoder("adpcm", 16000)
+        recorder.record_until_silence(on_frame=enc.feed, ...)   # الترميز أثناء الكلام
+        upload = enc.encode(pcm)                                # الذيل فقط
+
+    `encode(pcm)` may be called for a snapshot (speculative STT) and again for
+    the final audio; chunks given to feed() must be the start of `pcm`
+    (هذا ما يضمنه record_until_silence: on_frame = محتوى الـ buffer بالترتيب).
+    """
+
+    name = "wav"
+    extension = "wav"
+    content_type = "audio/wav"
+
+    def __init__(self, rate: int = 16000, width: int = 2, channels: int = 1):
+        self.rate = rate
+        self.width = width
+        self.channels = channels
+        self.frame_bytes = width * channels
+        self._lock = threading.Lock()
+        self.fed_bytes = 0
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    @classmethod
+    def supports(cls, rate: int, width: int, channels: int) -> bool:
+        return True
+
+    def feed(self, pcm: BytesLike) -> None:
+        """on_frame hook: encode while recording."""
+        if not pcm:
+            return
+        with self._lock:
+            self._feed(pcm)
+            self.fed_bytes += len(pcm)
+
+    def encode(self, pcm) -> EncodedAudio:
+        pcm = _pcm_view(pcm)
+        with self._lock:
+            parts = self._encode(pcm)
+        return EncodedAudio(self.name, parts, f"audio.{self.extension}", self.content_type, len(pcm),
+                            as_wav_parts(pcm, self.rate, self.width, self.channels))
+
+    def _feed(self, pcm: BytesLike) -> None:
+        pass
+
+    def _encode(self, pcm: BytesLike) -> Tuple[BytesLike, ...]:
+        return as_wav_parts(pcm, self.rate, self.width, self.channels)
+
+
+class WavEncoder(AudioEncoder):
+    """No compression: header + the PCM view (zero-copy, pcm_buffer)."""
+
+
+class UlawEncoder(AudioEncoder):
+    """G.711 μ-law in WAV: 8 bits per sample, vectorized NumPy (no dependency)."""
+
+    name = "ulaw"
+
+    def __init__(self, rate: int = 16000, width: int = 2, channels: int = 1):
+        super().__init__(rate, width, channels)
+        self._out = bytearray()
+
+    @classmethod
+    def supports(cls, rate: int, width: int, channels: int) -> bool:
+        return width == 2
+
+    def _feed(self, pcm: BytesLike) -> None:
+        self._out += ulaw_encode(pcm)
+
+    def _encode(self, pcm: BytesLike) -> Tuple[BytesLike, ...]:
+        n = len(pcm) // 2
+        have = min(len(self._out), n)
+        # الجزء المرمّز أثناء التسجيل يُنسخ (bytes) حتى يبقى feed() قادرًا على التوسّع
+        data = bytes(memoryview(self._out)[:have]) + ulaw_encode(memoryview(pcm)[have * 2:n * 2])
+        header = wav_format_header(WAVE_FORMAT_MULAW, self.rate, self.channels, 8, self.channels,
+                                   self.rate * self.channels, len(data), n // self.channels)
+        return header, data
+
+
+class ImaAdpcmEncoder(AudioEncoder):
+    """
+    IMA-ADPCM in WAV (format 0x11): 4 bits per sample, mono.
+    audioop encodes (C); blocks are re-packed to the WAV layout (4-byte
+    header per block, low nibble first). The last block is padded with silence.
+    """
+
+    name = "adpcm"
+    block_align = 512
+
+    def __init__(self, rate: int = 16000, width: int = 2, channels: int = 1):
+        super().__init__(rate, width, channels)
+        self.samples_per_block = (self.block_align - 4) * 2 + 1
+        self._out = bytearray()          # blocks مكتملة
+        self._pending = bytearray()      # عيّنات لم تكمل block بعد
+        self._index = 0                  # step index في بداية الـ block التالي
+
+    @classmethod
+    def available(cls) -> bool:
+        return _HAS_AUDIOOP
+
+    @classmethod
+    def supports(cls, rate: int, width: int, channels: int) -> bool:
+        return width == 2 and channels == 1
+
+    def _feed(self, pcm: BytesLike) -> None:
+        self._pending += pcm
+        block_bytes = self.samples_per_block * 2
+        full = len(self._pending) // block_bytes * block_bytes
+        if full:
+            data, self._index = self._blocks(self._pending[:full], self._index)
+            self._out += data
+            del self._pending[:full]
+
+    def _encode(self, pcm: BytesLike) -> Tuple[BytesLike, ...]:
+        n = len(pcm) // 2
+        spb = self.samples_per_block
+        done = min(len(self._out) // self.block_align, n // spb)
+        if done * self.block_align < len(self._out):
+            # snapshot أقصر مما رُمّز: step index موجود في هيدر الـ block التالي
+            index = self._out[done * self.block_align + 2]
+        else:
+            index = self._index
+        tail, _ = self._blocks(memoryview(pcm)[done * spb * 2:n * 2], index, pad=True)
+        data = bytes(memoryview(self._out)[:done * self.block_align]) + tail
+        extra = struct.pack("<H", spb)
+        header = wav_format_header(WAVE_FORMAT_IMA_ADPCM, self.rate, 1, 4, self.block_align,
+                                   self.rate * self.block_align // spb, len(data), n, extra)
+        return header, data
+
+    def _blocks(self, pcm: BytesLike, index: int, pad: bool = False) -> Tuple[bytes, int]:
+        spb = self.samples_per_block
+        block_bytes = spb * 2
+        out = []
+        for off in range(0, len(pcm), block_bytes):
+            block = bytes(pcm[off:off + block_bytes])
+            if len(block) < block_bytes:
+                if not pad:
+                    break
+                block += b"\x00" * (block_bytes - len(block))
+            first = struct.unpack_from("<h", block)[0]
+            # الهيدر: أول عيّنة كما هي + step index في بداية الـ block
+            out.append(struct.pack("<hBB", first, index, 0))
+            data, (_pred, index) = audioop.lin2adpcm(block[2:], 2, (first, index))
+            out.append(data.translate(_NIBBLE_SWAP))
+        return b"".join(out), index
+
+
+class _SoundFileEncoder(AudioEncoder):
+    """
+    libsndfile containers (FLAC / Ogg-Opus) written into memory while recording.
+    The file is finalized by encode() when it covers everything fed; a
+    snapshot shorter than that (or a second encode) is encoded in one go.
+    """
+
+    sf_format = ""
+    sf_subtype = ""
+    compression_level: Optional[float] = None
+
+    def __init__(self, rate: int = 16000, width: int = 2, channels: int = 1):
+        super().__init__(rate, width, channels)
+        self._io: Optional[io.BytesIO] = io.BytesIO()
+        self._sf = self._open(self._io)
+
+    @classmethod
+    def available(cls) -> bool:
+        return _HAS_SOUNDFILE and cls.sf_subtype in sf.available_subtypes(cls.sf_format)
+
+    @classmethod
+    def supports(cls, rate: int, width: int, channels: int) -> bool:
+        return width == 2
+
+    def _open(self, buf: io.BytesIO):
+        kwargs = {}
+        if self.compression_level is not None:
+            kwargs["compression_level"] = self.compression_level
+        return sf.SoundFile(buf, "w", samplerate=self.rate, channels=self.channels,
+                            format=self.sf_format, subtype=self.sf_subtype, **kwargs)
+
+    def _feed(self, pcm: BytesLike) -> None:
+        if self._sf is not None:
+            self._sf.buffer_write(pcm, dtype="int16")
+
+    def _encode(self, pcm: BytesLike) -> Tuple[BytesLike, ...]:
+        if self._sf is not None and self.fed_bytes == len(pcm):
+            self._sf.close()
+            data = self._io.getvalue()
+            # الملف أُغلق: أي feed لاحق يُتجاهل، و encode التالي يرمّز من البداية
+            self._sf = None
+            self._io = None
+            return (data,)
+        buf = io.BytesIO()
+        with self._open(buf) as f:
+            f.buffer_write(pcm, dtype="int16")
+        return (buf.getvalue(),)
+
+
+class FlacEncoder(_SoundFileEncoder):
+    """Lossless FLAC (speech ≈ 50–60% of PCM)."""
+
+    name = "flac"
+    extension = "flac"
+    content_type = "audio/flac"
+    sf_format = "FLAC"
+    sf_subtype = "PCM_16"
+
+
+class OpusEncoder(_SoundFileEncoder):
+    """Ogg/Opus (lossy, very small; libsndfile accepts 8/12/16/24/48 kHz)."""
+
+    name = "opus"
+    extension = "ogg"
+    content_type = "audio/ogg"
+    sf_format = "OGG"
+    sf_subtype = "OPUS"
+    # 0 = أعلى bitrate، 1 = أقل — 0.9 ≈ 25 kbps للكلام (0.7 ≈ 80 kbps)
+    compression_level = 0.9
+
+    @classmethod
+    def supports(cls, rate: int, width: int, channels: int) -> bool:
+        return width == 2 and rate in (8000, 12000, 16000, 24000, 48000)
+
+
+# ==================== μ-law / ADPCM primitives ====================
+
+# audioop يضع أول عيّنة في الـ nibble العلوي، WAV IMA-ADPCM في السفلي
+_NIBBLE_SWAP = bytes(((b & 0x0F) << 4) | (b >> 4) for b in range(256))
+
+_ULAW_BIAS = 0x84
+_ULAW_CLIP = 8159       # بعد الإزاحة إلى 14 bit (نفس خوارزمية g711.c / audioop)
+
+
+def ulaw_encode(pcm: BytesLike) -> bytes:
+    """16-bit PCM → G.711 μ-law bytes (NumPy, bit-exact with audioop.lin2ulaw)."""
+    x = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // 2).astype(np.int32) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    mag = np.minimum(np.abs(x), _ULAW_CLIP) + (_ULAW_BIAS >> 2)
+    seg = np.maximum(np.frexp(mag)[1] - 6, 0)        # bit_length - 6 → segment
+    uval = np.where(seg > 7, 0x7F, (seg << 4) | ((mag >> (seg + 1)) & 0x0F))
+    return (uval ^ mask).astype(np.uint8).tobytes()
+
+
+def ulaw_decode(data: BytesLike) -> np.ndarray:
+    u = ~np.frombuffer(data, dtype=np.uint8).astype(np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    mag = (((u & 0x0F) << 3) + _ULAW_BIAS) << exponent
+    return np.where(u & 0x80, _ULAW_BIAS - mag, mag - _ULAW_BIAS).astype(np.int16)
+
+
+def adpcm_decode(data: BytesLike, block_align: int, frames: int) -> np.ndarray:
+    """WAV IMA-ADPCM (mono) → int16 (needs audioop)."""
+    out = []
+    for off in range(0, len(data), block_align):
+        block = bytes(data[off:off + block_align])
+        if len(block) < 4:
+            break
+        first, index = struct.unpack_from("<hB", block)
+        pcm, _ = audioop.adpcm2lin(block[4:].translate(_NIBBLE_SWAP), 2, (first, index))
+        out.append(struct.pack("<h", first) + pcm)
+    return np.frombuffer(b"".join(out), dtype=np.int16)[:frames]
+
+
+# ==================== Registry / negotiation ====================
+
+ENCODERS: Dict[str, type] = {
+    "wav": WavEncoder,
+    "flac": FlacEncoder,
+    "opus": OpusEncoder,
+    "adpcm": ImaAdpcmEncoder,
+    "ulaw": UlawEncoder,
+}
+
+# "auto": lossless أولًا ثم الأصغر؛ opus يُطلب صراحة (lossy بمعدل منخفض)
+AUTO_ORDER = ("flac", "adpcm", "ulaw")
+
+
+def local_codecs(rate: int = 16000, width: int = 2, channels: int = 1) -> List[str]:
+    """Codecs this machine can encode for the given capture format."""
+    return [name for name, cls in ENCODERS.items() if cls.available() and cls.supports(rate, width, channels)]
+
+
+def choose_codec(preferred: str, server_formats: Iterable[str], rate: int = 16000, width: int = 2,
+                 channels: int = 1) -> str:
+    """
+    preferred = "auto" | codec name | comma list (بالترتيب).
+    Picks the first one both the server and this machine support, else "wav".
+    """
+    server = {str(f).strip().lower() for f in server_formats or ()}
+    local = set(local_codecs(rate, width, channels))
+    preferred = (preferred or "auto").strip().lower()
+    order = AUTO_ORDER if preferred == "auto" else tuple(p.strip() for p in preferred.split(",") if p.strip())
+    for name in order:
+        if name in server and name in local:
+            return name
+    return "wav"
+
+
+def create_encoder(name: str, rate: int = 16000, width: int = 2, channels: int = 1) -> AudioEncoder:
+    cls = ENCODERS.get(name, WavEncoder)
+    if not (cls.available() and cls.supports(rate, width, channels)):
+        cls = WavEncoder
+    return cls(rate, width, channels)
+
+
+# ==================== Decoding (stub server / checks) ====================
+
+def decode(data: BytesLike) -> Tuple[np.ndarray, int]:
+    """Any upload produced here → (int16 mono samples, rate)."""
+    head = bytes(data[:4])
+    if head == b"RIFF":
+        return _decode_wav(data)
+    if not _HAS_SOUNDFILE:
+        raise ValueError("soundfile is required to decode FLAC / Opus")
+    x, rate = sf.read(io.BytesIO(bytes(data)), dtype="int16", always_2d=True)
+    return x[:, 0].copy(), rate
+
+
+def _decode_wav(data: BytesLike) -> Tuple[np.ndarray, int]:
+    view = memoryview(data)
+    pos = 12
+    fmt = None
+    frames = None
+    while pos + 8 <= len(view):
+        cid, size = struct.unpack_from("<4sI", view, pos)
+        body = view[pos + 8:pos + 8 + size]
+        if cid == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", body)
+        elif cid == b"fact":
+            frames = struct.unpack_from("<I", body)[0]
+        elif cid == b"data":
+            if fmt is None:
+                break
+            tag, channels, rate, _br, block_align, bits = fmt
+            if tag == WAVE_FORMAT_PCM and bits == 16:
+                x = np.frombuffer(body, dtype=np.int16)
+            elif tag == WAVE_FORMAT_MULAW:
+                x = ulaw_decode(body)
+            elif tag == WAVE_FORMAT_IMA_ADPCM:
+                x = adpcm_decode(body, block_align, frames if frames is not None else len(body) * 2)
+            else:
+                raise ValueError(f"Unsupported WAV format tag 0x{tag:04x}")
+            return x[::channels].copy(), rate
+        pos += 8 + size + (size & 1)
+    raise ValueError("Invalid WAV data")
+
+
+# ==================== Benchmark ====================
+
+if __name__ == "__main__":
+    import glob
+    import os
+    import sys
+    import time
+
+    from Config import Config
+    from speech_to_text import SpeechToText
+    from stub_server import StubApiServer
+    from vad import _load_wav_16k
+
+    mbps = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0     # Pi Zero W على 2.4 GHz: ~2–8 Mbit/s فعليًا
+    rate, chunk, seconds = 16000, 320, 25.0
+    res_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Resources")
+    clips = [_load_wav_16k(p, rate) for p in sorted(glob.glob(os.path.join(res_dir, "**", "*.wav"), recursive=True))
+             if "bell" not in p.lower()]
+    speech = np.concatenate(clips) if clips else np.zeros(rate, dtype=np.int16)
+    speech = np.tile(speech, int(np.ceil(seconds * rate / len(speech))))[:int(seconds * rate)]
+    pcm = speech.tobytes()
+    step = chunk * 2
+
+    def snr_db(ref: np.ndarray, out: np.ndarray) -> float:
+        n = min(len(ref), len(out))
+        err = ref[:n].astype(np.float64) - out[:n]
+        return 10 * np.log10(np.sum(ref[:n].astype(np.float64) ** 2) / max(1e-9, np.sum(err ** 2)))
+
+    print("=" * 92)
+    print(f"🗜️ {seconds:.0f}s utterance @ {rate} Hz (PCM {len(pcm) / 1e3:.0f} KB), upload at {mbps:g} Mbit/s")
+    print("=" * 92)
+    print(f"   {'codec':<6} {'size':>9} {'ratio':>6} {'feed CPU':>13} {'tail':>8} {'one-shot':>9} "
+          f"{'upload':>9} {'SNR':>9}")
+    codecs = local_codecs(rate, 2, 1)
+    for name in codecs:
+        enc = create_encoder(name, rate)
+        t0 = time.process_time()
+        for i in range(0, len(pcm), step):
+            enc.feed(pcm[i:i + step])
+        feed_cpu = (time.process_time() - t0) / seconds * 1000
+        t0 = time.perf_counter()
+        upload = enc.encode(pcm)                 # بعد نهاية الكلام: الذيل فقط
+        tail_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        create_encoder(name, rate).encode(pcm)   # بدون ترميز أثناء التسجيل
+        oneshot_ms = (time.perf_counter() - t0) * 1000
+        data = b"".join(bytes(p) for p in upload.parts)
+        upload_ms = len(data) * 8 / (mbps * 1e6) * 1000
+        quality = "lossless" if name in ("wav", "flac") else (
+            "perceptual" if name == "opus" else f"{snr_db(speech, decode(data)[0]):.1f} dB")
+        print(f"   {name:<6} {len(data) / 1e3:7.0f}KB {len(data) / len(pcm):6.2f} {feed_cpu:7.2f} ms/s "
+              f"{tail_ms:6.1f}ms {oneshot_ms:7.1f}ms {upload_ms:7.0f}ms {quality:>10}")
+    missing = [n for n in ENCODERS if n not in codecs]
+    if missing:
+        print(f"   (not available here: {', '.join(missing)} — pip install soundfile / audioop-lts)")
+
+    # End-to-end: stub على localhost مع تحديد سرعة الرفع، من نهاية الكلام حتى النص
+    print(f"\n   end of speech → transcript (stub /stt, {mbps:g} Mbit/s, encoder fed while recording):")
+    with StubApiServer(upload_bytes_per_sec=mbps * 1e6 / 8) as srv:
+        for name in codecs:
+            cfg = Config()
+            cfg.SERVER_API_URL = srv.url
+            cfg.STT_UPLOAD_CODEC = name
+            stt = SpeechToText(cfg)
+            stt.server_formats()
+            # نفس مسار SpeculativeTranscriber (الـ classes من speech_to_text وليس __main__)
+            enc = stt.capture_encoder(rate)
+            for i in range(0, len(pcm), step):
+                if enc is not None:
+                    enc.feed(pcm[i:i + step])
+            t0 = time.perf_counter()
+            stt.transcribe(stt.prepare_upload(pcm, rate, encoder=enc))
+            total = (time.perf_counter() - t0) * 1000
+            print(f"   {name:<6} {total:7.0f} ms   (server got {srv.last_stt['format']}, "
+                  f"{srv.last_stt['bytes'] / 1e3:.0f} KB, {srv.last_stt['seconds']:.1f}s of audio)")
+    print("=" * 92)
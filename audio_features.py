@@ -0,0 +1,201 @@
+# audio_features.py
+# -------------------------------------------------------------------
+# Block-level audio features with NumPy (بديل audioop — محذوف في Python 3.13)
+# - frame_view(): strided view (n_frames, frame_len) على نفس الذاكرة، بدون نسخ
+#   (hop < frame_len → إطارات متداخلة عبر as_strided)
+# - rms / power_spectrum / magnitude_spectrum / spectral_flux: صف واحد لكل إطار،
+#   كل الإطارات في استدعاء NumPy واحد بدل حلقة Python لكل chunk (SpectralVad)
+# - chunk_rms(): RMS لقائمة chunks دفعة واحدة (معايرة الـ VAD، noise floor)
+# - mix_into() / gain_ramp(): gain + جمع داخل buffer الـ mixer بدون مصفوفات مؤقتة (AudioPlayer)
+#
+#   python audio_features.py      # benchmark مقابل audioop على chunks من 320 عيّنة
+# -------------------------------------------------------------------
+
+from functools import lru_cache
+from typing import Optional, Sequence, Union
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+# ==================== Framing ====================
+
+def samples(pcm: BytesLike, width: int = 2, channels: int = 1) -> np.ndarray:
+    """Raw PCM → 1-D sample view (first channel only when interleaved; no copy)."""
+    dtype = SAMPLE_DTYPES.get(width)
+    if dtype is None:
+        raise ValueError(f"Unsupported sample width: {width}")
+    usable = len(pcm) - len(pcm) % (width * channels)
+    x = np.frombuffer(pcm, dtype=dtype, count=usable // width)
+    return x[::channels] if channels > 1 else x
+
+
+def frame_view(x: np.ndarray, frame_len: int, hop: Optional[int] = None) -> np.ndarray:
+    """
+    (n_frames, frame_len) strided view of a 1-D array (read-only, no copy).
+    The tail shorter than one frame is left out.
+    """
+    hop = hop or frame_len
+    if frame_len <= 0 or hop <= 0:
+        raise ValueError("frame_len and hop must be positive")
+    n = 0 if len(x) < frame_len else 1 + (len(x) - frame_len) // hop
+    stride = x.strides[0]
+    return as_strided(x, shape=(n, frame_len), strides=(hop * stride, stride), writeable=False)
+
+
+# ==================== Features (one value per frame) ====================
+
+def rms(block: np.ndarray) -> np.ndarray:
+    """Root mean square per row (1-D input → shape (1,))."""
+    block = np.atleast_2d(block)
+    if block.shape[1] == 0:
+        return np.zeros(block.shape[0])
+    # float32: أسرع 3× من تجميع float64، والخطأ النسبي ~1e-5 (يكفي لمستويات الصوت)
+    x = block.astype(np.float32) if block.dtype != np.float32 else block
+    return np.sqrt(np.einsum("ij,ij->i", x, x) / block.shape[1])
+
+
+def unit_rows(x: np.ndarray) -> np.ndarray:
+    """Each row scaled to unit L2 norm (in place for float arrays)."""
+    x /= np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-9)
+    return x
+
+
+@lru_cache(maxsize=8)
+def _hann(n: int) -> np.ndarray:
+    return np.hanning(n).astype(np.float32)
+
+
+def power_spectrum(block: np.ndarray, nfft: Optional[int] = None) -> np.ndarray:
+    """Hann-windowed |rfft|² per row (nfft = next power of two by default)."""
+    block = np.atleast_2d(block)
+    n = block.shape[1]
+    nfft = nfft or (1 << max(0, n - 1).bit_length())
+    spec = np.fft.rfft(block.astype(np.float32) * _hann(n), n=nfft, axis=1)
+    return spec.real ** 2 + spec.imag ** 2
+
+
+def magnitude_spectrum(block: np.ndarray, nfft: Optional[int] = None) -> np.ndarray:
+    """Hann-windowed |rfft| per row, L2-normalized (مستقل عن مستوى الصوت)."""
+    return unit_rows(np.sqrt(power_spectrum(block, nfft)))
+
+
+def spectral_flux(mag: np.ndarray, prev: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Positive change of normalized spectra (magnitude_spectrum rows) vs the
+    previous frame, per row (0 = stationary). `prev` = last row of the previous
+    block (للتدفق بين الكتل); without it the first frame scores 0.
+    """
+    if not len(mag):
+        return np.zeros(0)
+    before = np.vstack((prev if prev is not None else mag[:1], mag[:-1]))
+    return np.maximum(mag - before, 0.0).sum(axis=1)
+
+
+def chunk_rms(chunks: Sequence[BytesLike], width: int = 2) -> np.ndarray:
+    """
+    RMS of each chunk (بديل [audioop.rms(c, width) for c in chunks]).
+    Equal-length chunks → one join + one strided block; mixed lengths fall back per chunk.
+    """
+    if not chunks:
+        return np.zeros(0)
+    size = len(chunks[0])
+    if size and all(len(c) == size for c in chunks):
+        x = samples(b"".join(chunks), width)
+        return rms(frame_view(x, size // width))
+    return np.array([chunk_level(c, width) for c in chunks])
+
+
+def chunk_level(chunk: BytesLike, width: int = 2) -> float:
+    """RMS of one chunk as a float (بديل audioop.rms لـ chunk واحد)."""
+    n = len(chunk) // width
+    if not n:
+        return 0.0
+    # مسار مختصر: استدعاء لكل chunk في حلقة الالتقاط → أقل عدد من استدعاءات NumPy
+    x = np.frombuffer(chunk, dtype=SAMPLE_DTYPES[width], count=n).astype(np.float32)
+    return (float(x @ x) / n) ** 0.5
+
+
+# ==================== Gain ====================
+
+def gain_ramp(start: float, end: float, n: int) -> np.ndarray:
+    """Linear gain ramp (n, 1) — يتفادى الطقطقة عند تغيير الـ gain بين الكتل."""
+    return np.linspace(start, end, n, dtype=np.float32)[:, None]
+
+
+def mix_into(dst: np.ndarray, src: np.ndarray, gain: float = 1.0,
+             ramp: Optional[np.ndarray] = None, scratch: Optional[np.ndarray] = None) -> None:
+    """
+    dst += src × gain (× ramp), float32 (frames, channels).
+    `src` is never modified (قد يكون view على clip مخزّن); `scratch` (≥ src)
+    avoids allocating a temporary per call.
+    """
+    n = len(src)
+    if not n:
+        return
+    if ramp is None and gain == 1.0:
+        dst[:n] += src
+        return
+    tmp = scratch[:n] if scratch is not None and len(scratch) >= n and scratch.shape[1:] == src.shape[1:] \
+        else np.empty_like(src, dtype=np.float32)
+    np.multiply(src, gain, out=tmp, casting="unsafe")
+    if ramp is not None:
+        tmp *= ramp[:n]
+    dst[:n] += tmp
+
+
+# ==================== Benchmark ====================
+
+if __name__ == "__main__":
+    import time
+    import warnings
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        try:
+            import audioop
+        except ImportError:
+            audioop = None
+
+    rate, chunk = 16000, 320
+    seconds = 60
+    rng = np.random.default_rng(3)
+    t = np.arange(rate * seconds) / rate
+    sig = 3000 * np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 0.5 * t) > 0) + rng.normal(0, 200, len(t))
+    pcm = np.clip(sig, -32768, 32767).astype(np.int16).tobytes()
+    step = chunk * 2
+    chunks = [pcm[i:i + step] for i in range(0, len(pcm) - step + 1, step)]
+    print(f"🎚️ {seconds}s @ {rate} Hz → {len(chunks)} chunks of {chunk} samples")
+
+    def bench(label, fn, runs=5):
+        fn()
+        t0 = time.process_time()
+        for _ in range(runs):
+            out = fn()
+        us = (time.process_time() - t0) / runs / len(chunks) * 1e6
+        print(f"   {label:<40} {us:6.2f} µs/chunk")
+        return out
+
+    if audioop is not None:
+        ref_rms = bench("audioop.rms (per chunk)", lambda: [audioop.rms(c, 2) for c in chunks])
+        bench("audioop.mul ×0.5 (per chunk)", lambda: [audioop.mul(c, 2, 0.5) for c in chunks])
+    else:
+        ref_rms = None
+        print("   (audioop not available on this Python — NumPy only)")
+    bench("chunk_level (per chunk)", lambda: [chunk_level(c) for c in chunks])
+    got = bench("chunk_rms (batched)", lambda: chunk_rms(chunks))
+    block = frame_view(samples(pcm), chunk)
+    bench("magnitude_spectrum + spectral_flux (batched)", lambda: spectral_flux(magnitude_spectrum(block)))
+    out = np.zeros((len(pcm) // 2, 1), dtype=np.float32)
+    src = samples(pcm).astype(np.float32)[:, None]
+    scratch = np.empty_like(src)
+    bench("mix_into ×0.5 (whole block, mixer path)", lambda: mix_into(out, src, 0.5, scratch=scratch))
+
+    if ref_rms is not None:
+        err = np.max(np.abs(np.asarray(ref_rms, dtype=np.float64) - got))
+        # audioop يقرّب لأسفل إلى int → الفرق < 1
+        print(f"   max |audioop.rms - chunk_rms| = {err:.3f}")
@@ -2,28 +2,247 @@
 # -------------------------------------------------------------------
 # Unified audio playback (async + blocking) via a single worker thread
 # Uses PyAudio under the hood. Safe for concurrent calls.
+# - Sound effects are decoded once into memory (ClipCache / preload())
+# - One long-lived output stream (callback) + NumPy mixer:
+#   channels cue / speech / background تُجمع معًا بـ gain لكل صوت،
+#   والـ background ينخفض (ducking) أثناء الكلام أو الـ cues
+# - Job sources: WAV path / PCM أو WAV bytes في الذاكرة / chunks متدفقة (TTS)
 # -------------------------------------------------------------------
 
 from __future__ import annotations
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
 from threading import Event, Thread, Lock
 from queue import Queue, Empty
-from typing import Optional
+from typing import Iterable, Optional, Union
+import glob
+import io
+import struct
 import time
 import os
 import wave
-import audioop  # لخفض/رفع الصوت برمجيًا بدون numpy
+import numpy as np
 import pyaudio
 
+from audio_features import chunk_level, gain_ramp, mix_into
+from resampler import PolyphaseResampler, downmix
+from echo_canceller import PlaybackReference
+
+
+# Mixer channels: كل channel طابور FIFO (تشغيل بالترتيب)، والـ channels تُجمع معًا
+CHANNEL_CUE = "cue"
+CHANNEL_SPEECH = "speech"
+CHANNEL_BACKGROUND = "background"
+CHANNELS = (CHANNEL_CUE, CHANNEL_SPEECH, CHANNEL_BACKGROUND)
+
 
 @dataclass
 class AudioJob:
     path: str
     blocking: bool = False          # True => caller waits until done
     volume: float = 1.0             # 0.0 .. 1.0
+    channel: str = CHANNEL_CUE      # mixer channel
+    clip: Optional["AudioClip"] = None   # in-memory source (بدل path)
     done: Event = field(default_factory=Event)
     # يُستخدم لإلغاء الحالية عند المقاطعة
     canceled: Event = field(default_factory=Event)
+    # أول عيّنة وصلت للسماعة
+    started: Event = field(default_factory=Event)
+    started_at: Optional[float] = None  # time.monotonic() المتوقع لسماع أول عيّنة
+
+
+@dataclass
+class AudioClip:
+    """Decoded WAV kept in memory (PCM + format)."""
+    path: str
+    pcm: bytes
+    sampwidth: int
+    channels: int
+    framerate: int
+    mtime: float = 0.0
+    # نسخ محوّلة لصيغة الجهاز: (rate, channels) -> float32 array
+    converted: dict = field(default_factory=dict, repr=False, compare=False)
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.sampwidth * self.channels
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / float(self.frame_bytes * self.framerate or 1)
+
+
+def clip_from_wav_bytes(wav_bytes: bytes, name: str = "<wav>") -> AudioClip:
+    """Decode in-memory WAV bytes (e.g. a TTS response)."""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        return AudioClip(
+            path=name,
+            pcm=wf.readframes(wf.getnframes()),
+            sampwidth=wf.getsampwidth(),
+            channels=wf.getnchannels(),
+            framerate=wf.getframerate(),
+        )
+
+
+def load_clip(path: str) -> AudioClip:
+    """Read + decode a WAV file (raises FileNotFoundError / wave.Error)."""
+    mtime = os.stat(path).st_mtime
+    with wave.open(path, "rb") as wf:
+        return AudioClip(
+            path=path,
+            pcm=wf.readframes(wf.getnframes()),
+            sampwidth=wf.getsampwidth(),
+            channels=wf.getnchannels(),
+            framerate=wf.getframerate(),
+            mtime=mtime,
+        )
+
+
+class PcmConverter:
+    """
+    Streaming int16 PCM → float32 (frames, channels) بصيغة الجهاز.
+    - mono ↔ stereo (downmix)
+    - resample polyphase (resampler.py) مع حفظ الحالة بين الـ chunks
+    - chunk مقطوع في منتصف frame يُكمل مع التالي
+    - flush() في النهاية يُخرج ذيل الـ filter
+    """
+
+    def __init__(self, src_rate: int, src_channels: int, dst_rate: int, dst_channels: int):
+        self.src_rate = src_rate
+        self.src_channels = src_channels
+        self.dst_rate = dst_rate
+        self.dst_channels = dst_channels
+        self._rs = PolyphaseResampler(src_rate, dst_rate, dst_channels)
+        self._tail = b""
+
+    def push(self, pcm: bytes) -> np.ndarray:
+        frame_bytes = 2 * self.src_channels
+        if self._tail:
+            pcm = self._tail + pcm
+        usable = len(pcm) - len(pcm) % frame_bytes
+        self._tail = bytes(pcm[usable:])
+        x = np.frombuffer(pcm, dtype=np.int16, count=usable // 2).reshape(-1, self.src_channels)
+        # downmix على int16 (أرخص) ثم float32 للـ filter/mixer
+        x = downmix(x, self.dst_channels).astype(np.float32)
+        return self._rs.process(x)
+
+    def flush(self) -> np.ndarray:
+        return self._rs.flush()
+
+
+class WavStreamParser:
+    """
+    Incremental WAV header parser for streamed responses.
+    feed() يرجع PCM بعد الـ header (ويتجاهل حجم data — سيرفرات البث تكتب 0/0xFFFFFFFF).
+    """
+
+    def __init__(self):
+        self._buf = b""
+        self.sample_rate: Optional[int] = None
+        self.channels: Optional[int] = None
+        self.sampwidth: Optional[int] = None
+        self.ready = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.ready:
+            return chunk
+        self._buf += chunk
+        buf = self._buf
+        if len(buf) < 12:
+            return b""
+        if buf[:4] != b"RIFF" or buf[8:12] != b"WAVE":
+            raise wave.Error("stream is not a RIFF/WAVE file")
+        pos = 12
+        while len(buf) >= pos + 8:
+            cid, size = buf[pos:pos + 4], struct.unpack("<I", buf[pos + 4:pos + 8])[0]
+            body = pos + 8
+            if cid == b"data":
+                if self.sample_rate is None:
+                    raise wave.Error("data chunk before fmt chunk")
+                self.ready = True
+                self._buf = b""
+                return buf[body:]
+            if len(buf) < body + size:
+                return b""
+            if cid == b"fmt ":
+                _, ch, rate, _, _, bits = struct.unpack("<HHIIHH", buf[body:body + 16])
+                self.channels, self.sample_rate, self.sampwidth = ch, rate, bits // 8
+            pos = body + size + (size & 1)
+        return b""
+
+
+class ClipCache:
+    """
+    In-memory WAV cache.
+    - preloaded clips (voice_msgs) تبقى دائمًا في الذاكرة
+    - المسارات الأخرى في LRU محدود (عدد + بايتات)
+    - لو تغيّر mtime للملف يُعاد تحميله تلقائيًا
+    """
+
+    def __init__(self, max_items: int = 32, max_bytes: int = 16 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._pinned: dict[str, AudioClip] = {}
+        self._lru: OrderedDict[str, AudioClip] = OrderedDict()
+        self._lru_bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    def preload(self, paths: Iterable[str]) -> int:
+        """Decode and pin clips; returns how many were loaded."""
+        count = 0
+        for path in paths:
+            try:
+                clip = load_clip(path)
+            except Exception as e:
+                print(f"⚠️ Preload failed for {path}: {e}")
+                continue
+            with self._lock:
+                self._pinned[self._key(path)] = clip
+            count += 1
+        return count
+
+    def get(self, path: str) -> AudioClip:
+        key = self._key(path)
+        mtime = os.stat(path).st_mtime          # FileNotFoundError لو اتحذف
+        with self._lock:
+            clip = self._pinned.get(key)
+            if clip is None:
+                clip = self._lru.get(key)
+                if clip is not None:
+                    self._lru.move_to_end(key)
+            if clip is not None and clip.mtime == mtime:
+                self.hits += 1
+                return clip
+
+        # miss أو الملف اتغير → decode خارج القفل
+        self.misses += 1
+        clip = load_clip(path)
+        with self._lock:
+            if key in self._pinned:
+                self._pinned[key] = clip
+            else:
+                old = self._lru.pop(key, None)
+                if old is not None:
+                    self._lru_bytes -= len(old.pcm)
+                if len(clip.pcm) <= self.max_bytes:
+                    self._lru[key] = clip
+                    self._lru_bytes += len(clip.pcm)
+                    while len(self._lru) > self.max_items or self._lru_bytes > self.max_bytes:
+                        _, evicted = self._lru.popitem(last=False)
+                        self._lru_bytes -= len(evicted.pcm)
+        return clip
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pinned.clear()
+            self._lru.clear()
+            self._lru_bytes = 0
 
 
 class AudioPlayer:
@@ -37,17 +256,30 @@ class AudioPlayer:
     ملاحظات:
       * احرص على استدعاء start() مرّة واحدة بعد الإنشاء.
       * يدعم ملفات WAV (PCM 16-bit LE) مباشرةً.
-      * لا يقوم بإعادة التشكيل Resample لتقليل الاستهلاك (أفضلية ملفات 16kHz mono).
+      * stream إخراج واحد مفتوح طول الوقت بصيغة (sample_rate, channels)؛
+        الملفات بصيغة أخرى تُحوَّل مرة واحدة (polyphase resample + downmix) وتُخزن مع الـ clip،
+        فلا يُعاد فتح الجهاز لصيغة جديدة أبدًا.
+      * preload(): فك ترميز ملفات الـ cues مرة واحدة؛ التشغيل بعدها من الذاكرة.
+      * channel="cue" / "speech" / "background": كل channel بالترتيب، والـ channels
+        تُجمع معًا (cue فوق الكلام بدون تنازع على جهاز ALSA).
+      * play_pcm / play_wav_bytes: مصدر في الذاكرة؛ play_stream: chunks متدفقة
+        (مثل رد TTS أثناء التحميل) تُشغّل فور وصول أول prebuffer.
+      * stop_current() يوقف كل المصادر (cues + TTS) — مسار إلغاء واحد.
     """
 
     def __init__(
         self,
-        sample_rate: int = 16000,   # تلميح/افتراضي فقط (لن نستخدمه لو الملف مختلف)
-        channels: int = 1,          # تلميح/افتراضي فقط
-        frames_per_buffer: int = 1024
+        sample_rate: int = 16000,   # صيغة الـ output stream الدائم
+        channels: int = 1,
+        frames_per_buffer: int = 1024,
+        cache_items: int = 32,
+        cache_bytes: int = 16 * 1024 * 1024,
+        duck_gain: float = 0.25,
+        stream_prebuffer_ms: int = 60
     ) -> None:
         self._queue: Queue[AudioJob] = Queue(maxsize=8)
         self._worker: Optional[Thread] = None
+        self._current_job: Optional[AudioJob] = None   # job يحوّله الـ worker الآن (لم يدخل الـ mixer بعد)
         self._running: bool = False
         self._lock = Lock()
 
@@ -56,7 +288,25 @@ class AudioPlayer:
         self._frames_per_buffer = frames_per_buffer
 
         self._pa: Optional[pyaudio.PyAudio] = None
-        self._current_job: Optional[AudioJob] = None
+        self._stream = None
+
+        # WAV مفكوك في الذاكرة (preload + LRU للمسارات الأخرى)
+        self.clips = ClipCache(max_items=cache_items, max_bytes=cache_bytes)
+
+        # ---- Mixer state (يُقرأ من callback الـ stream) ----
+        self._mix_lock = Lock()
+        self._voices: dict[str, deque] = {name: deque() for name in CHANNELS}
+        self.channel_gain: dict[str, float] = {name: 1.0 for name in CHANNELS}
+        self._gain_level = dict(self.channel_gain)   # آخر gain طُبّق فعليًا (للـ ramp)
+        self.duck_gain = duck_gain          # gain الـ background أثناء cue/speech
+        self._duck_level = 1.0
+        self.underflows = 0                 # output underflows (status flags)
+        self.stream_starved = 0             # stream voice ran dry mid-playback
+        self._prebuffer_frames = int(sample_rate * stream_prebuffer_ms / 1000)
+
+        # إشارة السماعة الفعلية لإلغاء الصدى (attach_reference)
+        self.reference: Optional[PlaybackReference] = None
+        self._out_latency = 0.0
 
         # آخر تشغيل لنفس الملف (لـ debounce اختياري)
         self._last_play_ts: dict[str, float] = {}
@@ -74,10 +324,34 @@ class AudioPlayer:
                 print(f"⚠️ PyAudio init failed: {e}")
                 self._pa = None
 
+            self._open_stream()
+
             self._running = True
             self._worker = Thread(target=self._run, name="AudioPlayerWorker", daemon=True)
             self._worker.start()
 
+    def _open_stream(self) -> None:
+        """Open the single long-lived output stream (callback mode)."""
+        if self._pa is None:
+            return
+        try:
+            self._stream = self._pa.open(
+                format=pyaudio.paInt16,
+                channels=self._channels,
+                rate=self._sample_rate,
+                output=True,
+                frames_per_buffer=self._frames_per_buffer,
+                stream_callback=self._callback
+            )
+            try:
+                self._out_latency = float(self._stream.get_output_latency())
+            except Exception:
+                self._out_latency = 0.0
+            self._stream.start_stream()
+        except Exception as e:
+            print(f"❌ Cannot open audio stream: {e}")
+            self._stream = None
+
     def shutdown(self, join_timeout: float = 2.0) -> None:
         # أوقف الثريد
         with self._lock:
@@ -92,7 +366,22 @@ class AudioPlayer:
         if self._worker and self._worker.is_alive():
             self._worker.join(timeout=join_timeout)
 
-        # اغلق PyAudio
+        # أوقف كل الأصوات وحرّر المنتظرين
+        self.stop_current()
+
+        # اغلق الـ stream ثم PyAudio
+        try:
+            if self._stream is not None:
+                try:
+                    self._stream.stop_stream()
+                except:
+                    pass
+                self._stream.close()
+        except:
+            pass
+        finally:
+            self._stream = None
+
         try:
             if self._pa is not None:
                 self._pa.terminate()
@@ -103,50 +392,176 @@ class AudioPlayer:
 
     # ---------------- Public API ----------------
 
-    def play_async(self, path: str, volume: float = 1.0) -> AudioJob:
+    def preload(self, paths: Union[str, Iterable[str]] = "Resources/voice_msgs") -> int:
+        """
+        Decode WAVs once into memory (directory → all *.wav inside).
+        يُستدعى عند الإقلاع حتى لا يفتح bell/thinking/got_it الملف كل مرة.
+        """
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(os.path.join(paths, "*.wav"))) if os.path.isdir(paths) else [paths]
+        paths = list(paths)
+        count = self.clips.preload(paths)
+        # حوّل لصيغة الجهاز مسبقًا أيضًا
+        for path in paths:
+            try:
+                self._device_samples(self.clips.get(path))
+            except Exception:
+                pass
+        print(f"✅ Preloaded {count} audio clips")
+        return count
+
+    def play_async(self, path: str, volume: float = 1.0, channel: str = CHANNEL_CUE) -> AudioJob:
         """شغّل الصوت في الخلفية (لا يحجب التنفيذ)."""
         if not path:
             return AudioJob(path="")
         if self._debounced(path):
             # تجاهل السبام السريع لنفس الملف
             return AudioJob(path=path, blocking=False)
-        job = AudioJob(path=path, blocking=False, volume=max(0.0, min(1.0, volume)))
+        job = AudioJob(path=path, blocking=False, volume=max(0.0, min(1.0, volume)), channel=channel)
         self._safe_put(job)
         return job
 
-    def play_blocking(self, path: str, volume: float = 1.0, timeout: Optional[float] = None) -> bool:
+    def play_blocking(self, path: str, volume: float = 1.0, timeout: Optional[float] = None,
+                      channel: str = CHANNEL_CUE) -> bool:
         """شغّل الصوت وانتظر حتى نهايته (أو حتى timeout)."""
         if not path:
             return True
-        job = AudioJob(path=path, blocking=True, volume=max(0.0, min(1.0, volume)))
+        job = AudioJob(path=path, blocking=True, volume=max(0.0, min(1.0, volume)), channel=channel)
         self._safe_put(job)
         job.done.wait(timeout=timeout)
         return job.done.is_set()
 
-    def stop_current(self) -> None:
-        """إيقاف فوري لأي صوت جارٍ + إلغاء الـ job الجاري."""
-        # علّم المهمة الحالية أنها مُلغاة
-        cj = self._current_job
-        if cj is not None:
-            cj.canceled.set()
+    def play_pcm(self, pcm: bytes, sample_rate: int, channels: int = 1, volume: float = 1.0,
+                 channel: str = CHANNEL_SPEECH, blocking: bool = False,
+                 timeout: Optional[float] = None) -> AudioJob:
+        """شغّل PCM 16-bit من الذاكرة (blocking=True ينتظر النهاية)."""
+        clip = AudioClip(path="<pcm>", pcm=pcm, sampwidth=2, channels=channels, framerate=sample_rate)
+        return self._play_clip(clip, volume, channel, blocking, timeout)
+
+    def play_wav_bytes(self, wav_bytes: bytes, volume: float = 1.0, channel: str = CHANNEL_SPEECH,
+                       blocking: bool = False, timeout: Optional[float] = None) -> AudioJob:
+        """شغّل ملف WAV كامل موجود في الذاكرة."""
+        return self._play_clip(clip_from_wav_bytes(wav_bytes), volume, channel, blocking, timeout)
+
+    def play_stream(self, chunks: Iterable[bytes], sample_rate: Optional[int] = None,
+                    channels: int = 1, volume: float = 1.0,
+                    channel: str = CHANNEL_SPEECH) -> AudioJob:
+        """
+        Play PCM chunks as they are produced (non-blocking; انتظر job.done).
+        sample_rate=None → الـ chunks عبارة عن WAV متدفق (الـ header يُقرأ من أوله).
+        الـ stream يدخل الـ mixer فورًا ويبدأ بعد الأصوات الموجودة فيه على نفس الـ channel؛
+        لا يمر بطابور الـ worker، فـ jobs الـ play_pcm / play_wav_bytes التي لم تُحوَّل بعد قد تأتي بعده.
+        """
+        job = AudioJob(path="<stream>", blocking=False, volume=max(0.0, min(1.0, volume)), channel=channel)
+        if self._stream is None:
+            print("⚠️ Audio output stream not available.")
+            _close_iter(chunks)
+            job.done.set()
+            return job
+        voice = _StreamVoice(job, self._prebuffer_frames)
+        with self._mix_lock:
+            self._voices.setdefault(channel, deque()).append(voice)
+        Thread(target=self._feed_stream, args=(voice, chunks, sample_rate, channels),
+               name="AudioStreamFeeder", daemon=True).start()
+        return job
+
+    def stop_current(self, channel: Optional[str] = None) -> None:
+        """إيقاف فوري لأي صوت جارٍ (أو channel واحد) + إلغاء الـ jobs المنتظرة."""
+        with self._mix_lock:
+            names = [channel] if channel else list(CHANNELS)
+            stopped = []
+            for name in names:
+                fifo = self._voices.get(name)
+                while fifo:
+                    stopped.append(fifo.popleft())
+        for voice in stopped:
+            voice.job.canceled.set()
+            voice.job.done.set()
 
         # تفريغ أي عناصر "قديمة" بالطابور (اختياري)
-        self.flush_queue()
+        if channel is None:
+            self.flush_queue()
+            return
+        # jobs هذا الـ channel التي لم يخلطها الـ worker بعد (play_wav_bytes / play_pcm)
+        with self._queue.mutex:
+            queued = [job for job in self._queue.queue if getattr(job, "channel", None) == channel]
+        current = self._current_job
+        if current is not None and current.channel == channel:
+            queued.append(current)
+        for job in queued:
+            job.canceled.set()
+            job.done.set()
+
+    def is_playing(self, channel: Optional[str] = None) -> bool:
+        with self._mix_lock:
+            if channel:
+                return bool(self._voices.get(channel))
+            return any(self._voices.values())
+
+    def set_channel_gain(self, channel: str, gain: float) -> None:
+        """Target gain of a channel; the mixer ramps to it over one buffer."""
+        self.channel_gain[channel] = max(0.0, float(gain))
+
+    def attach_reference(self, rate: int = 16000) -> PlaybackReference:
+        """Publish everything sent to the speaker (at `rate`) for echo cancellation."""
+        if self.reference is None or self.reference.rate != rate:
+            self.reference = PlaybackReference(rate=rate, device_rate=self._sample_rate)
+        return self.reference
 
     # ---------------- Internal ----------------
 
+    def _play_clip(self, clip: AudioClip, volume: float, channel: str,
+                   blocking: bool, timeout: Optional[float]) -> AudioJob:
+        job = AudioJob(path=clip.path, blocking=blocking, volume=max(0.0, min(1.0, volume)),
+                       channel=channel, clip=clip)
+        self._safe_put(job)
+        if blocking:
+            job.done.wait(timeout=timeout)
+        return job
+
+    def _feed_stream(self, voice: "_StreamVoice", chunks: Iterable[bytes],
+                     sample_rate: Optional[int], channels: int) -> None:
+        """Producer thread: chunks → device format → voice buffer."""
+        job = voice.job
+        parser = WavStreamParser() if sample_rate is None else None
+        conv = None if parser else PcmConverter(sample_rate, channels, self._sample_rate, self._channels)
+        try:
+            for chunk in chunks:
+                if job.canceled.is_set():
+                    break
+                if parser is not None and not parser.ready:
+                    chunk = parser.feed(chunk)
+                    if not parser.ready:
+                        continue
+                    if parser.sampwidth != 2:
+                        raise wave.Error("Only 16-bit WAV supported")
+                    conv = PcmConverter(parser.sample_rate, parser.channels,
+                                        self._sample_rate, self._channels)
+                if chunk:
+                    voice.push(conv.push(chunk))
+            if conv is not None and not job.canceled.is_set():
+                voice.push(conv.flush())
+        except Exception as e:
+            if not job.canceled.is_set():
+                print(f"❌ Audio stream error: {e}")
+        finally:
+            voice.end()
+            _close_iter(chunks)
+
     def _safe_put(self, job: AudioJob) -> None:
         try:
             self._queue.put_nowait(job)
         except:
             # لو الطابور ممتلئ، اسحب أقدم عنصر وارمِه ثم ضع الجديد
             try:
-                _ = self._queue.get_nowait()
+                dropped = self._queue.get_nowait()
+                dropped.done.set()
             except Empty:
                 pass
             self._queue.put_nowait(job)
 
     def _run(self) -> None:
+        """Worker: decode/convert (من الكاش غالبًا) ثم يسلّم الصوت للـ mixer."""
         while True:
             with self._lock:
                 if not self._running:
@@ -166,104 +581,119 @@ class AudioPlayer:
             if not isinstance(job, AudioJob):
                 job = AudioJob(path=str(job), blocking=False)
 
-            # مسار غير موجود
-            if not os.path.exists(job.path):
-                print(f"⚠️ Missing audio file: {job.path}")
-                job.done.set()
-                continue
-
-            # شغّل الملف
-            self._play_wav_job(job)
-
-            # علّم المُرسل بانتهاء التشغيل
-            job.done.set()
+            self._current_job = job
+            try:
+                self._play_wav_job(job)
+            finally:
+                self._current_job = None
             # سجّل توقيت آخر تشغيل لهذا المسار (لـ debounce)
-            self._last_play_ts[job.path] = time.time()
+            if job.clip is None:
+                self._last_play_ts[job.path] = time.time()
 
     def _play_wav_job(self, job: AudioJob) -> None:
-        """تشغيل ملف WAV باستخدام PyAudio مع دعم الإلغاء والتحكم في الصوت."""
-        if self._pa is None:
-            print("⚠️ PyAudio not initialized.")
+        """Queue a WAV on its mixer channel (done يُضبط من الـ callback عند الانتهاء)."""
+        if self._stream is None:
+            print("⚠️ Audio output stream not available.")
+            job.done.set()
+            return
+        if job.canceled.is_set():
+            job.done.set()
             return
-
-        self._current_job = job
-        wf = None
-        stream = None
         try:
-            # افتح الملف
-            wf = wave.open(job.path, "rb")
-
-            # تحقق من التنسيق
-            sampwidth = wf.getsampwidth()  # يُفضّل 2 (16-bit)
-            channels = wf.getnchannels()
-            framerate = wf.getframerate()
-
-            # افتح stream متوافق مع الملف (أخف على الـ Pi من إعادة التشكيل)
-            try:
-                stream = self._pa.open(
-                    format=self._pa.get_format_from_width(sampwidth),
-                    channels=channels,
-                    rate=framerate,
-                    output=True,
-                    frames_per_buffer=self._frames_per_buffer
-                )
-            except Exception as e:
-                print(f"❌ Cannot open audio stream: {e}")
-                return
-
-            # اقرأ وافرغ في الـ stream على دفعات صغيرة
-            vol = float(job.volume)
-            chunk = wf.readframes(self._frames_per_buffer)
-            while chunk:
-                # إلغاء فوري؟
-                if job.canceled.is_set():
-                    break
-
-                # تحكم في الصوت برمجيًا (audioop.mul) — يعمل بدون numpy
-                if vol < 0.999:  # تجنب كلفة غير ضرورية عند 1.0
-                    try:
-                        # factor في audioop.mul يكون float بين 0..N
-                        # width = sampwidth (1=8bit, 2=16bit ...)
-                        chunk = audioop.mul(chunk, sampwidth, vol)
-                    except Exception as _:
-                        # في حال فشل الضبط لأي سبب، اكتب الخام
-                        pass
-
-                try:
-                    stream.write(chunk)
-                except Exception as e:
-                    # أحياناً ALSA يقطع عند تبديل أجهزة — تجاهل الخطأ وأنهِ
-                    print(f"⚠️ stream write error: {e}")
-                    break
-
-                # التالي
-                chunk = wf.readframes(self._frames_per_buffer)
-
+            # من الذاكرة (لا فتح ملف ولا parsing للـ header في كل cue)
+            clip = job.clip or self.clips.get(job.path)
+            samples = self._device_samples(clip)
         except wave.Error as e:
             print(f"❌ WAV error: {e}")
+            job.done.set()
+            return
         except FileNotFoundError:
-            print(f"⚠️ File not found: {job.path}")
+            print(f"⚠️ Missing audio file: {job.path}")
+            job.done.set()
+            return
         except Exception as e:
             print(f"❌ Audio playback error: {e}")
-        finally:
-            # أغلق الموارد بهدوء
-            try:
-                if stream is not None:
-                    try:
-                        stream.stop_stream()
-                    except:
-                        pass
-                    stream.close()
-            except:
-                pass
-
-            try:
-                if wf is not None:
-                    wf.close()
-            except:
-                pass
+            job.done.set()
+            return
 
-            self._current_job = None
+        with self._mix_lock:
+            if job.canceled.is_set():
+                # stop_current() أثناء التحويل
+                job.done.set()
+                return
+            self._voices.setdefault(job.channel, deque()).append(_Voice(job, samples))
+
+    def _device_samples(self, clip: AudioClip) -> np.ndarray:
+        """Clip → float32 (frames, device_channels) بصيغة الـ stream (مخزّنة مع الـ clip)."""
+        key = (self._sample_rate, self._channels)
+        cached = clip.converted.get(key)
+        if cached is not None:
+            return cached
+        if clip.sampwidth != 2:
+            raise wave.Error(f"Only 16-bit WAV supported ({clip.path})")
+
+        conv = PcmConverter(clip.framerate, clip.channels, self._sample_rate, self._channels)
+        x = np.concatenate([conv.push(clip.pcm), conv.flush()])
+        # الطول الصحيح بعد التحويل (الـ flush يضيف ذيل صامت صغير)
+        n_out = int(round(len(clip.pcm) // clip.frame_bytes * self._sample_rate / clip.framerate))
+        x = np.ascontiguousarray(x[:n_out], dtype=np.float32)
+        clip.converted[key] = x
+        return x
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """PyAudio callback: sum the head voice of every channel into one buffer."""
+        if status:
+            self.underflows += 1
+        out = np.zeros((frame_count, self._channels), dtype=np.float32)
+        scratch = np.empty_like(out)        # gain × samples بدون مصفوفة جديدة لكل صوت
+        finished = []
+        with self._mix_lock:
+            foreground = bool(self._voices.get(CHANNEL_CUE)) or bool(self._voices.get(CHANNEL_SPEECH))
+            for name, fifo in self._voices.items():
+                gain = self.channel_gain.get(name, 1.0)
+                level = self._gain_level.get(name, gain)
+                self._gain_level[name] = gain
+                ramp = None
+                if level != gain:
+                    # set_channel_gain (barge-in ducking): ramp خطي بدل قفزة
+                    ramp = gain_ramp(level, gain, frame_count)
+                    gain = 1.0
+                if name == CHANNEL_BACKGROUND:
+                    # ramp خطي بين الكتل لتفادي الطقطقة
+                    target = self.duck_gain if foreground else 1.0
+                    duck = gain_ramp(self._duck_level, target, frame_count)
+                    self._duck_level = target
+                    ramp = duck if ramp is None else ramp * duck
+                offset = 0
+                while fifo and offset < frame_count:
+                    voice = fifo[0]
+                    if voice.job.canceled.is_set():
+                        finished.append(fifo.popleft())
+                        continue
+                    part = voice.read(frame_count - offset)
+                    n = len(part)
+                    if n:
+                        mix_into(out[offset:], part, gain * voice.job.volume,
+                                 None if ramp is None else ramp[offset:], scratch)
+                        offset += n
+                        if voice.job.started_at is None:
+                            voice.job.started_at = time.monotonic() + self._out_latency
+                            voice.job.started.set()
+                    if voice.exhausted:
+                        finished.append(fifo.popleft())
+                    elif offset < frame_count:
+                        # stream لم يصل باقيه بعد — لا نتخطّاه (الترتيب محفوظ)
+                        if voice.job.started.is_set():
+                            self.stream_starved += 1
+                        break
+        for voice in finished:
+            voice.job.done.set()
+        np.clip(out, -32768, 32767, out=out)
+        ref = self.reference
+        if ref is not None:
+            # الكتلة تُسمع بعد output latency تقريبًا
+            ref.push(out, time.monotonic() + self._out_latency)
+        return out.astype(np.int16).tobytes(), pyaudio.paContinue
 
     def _debounced(self, path: str) -> bool:
         last = self._last_play_ts.get(path)
@@ -275,6 +705,118 @@ class AudioPlayer:
     def flush_queue(self) -> None:
         try:
             while True:
-                self._queue.get_nowait()
+                job = self._queue.get_nowait()
+                job.done.set()
         except Empty:
             pass
+        # الأصوات المنتظرة خلف الصوت الجاري في كل channel
+        with self._mix_lock:
+            pending = []
+            for fifo in self._voices.values():
+                while len(fifo) > 1:
+                    pending.append(fifo.pop())
+        for voice in pending:
+            voice.job.canceled.set()
+            voice.job.done.set()
+
+
+def barge_in_ducker(player: AudioPlayer, gain: float, level: float = 250.0,
+                    frames: int = 2):
+    """
+    on_frame hook for barge-in windows (record_until_silence يمرر كل chunk
+    بما فيها الـ pre-roll الصامت): بعد `frames` chunks متتالية فوق `level` rms
+    والروبوت يتكلم → خفض قناة الكلام فورًا (قبل أن يقرر STT).
+    يحتاج المايك بعد إلغاء الصدى (recorder.echo)؛ بدونه صوت الروبوت نفسه يتخطى
+    `level` فيُخفض الكلام في كل نافذة.
+    """
+    state = {"over": 0, "fired": False}
+
+    def on_frame(chunk: bytes) -> None:
+        if state["fired"] or not player.is_playing(CHANNEL_SPEECH):
+            return
+        rms = chunk_level(chunk)
+        state["over"] = state["over"] + 1 if rms >= level else 0
+        if state["over"] < frames:
+            return
+        state["fired"] = True
+        player.set_channel_gain(CHANNEL_SPEECH, gain)
+        print("🔉 Barge-in: user speech over robot — ducking")
+    return on_frame
+
+
+def _close_iter(chunks) -> None:
+    close = getattr(chunks, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class _Voice:
+    """One playing/pending sound inside the mixer."""
+
+    __slots__ = ("job", "samples", "pos")
+
+    def __init__(self, job: AudioJob, samples: np.ndarray):
+        self.job = job
+        self.samples = samples
+        self.pos = 0
+
+    def read(self, n: int) -> np.ndarray:
+        part = self.samples[self.pos:self.pos + n]
+        self.pos += len(part)
+        return part
+
+    @property
+    def exhausted(self) -> bool:
+        return self.pos >= len(self.samples)
+
+
+class _StreamVoice:
+    """Voice fed incrementally by a producer thread (push/end)."""
+
+    def __init__(self, job: AudioJob, prebuffer: int):
+        self.job = job
+        self._blocks: deque = deque()
+        self._head = 0                  # offset داخل أول block
+        self._buffered = 0
+        self._prebuffer = prebuffer
+        self._ended = False
+        self._lock = Lock()
+
+    def push(self, block: np.ndarray) -> None:
+        if not len(block):
+            return
+        with self._lock:
+            self._blocks.append(block)
+            self._buffered += len(block)
+
+    def end(self) -> None:
+        with self._lock:
+            self._ended = True
+
+    def read(self, n: int) -> np.ndarray:
+        with self._lock:
+            # انتظر prebuffer صغير قبل البداية (تفادي تقطّع أول كلمة)
+            if not self.job.started.is_set() and not self._ended and self._buffered < self._prebuffer:
+                return self._blocks[0][:0] if self._blocks else np.zeros((0, 1), dtype=np.float32)
+            parts = []
+            while n > 0 and self._blocks:
+                block = self._blocks[0]
+                take = block[self._head:self._head + n]
+                parts.append(take)
+                n -= len(take)
+                self._head += len(take)
+                self._buffered -= len(take)
+                if self._head >= len(block):
+                    self._blocks.popleft()
+                    self._head = 0
+        if not parts:
+            return np.zeros((0, 1), dtype=np.float32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    @property
+    def exhausted(self) -> bool:
+        with self._lock:
+            return self._ended and not self._blocks
@@ -1,8 +1,13 @@
 ﻿# audio_recorder.py
 # ============================================================
 # Cross-platform Audio Recorder with robust VAD/Hysteresis
-# - Dynamic noise calibration
+# - Dynamic noise calibration (continuous noise-floor tracker → no per-turn wait)
 # - Start/End hysteresis (different thresholds)
+# - Pluggable frame VAD (vad.py): rms / spectral / webrtc
+# - Always-on capture → ring buffer → many readers (cursors)
+#   callback mode: PortAudio يدفع الـ chunks مباشرة في الـ ring (بدون read() يحجز الـ GIL)
+#   blocking mode: ثريد التقاط واحد يقرأ stream.read() (fallback)
+# - Optional echo canceller on the capture path (echo_canceller.py)
 # - Pre-roll & post-silence padding
 # - Min speech duration after start
 # - Windows/Linux (Raspberry Pi) with graceful fallbacks
@@ -10,9 +15,12 @@
 
 import time
 import io
-import audioop
-import collections
-from typing import Optional
+import queue
+import threading
+from typing import Optional, Callable, Union
+
+from pcm_buffer import PcmBuffer
+from vad import NoiseFloorTracker, VadEngine, create_vad
 
 try:
     import pyaudio
@@ -38,13 +46,176 @@ except Exception:
         REC_CHANNELS = 1
         REC_CHUNK = 1024
         REC_DEVICE_INDEX = None  # optional
+        VAD_ENGINE = "rms"
+        REC_RING_SECONDS = 10.0
+        REC_NOISE_TRACKING = True
+        REC_CAPTURE_MODE = "callback"
+
+
+# ==================== Ring Buffer ====================
+
+class AudioRingBuffer:
+    """
+    Fixed-size PCM ring written by ONE capture thread, read by many consumers.
+
+    - write position is a monotonic byte counter (never wraps), so each
+      reader only keeps its own cursor; no audio is read twice from hardware
+    - the writer copies the data first and publishes the new position after,
+      readers re-check the position after copying (seqlock style): no lock
+      on the data path, the Condition is only used to wake blocked readers.
+      The re-check keeps one write of slack (`max_write`): a write in
+      progress has already overwritten `[W, W + n)` before it publishes W + n
+    - a reader that falls more than `capacity - max_write` behind skips ahead
+      and counts the lost bytes in `reader.dropped` (instead of silent
+      overflow); `ring.overruns` sums them over all readers
+    """
+
+    def __init__(self, capacity: int, align: int = 2):
+        self.align = max(1, align)
+        self.capacity = max(self.align, capacity - capacity % self.align)
+        self._buf = bytearray(self.capacity)
+        self._write_pos = 0
+        self._closed = False
+        self.max_write = 0          # أكبر write حتى الآن (slack فحص الـ seqlock)
+        self.overruns = 0           # bytes skipped by readers that fell behind (all readers, تحت _cond)
+        self._cond = threading.Condition()
+
+    @property
+    def write_pos(self) -> int:
+        return self._write_pos
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write(self, data: bytes) -> None:
+        n = len(data)
+        if n == 0:
+            return
+        if n > self.capacity:
+            data = data[-self.capacity:]
+            self._write_pos += n - self.capacity
+            n = self.capacity
+        if n > self.max_write:
+            self.max_write = n        # يُنشر قبل الكتابة فوق بيانات القرّاء
+        start = self._write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = data[:first]
+        if first < n:
+            self._buf[:n - first] = data[first:]
+        self._write_pos += n          # publish بعد النسخ
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        self._closed = True
+        with self._cond:
+            self._cond.notify_all()
+
+    def reader(self, backlog_bytes: int = 0) -> "RingReader":
+        """New consumer starting `backlog_bytes` before now (pre-roll from the past)."""
+        backlog = min(max(0, backlog_bytes), self.capacity, self._write_pos)
+        backlog -= backlog % self.align
+        return RingReader(self, self._write_pos - backlog)
+
+    def _copy(self, pos: int, n: int) -> bytes:
+        start = pos % self.capacity
+        first = min(n, self.capacity - start)
+        if first == n:
+            return bytes(self._buf[start:start + n])
+        return bytes(self._buf[start:]) + bytes(self._buf[:n - first])
+
+    def _copy_into(self, pos: int, out: memoryview) -> None:
+        n = len(out)
+        start = pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buf[start:start + first]
+        if first < n:
+            out[first:] = self._buf[:n - first]
+
+    def _safe_lag(self, nbytes: int) -> int:
+        """Largest reader lag whose bytes cannot be under a write in progress."""
+        return max(self.capacity - self.max_write, nbytes)
+
+    def _wait(self, target_pos: int, timeout: Optional[float]) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._write_pos >= target_pos or self._closed, timeout)
+
+
+class RingReader:
+    """One consumer cursor over an AudioRingBuffer."""
+
+    def __init__(self, ring: AudioRingBuffer, pos: int):
+        self.ring = ring
+        self.pos = pos
+        self.dropped = 0            # bytes lost because this reader was too slow
+
+    def available(self) -> int:
+        return self.ring.write_pos - self.pos
+
+    def skip_to_now(self) -> None:
+        self.pos = self.ring.write_pos
+
+    def read(self, nbytes: int, timeout: Optional[float] = None) -> bytes:
+        """
+        Block until `nbytes` are available and return them.
+        Returns b"" on timeout or when the ring is closed.
+        """
+        ring = self.ring
+        while True:
+            if ring.write_pos - self.pos < nbytes:
+                if ring.closed or not ring._wait(self.pos + nbytes, timeout):
+                    return b""
+                if ring.write_pos - self.pos < nbytes:
+                    return b""           # closed
+            self._catch_up(nbytes)
+            data = ring._copy(self.pos, nbytes)
+            if ring.write_pos - self.pos > ring._safe_lag(nbytes):
+                continue                 # الكاتب لفّ فوقنا أثناء النسخ — أعد
+            self.pos += nbytes
+            return data
+
+    def read_into(self, out: memoryview, timeout: Optional[float] = None) -> int:
+        """
+        Same as read(len(out)) but copies straight into `out` (e.g. PcmBuffer.reserve()).
+        Returns the number of bytes written (0 on timeout / closed ring).
+        """
+        ring = self.ring
+        nbytes = len(out)
+        while True:
+            if ring.write_pos - self.pos < nbytes:
+                if ring.closed or not ring._wait(self.pos + nbytes, timeout):
+                    return 0
+                if ring.write_pos - self.pos < nbytes:
+                    return 0             # closed
+            self._catch_up(nbytes)
+            ring._copy_into(self.pos, out)
+            if ring.write_pos - self.pos > ring._safe_lag(nbytes):
+                continue                 # الكاتب لفّ فوقنا أثناء النسخ — أعد
+            self.pos += nbytes
+            return nbytes
+
+    def _catch_up(self, nbytes: int) -> None:
+        ring = self.ring
+        limit = ring._safe_lag(nbytes)
+        lag = ring.write_pos - self.pos
+        if lag > limit:
+            skip = lag - limit
+            skip += (-skip) % ring.align
+            self.pos += skip
+            self.dropped += skip
+            # عدة قرّاء قد يتأخروا معًا — الجمع تحت القفل
+            with ring._cond:
+                ring.overruns += skip
 
 
 class AudioRecorder:
     """
-    Simple audio recorder with VAD-like stop on silence using hysteresis,
-    suitable for single-thread assistants that call `record_until_silence`
-    and feed the raw PCM bytes to STT.
+    Simple audio recorder with VAD-like stop on silence using hysteresis.
+    The capture side owns the hardware stream (PortAudio callback, or one
+    blocking thread); `record_until_silence` may be called from several
+    threads at once (main listener, barge-in…), each call reading the shared
+    ring buffer through its own cursor — VAD always runs on the consumer side.
     """
 
     def __init__(self, config: Optional[Config] = None):
@@ -56,10 +227,37 @@ class AudioRecorder:
         self.channels = int(getattr(self.cfg, "REC_CHANNELS", 1))
         self.chunk = int(getattr(self.cfg, "REC_CHUNK", 1024))
         self.device_index = getattr(self.cfg, "REC_DEVICE_INDEX", None)
+        self.vad_engine = str(getattr(self.cfg, "VAD_ENGINE", "rms"))
+        self.ring_seconds = float(getattr(self.cfg, "REC_RING_SECONDS", 10.0))
+        self.capture_mode = str(getattr(self.cfg, "REC_CAPTURE_MODE", "callback")).strip().lower()
 
         # Internals
         self._pa = None
         self._stream = None
+        self._ring: Optional[AudioRingBuffer] = None
+        self._capture_thread: Optional[threading.Thread] = None
+        self._capture_stop = threading.Event()
+        self._capture_lock = threading.Lock()
+        self.overflows = 0          # input overflows reported by the driver (audio lost before us)
+        self.underflows = 0         # input underflows (callback status flags)
+        self.callbacks = 0
+        self.callback_max_ms = 0.0  # أطول زمن قضاه callback الالتقاط (يجب أن يبقى << زمن الـ chunk)
+        # callback mode + echo canceller: المعالجة الثقيلة في ثريد منفصل، لا داخل callback الـ PortAudio
+        self._echo_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._echo_thread: Optional[threading.Thread] = None
+        self._echo_in = 0           # chunks queued (callback فقط يزيده)
+        self._echo_out = 0          # chunks written (ثريد الصدى فقط يزيده)
+        self.echo_skipped = 0       # chunks passed through unprocessed to catch up
+        # Echo canceller (set_echo_canceller): يعمل قبل الكتابة في الـ ring
+        # → كل القرّاء (VAD / STT / KWS) يرون الصوت بعد إزالة صدى الروبوت
+        self.echo = None
+        self._cap_t0: Optional[float] = None    # زمن التقاط أول عيّنة (monotonic)
+        self._cap_frames = 0
+        self._cap_latency = 0.0
+        # Noise floor محدَّث باستمرار من ثريد الالتقاط (None = معايرة زمنية كل مرة)
+        self.noise: Optional[NoiseFloorTracker] = None
+        if getattr(self.cfg, "REC_NOISE_TRACKING", True):
+            self.noise = NoiseFloorTracker(rate=self.rate, width=self.width, chunk=self.chunk)
 
         # Initialize backend
         self._init_backend()
@@ -79,8 +277,8 @@ class AudioRecorder:
         except Exception as ex:
             raise RuntimeError(f"Failed to initialize PyAudio: {ex}")
 
-    def _ensure_stream(self):
-        """Open input stream if not opened yet."""
+    def _ensure_stream(self, callback: bool = False):
+        """Open input stream if not opened yet (callback=True → PortAudio pushes into _on_audio)."""
         if self._stream is not None:
             return
         if self._pa is None:
@@ -96,11 +294,16 @@ class AudioRecorder:
         )
         if self.device_index is not None:
             kwargs["input_device_index"] = self.device_index
+        if callback:
+            kwargs["stream_callback"] = self._on_audio
+            kwargs["start"] = False         # يبدأ بعد تجهيز الـ ring
 
         try:
             self._stream = self._pa.open(**kwargs)
         except Exception as ex:
             raise RuntimeError(f"Failed to open input stream: {ex}")
+        if callback:
+            return
 
         # Prime the stream to reduce latency
         try:
@@ -108,8 +311,218 @@ class AudioRecorder:
         except Exception:
             pass
 
+    # -------------------- Capture Thread --------------------
+
+    @property
+    def bytes_per_chunk(self) -> int:
+        return self.chunk * self.width * self.channels
+
+    def start_capture(self) -> AudioRingBuffer:
+        """
+        Start capturing (idempotent). Everything that needs microphone audio
+        reads from self.ring through its own reader().
+        """
+        with self._capture_lock:
+            if self._capturing():
+                return self._ring
+            frame_bytes = self.width * self.channels
+            self._ring = AudioRingBuffer(int(self.rate * self.ring_seconds) * frame_bytes, align=frame_bytes)
+            self._cap_t0 = None
+            self._cap_frames = 0
+            self._capture_stop.clear()
+            if self.capture_mode == "callback" and self._start_callback_stream():
+                return self._ring
+            self._ensure_stream()
+            self._capture_thread = threading.Thread(target=self._capture_loop, name="AudioCapture", daemon=True)
+            self._capture_thread.start()
+            return self._ring
+
+    def _capturing(self) -> bool:
+        if self._capture_thread is not None and self._capture_thread.is_alive():
+            return True
+        return self.capture_mode == "callback" and self._ring is not None and not self._capture_stop.is_set()
+
+    def _start_callback_stream(self) -> bool:
+        """Open/restart the callback stream; on failure fall back to blocking reads for good."""
+        try:
+            self._ensure_stream(callback=True)
+            self._stream.start_stream()
+        except Exception as ex:
+            print(f"⚠️ Callback capture unavailable ({ex}) → blocking reads")
+            self.capture_mode = "blocking"
+            if self._stream is not None:
+                try:
+                    self._stream.close()
+                except Exception:
+                    pass
+                self._stream = None
+            return False
+        if self._echo_thread is None or not self._echo_thread.is_alive():
+            self._echo_thread = threading.Thread(target=self._echo_loop, name="AudioEcho", daemon=True)
+            self._echo_thread.start()
+        return True
+
+    @property
+    def ring(self) -> AudioRingBuffer:
+        return self.start_capture()
+
+    def reader(self, backlog_ms: int = 0) -> RingReader:
+        """New consumer cursor; `backlog_ms` of already-captured audio is included."""
+        ring = self.ring
+        return ring.reader(int(self.rate * backlog_ms / 1000.0) * self.width * self.channels)
+
+    def set_echo_canceller(self, echo) -> None:
+        """Attach an EchoCanceller (process(pcm, t_start) -> pcm); None to remove."""
+        self.echo = echo
+
+    def _capture_time(self, frames: int) -> float:
+        """
+        Capture time of the first frame of the chunk just read.
+        الساعة = عدد العيّنات منذ أول chunk (بدون jitter الثريد)، ويُعاد الضبط عند الانحراف.
+        """
+        now = time.monotonic()
+        if self._cap_t0 is None:
+            try:
+                latency = float(self._stream.get_input_latency())
+            except Exception:
+                latency = 0.0
+            self._cap_latency = latency
+        expected_end = None if self._cap_t0 is None else self._cap_t0 + (self._cap_frames + frames) / self.rate
+        if expected_end is None or abs(now - self._cap_latency - expected_end) > 0.1:
+            self._cap_t0 = now - self._cap_latency - (self._cap_frames + frames) / self.rate
+        t_start = self._cap_t0 + self._cap_frames / self.rate
+        self._cap_frames += frames
+        return t_start
+
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        """
+        PortAudio callback (its own thread, once per chunk): counters + copy into
+        the preallocated ring, nothing that can block. Readers wake on the ring's
+        Condition; VAD / STT / KWS run in their own threads.
+        """
+        t0 = time.perf_counter()
+        try:
+            self.callbacks += 1
+            if status:
+                if status & getattr(pyaudio, "paInputOverflow", 0x2):
+                    self.overflows += 1
+                    self._cap_t0 = None      # عيّنات ضاعت → أعد ضبط الساعة
+                if status & getattr(pyaudio, "paInputUnderflow", 0x1):
+                    self.underflows += 1
+            if in_data:
+                t_start = self._capture_time(frame_count)
+                if self.echo is not None or self._echo_in != self._echo_out:
+                    # الترتيب محفوظ: ما دام في الطابور شيء، كل الـ chunks تمر عبره
+                    self._echo_in += 1
+                    self._echo_queue.put((in_data, t_start))
+                else:
+                    self._deliver(in_data)
+        except Exception as ex:
+            # استثناء هنا يوقف الـ stream في PyAudio → لا نسمح به
+            print(f"❌ Audio capture callback error: {ex}")
+        ms = (time.perf_counter() - t0) * 1000.0
+        if ms > self.callback_max_ms:
+            self.callback_max_ms = ms
+        return None, getattr(pyaudio, "paContinue", 0)
+
+    def _echo_loop(self):
+        """Echo canceller for callback mode, off the PortAudio thread (None = stop)."""
+        backlog_limit = max(2, int(0.3 * self.rate / max(1, self.chunk)))
+        while True:
+            item = self._echo_queue.get()
+            if item is None:
+                break
+            data, t_start = item
+            echo = self.echo
+            if echo is not None and self._echo_in - self._echo_out > backlog_limit:
+                # متأخرون > 300ms: مرّر بدون معالجة حتى نلحق (لا نفقد الصوت)
+                self.echo_skipped += 1
+                echo = None
+            self._deliver(data, t_start, echo)
+            self._echo_out += 1
+
+    def _deliver(self, data: bytes, t_start: float = 0.0, echo=None) -> None:
+        """Echo canceller (optional) → noise floor → ring."""
+        if echo is not None and self.channels == 1 and self.width == 2:
+            try:
+                data = echo.process(data, t_start)
+            except Exception as ex:
+                print(f"⚠️ Echo canceller error: {ex}")
+        noise = self.noise
+        if noise is not None:
+            noise.update(data)
+        self._ring.write(data)
+
+    def _capture_loop(self):
+        ring = self._ring
+        frame_bytes = self.width * self.channels
+        while not self._capture_stop.is_set():
+            try:
+                data = self._stream.read(self.chunk, exception_on_overflow=True)
+            except IOError as ex:
+                # Input overflowed: count it and keep going (لا نخفيه بصمت)
+                if getattr(ex, "errno", None) == getattr(pyaudio, "paInputOverflowed", -9981):
+                    self.overflows += 1
+                    self._cap_t0 = None      # عيّنات ضاعت → أعد ضبط الساعة
+                    continue
+                if self._capture_stop.is_set():
+                    break
+                print(f"❌ Audio capture error: {ex}")
+                time.sleep(0.05)
+                continue
+            except Exception as ex:
+                if self._capture_stop.is_set():
+                    break
+                print(f"❌ Audio capture error: {ex}")
+                time.sleep(0.05)
+                continue
+            t_start = self._capture_time(len(data) // frame_bytes)
+            self._deliver(data, t_start, self.echo)
+        ring.close()
+
+    def stop_capture(self):
+        self._capture_stop.set()
+        t = self._capture_thread
+        if t is not None and t.is_alive() and t is not threading.current_thread():
+            t.join(timeout=1.0)
+        self._capture_thread = None
+        if self.capture_mode == "callback" and self._stream is not None:
+            try:
+                self._stream.stop_stream()
+            except Exception:
+                pass
+            # الطابور يُفرَّغ قبل الإغلاق → القرّاء يحصلون على آخر chunk
+            self._echo_queue.put(None)
+            t = self._echo_thread
+            if t is not None and t.is_alive() and t is not threading.current_thread():
+                t.join(timeout=1.0)
+            self._echo_thread = None
+            if self._ring is not None:
+                self._ring.close()
+
+    def capture_stats(self) -> str:
+        ring = self._ring
+        overruns = ring.overruns if ring is not None else 0
+        text = (f"{self.capture_mode} capture: {self.overflows} input overflows, "
+                f"{self.underflows} underflows, {overruns} bytes dropped by slow readers")
+        if self.capture_mode == "callback":
+            text += f", {self.callbacks} callbacks (max {self.callback_max_ms:.2f} ms)"
+            if self.echo_skipped:
+                text += f", {self.echo_skipped} chunks past the echo canceller"
+        return text
+
+    def _read_chunk(self, reader: RingReader) -> bytes:
+        """One chunk from the ring (b"" if capture stopped)."""
+        return reader.read(self.bytes_per_chunk, timeout=1.0)
+
+    def _read_chunk_into(self, reader: RingReader, buf: PcmBuffer) -> memoryview:
+        """One chunk copied from the ring straight into `buf`; returns its view (empty if stopped)."""
+        n = reader.read_into(buf.reserve(self.bytes_per_chunk), timeout=1.0)
+        return buf.commit(n)
+
     def close(self):
-        """Close the stream and terminate PyAudio."""
+        """Stop capturing, close the stream and terminate PyAudio."""
+        self.stop_capture()
         try:
             if self._stream is not None:
                 try:
@@ -131,17 +544,26 @@ class AudioRecorder:
         finally:
             self._pa = None
 
+    # -------------------- VAD --------------------
+
+    def new_vad(self, name: Optional[str] = None, **kwargs) -> VadEngine:
+        """Fresh VAD engine for one recording (engines keep per-recording state)."""
+        return create_vad(name or self.vad_engine, rate=self.rate, width=self.width,
+                          channels=self.channels, **kwargs)
+
     # -------------------- Public Recording APIs --------------------
 
     def record_fixed(self, duration_sec: float = 5.0) -> bytes:
         """
         Record a fixed duration of audio and return raw PCM bytes.
         """
-        self._ensure_stream()
+        reader = self.reader()
         total_frames = int(self.rate * duration_sec / self.chunk)
         frames = []
         for _ in range(total_frames):
-            data = self._stream.read(self.chunk, exception_on_overflow=False)
+            data = self._read_chunk(reader)
+            if not data:
+                break
             frames.append(data)
         return b"".join(frames)
 
@@ -155,78 +577,129 @@ class AudioRecorder:
         pre_roll_ms: int = 300,
         min_speech_after_start: float = 1.8,
         threshold_boost: float = 2.0,
-    ) -> bytes:
+        on_frame: Optional[Callable[[bytes], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        on_silence_start: Optional[Callable[[bytes], None]] = None,
+        on_speech_resume: Optional[Callable[[], None]] = None,
+        speculative_frames: int = 4,
+        vad: Optional[VadEngine] = None,
+        reader: Optional[RingReader] = None,
+    ) -> Union[PcmBuffer, bytes]:
         """
         Record until "real" silence is detected using hysteresis & padding.
-        Returns raw PCM bytes (matching self.rate/self.width/self.channels).
+        Returns a PcmBuffer (bytes-like audio via .pcm(), WAV without copying via
+        .wav() / pcm_to_wav()) matching self.rate/self.width/self.channels,
+        or b"" when nothing was recorded.
 
         Parameters:
         - max_duration:           Hard cap in seconds.
-        - noise_calib_duration:   Seconds to measure ambient noise at start.
+        - noise_calib_duration:   Seconds to measure ambient noise at start. Skipped (0 s) once
+                                  the background noise tracker (self.noise) has an estimate;
+                                  0 = no calibration at all (default thresholds).
         - start_frames:           # of consecutive frames above start_threshold to start speech.
         - end_frames:             # of consecutive frames below end_threshold to end speech.
         - post_silence_hold:      Extra seconds to capture after end detected.
         - pre_roll_ms:            Milliseconds kept from before speaking started.
         - min_speech_after_start: Minimum seconds after start before allowing end.
         - threshold_boost:        Multiplier applied to noise floor to form thresholds.
+        - on_frame:               Optional callback receiving every PCM chunk that ends up
+                                  in the result, as soon as it is captured (streaming STT).
+                                  Chunks are memoryviews into the result buffer (do not modify).
+        - cancel_event:           Optional Event; when set, recording stops and returns b"".
+        - on_silence_start:       Speculative snapshot: called with the PCM captured so far once
+                                  `speculative_frames` quiet frames follow real speech (the
+                                  end-of-speech hangover begins). Start STT on it in parallel.
+        - on_speech_resume:       Called if speech resumes after a snapshot (discard it).
+        - speculative_frames:     Quiet frames before the snapshot (must be < end_frames).
+        - vad:                    Optional VadEngine for this call (default: self.new_vad(),
+                                  i.e. Config.VAD_ENGINE).
+        - reader:                 Optional RingReader to consume (default: a new one whose
+                                  backlog provides the pre-roll). Concurrent callers each get
+                                  their own cursor, so none of them steals the other's audio.
 
         Tuning tips:
         - Cuts too early? Increase `end_frames` (e.g., 18–22) and/or `post_silence_hold`.
         - Misses soft speech? Decrease `threshold_boost` (e.g., 2.0–2.5).
+        - Fans/TV open the recording? VAD_ENGINE=spectral (or webrtc).
         - Trims first word? Increase `pre_roll_ms` (e.g., 400–500ms).
         """
 
         if _HAS_PYAUDIO is False:
             raise RuntimeError("PyAudio backend not available")
 
-        self._ensure_stream()
+        if vad is None:
+            vad = self.new_vad()
 
         bytes_per_frame = self.width * self.channels
+        bpc = self.bytes_per_chunk
         # How many chunk blocks to buffer for pre-roll
         pre_roll_bytes = int(self.rate * pre_roll_ms / 1000.0) * bytes_per_frame
         pre_roll_blocks = max(1, pre_roll_bytes // (self.chunk * bytes_per_frame))
-        ring_pre = collections.deque(maxlen=pre_roll_blocks)
 
-        frames = []
+        # الصوت كله في buffer واحد محجوز مسبقًا (هيدر WAV + max_duration + pre-roll + hold)
+        buf = PcmBuffer(self.rate, self.width, self.channels,
+                        capacity_sec=max_duration + pre_roll_ms / 1000.0 + post_silence_hold + 1.0)
+
+        if reader is None:
+            # الصوت الملتقط قبل الاستدعاء متاح في الـ ring → pre-roll حقيقي حتى بدون معايرة
+            reader = self.reader(backlog_ms=pre_roll_blocks * self.chunk * 1000 // self.rate)
+            while reader.available() >= bpc:
+                if not self._read_chunk_into(reader, buf):
+                    break
 
         # ---- 1) Noise calibration ----
-        calib_end = time.time() + max(0.0, noise_calib_duration)
-        noise_vals = []
-        while time.time() < calib_end:
-            data = self._stream.read(self.chunk, exception_on_overflow=False)
-            rms = audioop.rms(data, self.width)
-            noise_vals.append(rms)
-            ring_pre.append(data)
-
-        noise_floor = (sum(noise_vals) / max(1, len(noise_vals))) if noise_vals else 50
-        # Two thresholds: higher to START, lower to END (hysteresis)
-        start_threshold = max(150, noise_floor * threshold_boost)
-        end_threshold = max(100, noise_floor * (threshold_boost * 0.55))
+        noise = self.noise
+        if noise_calib_duration > 0 and noise is not None and noise.ready:
+            # الضوضاء مقاسة مسبقًا في الخلفية → الكلام يُلتقط من أول chunk
+            noise_chunks = noise.noise_chunks()
+        else:
+            calib_end = time.time() + max(0.0, noise_calib_duration)
+            noise_chunks = []
+            while time.time() < calib_end:
+                if cancel_event is not None and cancel_event.is_set():
+                    return b""
+                data = self._read_chunk_into(reader, buf)
+                if not data:
+                    return b""
+                noise_chunks.append(data)
+
+        # Two thresholds: higher to START, lower to END (hysteresis) — inside the engine
+        vad.calibrate(noise_chunks, threshold_boost)
+        # pre-roll = آخر pre_roll_blocks فقط من الـ backlog + المعايرة
+        buf.discard_head(len(buf) - pre_roll_blocks * bpc)
 
         # (Optional) debug print — uncomment if you want to see values
-        # print(f"[VAD] noise_floor={noise_floor:.1f} start_thr={start_threshold:.1f} end_thr={end_threshold:.1f}")
+        # print(f"[VAD] {vad.describe()}")
 
         # ---- 2) State tracking ----
         speaking = False
         over_count = 0
         under_count = 0
+        snapshot_sent = False
         start_time = None
         hard_deadline = time.time() + max_duration
 
         # seed pre-roll
-        frames.extend(list(ring_pre))
+        if on_frame is not None:
+            for off in range(0, len(buf), bpc):
+                on_frame(buf.pcm(off, off + bpc))
 
         # ---- 3) Main loop ----
         while True:
             if time.time() >= hard_deadline:
                 break
+            if cancel_event is not None and cancel_event.is_set():
+                return b""
 
-            data = self._stream.read(self.chunk, exception_on_overflow=False)
-            rms = audioop.rms(data, self.width)
-            frames.append(data)
+            data = self._read_chunk_into(reader, buf)
+            if not data:
+                break
+            voiced = vad.is_speech(data, speaking)
+            if on_frame is not None:
+                on_frame(data)
 
             if not speaking:
-                if rms >= start_threshold:
+                if voiced:
                     over_count += 1
                     if over_count >= start_frames:
                         speaking = True
@@ -235,13 +708,24 @@ class AudioRecorder:
                 else:
                     over_count = 0
             else:
-                if rms < end_threshold:
+                if not voiced:
                     under_count += 1
                 else:
                     under_count = 0
+                    if snapshot_sent:
+                        # المستخدم أكمل الكلام — الـ snapshot لم يعد صالحًا
+                        snapshot_sent = False
+                        if on_speech_resume is not None:
+                            on_speech_resume()
 
                 # Enforce minimum speech time before allowing end
                 long_enough = (time.time() - start_time) >= min_speech_after_start if start_time else False
+
+                # Speculative snapshot: بداية فترة الصمت الأخيرة (قبل انتهاء الـ hangover)
+                if (on_silence_start is not None and not snapshot_sent and long_enough
+                        and speculative_frames <= under_count < end_frames):
+                    snapshot_sent = True
+                    on_silence_start(buf.pcm())
                 if long_enough and under_count >= end_frames:
                     # Post-silence hold
                     hold_bytes = int(self.rate * post_silence_hold) * bytes_per_frame
@@ -249,19 +733,26 @@ class AudioRecorder:
                     for _ in range(hold_blocks):
                         if time.time() >= hard_deadline:
                             break
-                        extra = self._stream.read(self.chunk, exception_on_overflow=False)
-                        frames.append(extra)
+                        extra = self._read_chunk_into(reader, buf)
+                        if not extra:
+                            break
+                        if on_frame is not None:
+                            on_frame(extra)
                     break
 
-        return b"".join(frames) if frames else b""
+        return buf if buf else b""
 
     # -------------------- Utilities --------------------
 
-    def pcm_to_wav(self, pcm_bytes: bytes) -> bytes:
+    def pcm_to_wav(self, pcm_bytes: Union[PcmBuffer, bytes]) -> Union[memoryview, bytes]:
         """
         Optional: wrap raw PCM into WAV header and return bytes.
         Useful if your STT expects WAV. Not used by default.
+        A PcmBuffer (record_until_silence) gets its reserved header filled in place:
+        the returned memoryview is the same memory, the audio is not copied.
         """
+        if isinstance(pcm_bytes, PcmBuffer):
+            return pcm_bytes.wav()
         import wave
         buf = io.BytesIO()
         with wave.open(buf, 'wb') as wf:
@@ -0,0 +1,338 @@
+# echo_canceller.py
+# -------------------------------------------------------------------
+# Acoustic echo suppression for barge-in (NumPy only)
+# - PlaybackReference: ما خرج فعلًا للسماعة (من callback الـ AudioPlayer)
+#   محوّل لمعدل المايك ومؤرّخ بزمن التشغيل
+# - EchoCanceller: bulk delay (GCC-PHAT) + NLMS (frequency-domain blocks) يطرح صدى الروبوت
+#   من المايك قبل الـ VAD و STT، مع كشف double-talk و residual suppression
+# الاستخدام:
+#   ref = audio_player.attach_reference(recorder.rate)
+#   recorder.set_echo_canceller(EchoCanceller(ref, recorder.rate))
+# -------------------------------------------------------------------
+
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from resampler import PolyphaseResampler, downmix
+
+
+class PlaybackReference:
+    """
+    Speaker signal at the microphone rate, indexed by playback time.
+    push() يُستدعى من callback الـ output stream؛ segment() من ثريد الالتقاط.
+    الـ stream دائم، فعدد العيّنات هو الساعة (يُعاد الضبط فقط عند underflow كبير).
+    """
+
+    def __init__(self, rate: int = 16000, device_rate: int = 22050,
+                 seconds: float = 3.0, silence_level: float = 30.0, resync_sec: float = 0.1):
+        self.rate = rate
+        self.device_rate = device_rate
+        self.silence_level = silence_level
+        self.resync_sec = resync_sec
+        self._buf = np.zeros(int(rate * seconds), dtype=np.float32)
+        self._rs = PolyphaseResampler(device_rate, rate, 1)
+        self._t0: Optional[float] = None        # زمن تشغيل العيّنة 0
+        self._in_frames = 0                     # frames بمعدل الجهاز
+        self._n = 0                             # عيّنات مكتوبة بمعدل المايك
+        self._lock = threading.Lock()
+        self.last_active = 0.0                  # آخر زمن تشغيل فيه صوت غير صامت
+        self.resyncs = 0
+
+    def push(self, block: np.ndarray, play_time: float) -> None:
+        """block: float32 (frames, ch) at device rate; play_time: when its first frame is heard."""
+        x = self._rs.process(downmix(block, 1))[:, 0]
+        with self._lock:
+            expected = None if self._t0 is None else self._t0 + self._in_frames / self.device_rate
+            if expected is None or abs(play_time - expected) > self.resync_sec:
+                if expected is not None:
+                    self.resyncs += 1
+                self._t0 = play_time - self._in_frames / self.device_rate
+            self._in_frames += len(block)
+
+            cap = len(self._buf)
+            idx = (self._n + np.arange(len(x))) % cap
+            self._buf[idx] = x
+            self._n += len(x)
+            if len(x) and float(np.abs(x).max()) > self.silence_level:
+                self.last_active = self._t0 + self._n / self.rate
+
+    def segment(self, t_start: float, n: int) -> np.ndarray:
+        """n samples starting at playback time t_start (zeros where unknown)."""
+        out = np.zeros(n, dtype=np.float32)
+        with self._lock:
+            if self._t0 is None:
+                return out
+            start = int(round((t_start - self._t0) * self.rate))
+            lo = max(start, self._n - len(self._buf), 0)
+            hi = min(start + n, self._n)
+            if hi > lo:
+                out[lo - start:hi - start] = self._buf[np.arange(lo, hi) % len(self._buf)]
+        return out
+
+    def active_since(self, t: float) -> bool:
+        return self.last_active >= t
+
+
+class EchoCanceller:
+    """
+    Removes the robot's own voice from capture chunks.
+
+        clean = ec.process(pcm_chunk, t_start)   # int16 bytes → int16 bytes
+
+    - delay bulk (الصوت من السماعة للمايك + فرق ساعات التقدير) يُقدّر بـ GCC-PHAT
+    - NLMS بمجال التردد (partitioned blocks, taps عيّنة): y = X·W ، e = d - y
+    - double-talk: المايك > dtd_ratio × (ERL × قوة الـ reference) → المستخدم يتكلم، نجمّد التكيّف
+    - residual suppression: الروبوت وحده يتكلم (بدون double-talk) → نخفض الباقي (suppress)
+    بدون صوت من السماعة → الـ chunk يمر كما هو (تكلفة صفر).
+    """
+
+    def __init__(self, reference: PlaybackReference, rate: int = 16000, taps: int = 256,
+                 mu: float = 0.3, block: int = 64, max_delay_ms: int = 300,
+                 suppress: float = 0.3, dtd_ratio: float = 4.0, reg: float = 0.5):
+        self.ref = reference
+        self.rate = rate
+        self.block = block
+        self.parts = max(1, taps // block)
+        self.taps = self.parts * block
+        self.mu = mu
+        self.max_delay = int(rate * max_delay_ms / 1000)
+        self.suppress = suppress
+        self.dtd_ratio = dtd_ratio
+        self.reg = reg
+
+        # الفلتر في مجال التردد: partition لكل block من الـ taps (overlap-save, FFT = 2·block)
+        self.W = np.zeros((self.parts, block + 1), dtype=np.complex64)
+        self._power = np.full(block + 1, 1.0, dtype=np.float32)
+        self.delay = 0                      # samples (reference قبل المايك بهذا القدر)
+        self._margin = self.taps // 8       # الصدى يبدأ عند tap ~margin (تحمّل jitter)
+        self._delay_known = False
+        self._mic = deque()                 # آخر ثانية من المايك (لتقدير الـ delay)
+        self._mic_len = 0
+        self._since_estimate = 0
+        self._active = 0                    # عيّنات المايك أثناء تشغيل السماعة (قبل أول تقدير)
+        self.erle = 1.0                     # echo return loss enhancement (linear, smoothed)
+        self.erl = 1.0                      # echo return loss: قوة الصدى / قوة الـ reference
+        self.double_talk = False
+        self._dt_blocks = 0
+
+    # ---------------- Public API ----------------
+
+    def process(self, pcm: bytes, t_start: float) -> bytes:
+        d = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        n = len(d)
+        self._remember(d)
+        if not n or not self.ref.active_since(t_start - 0.25):
+            self.double_talk = False
+            return pcm
+
+        self._since_estimate += n
+        self._active += n
+        # أول تقدير يحتاج نصف ثانية على الأقل من الصدى، وإلا القمة عشوائية
+        if self._active >= self.rate // 2 and (
+                not self._delay_known or self._since_estimate >= self.rate):
+            self._estimate_delay(t_start + n / self.rate)
+
+        # x[j + taps] ↔ d[j] متأخرًا بـ (delay - margin)؛ partition p ↔ lags p·block..
+        lead = self.delay - self._margin + self.taps
+        x = self.ref.segment(t_start - lead / self.rate, n + self.taps)
+        e = self._adapt(x, d)
+        return np.clip(e, -32768, 32767).astype(np.int16).tobytes()
+
+    @property
+    def erle_db(self) -> float:
+        return 10.0 * float(np.log10(max(self.erle, 1e-6)))
+
+    @property
+    def delay_ms(self) -> float:
+        return 1000.0 * self.delay / self.rate
+
+    def reset(self) -> None:
+        self.W[:] = 0.0
+        self.erle = 1.0
+        self.erl = 1.0
+        self._delay_known = False
+        self._active = 0
+        self._dt_blocks = 0
+
+    # ---------------- Internal ----------------
+
+    def _remember(self, d: np.ndarray) -> None:
+        self._mic.append(d)
+        self._mic_len += len(d)
+        while self._mic_len - len(self._mic[0]) >= self.rate:
+            self._mic_len -= len(self._mic.popleft())
+
+    def _adapt(self, x: np.ndarray, d: np.ndarray) -> np.ndarray:
+        """
+        Partitioned-block frequency-domain NLMS (overlap-save).
+        التطبيع لكل bin ترددي → تقارب سريع حتى مع إشارة ملوّنة (كلام/موسيقى)
+        حيث NLMS الزمني يتقارب ببطء شديد.
+        """
+        B, P = self.block, self.parts
+        n = len(d)
+        nb = -(-n // B)
+        # كل نوافذ الـ reference لكل blocks الـ chunk في FFT واحد: (nb, P, 2B)
+        pad = nb * B - n
+        if pad:
+            x = np.concatenate([x, np.zeros(pad, dtype=np.float32)])
+            d = np.concatenate([d, np.zeros(pad, dtype=np.float32)])
+        win = sliding_window_view(x, 2 * B)
+        starts = (np.arange(nb) * B)[:, None] + self.taps - B - np.arange(P)[None, :] * B
+        X = np.fft.rfft(win[starts], axis=-1)                       # (nb, P, B+1)
+
+        out = np.empty_like(d)
+        eps = 1e-3 * B
+        zeros = np.zeros(B, dtype=np.float32)
+        for k in range(nb):
+            Xk = X[k]
+            db = d[k * B:(k + 1) * B]
+            y = np.fft.irfft((Xk * self.W).sum(axis=0), 2 * B)[B:]
+            e = db - y
+            p_d = float(db @ db) / B + eps
+            p_e = float(e @ e) / B + eps
+            span = x[k * B:k * B + self.taps + B]        # كل الـ reference الذي يغطيه الفلتر
+            p_x = float(span @ span) / len(span) + eps
+
+            # double-talk (Geigel بـ ERL متعلَّم): المايك أعلى بكثير من أعلى صدى متوقع
+            # لهذا الـ reference → صوت قريب (المستخدم). لا يعتمد على تقارب الفلتر،
+            # فبداية cue جديد (محتوى لم يتعلمه الفلتر بعد) لا تُحسب مقاطعة.
+            far = p_x > 100.0
+            if far and p_d > self.dtd_ratio * self.erl * p_x:
+                self._dt_blocks += 1
+            else:
+                self._dt_blocks = 0
+            # double-talk مستمر > 2s = تغيّر مسار الصدى (الصوت أعلى) لا كلام → أعد التعلّم
+            if self._dt_blocks * B > 2 * self.rate:
+                self.erl *= 2.0
+                self._dt_blocks = 0
+            self.double_talk = self._dt_blocks > 0
+
+            x_pow = (Xk.real ** 2 + Xk.imag ** 2).mean(axis=0)
+            self._power = 0.9 * self._power + 0.1 * x_pow
+            last_block = k == nb - 1 and pad
+            if far and not self.double_talk:
+                if not last_block:
+                    E = np.fft.rfft(np.concatenate([zeros, e]))
+                    # bins شبه صامتة (cues نغمية) لا تُضخَّم: regularization نسبةً لمتوسط الطاقة
+                    G = np.conj(Xk) * E / (P * (self._power + self.reg * self._power.mean()) + eps)
+                    # gradient constraint: النصف الثاني من الاستجابة الزمنية = صفر
+                    g = np.fft.irfft(G, 2 * B, axis=-1)
+                    g[:, B:] = 0.0
+                    self.W += self.mu * np.fft.rfft(g, axis=-1)
+                self.erl = 0.95 * self.erl + 0.05 * min(p_d / p_x, 4.0)
+                self.erle = 0.9 * self.erle + 0.1 * (p_d / p_e)
+                # الروبوت وحده يتكلم → خفض ما تبقى من الصدى
+                e = e * self.suppress
+            out[k * B:(k + 1) * B] = e
+        return out[:n]
+
+    def _estimate_delay(self, t_end: float) -> None:
+        """GCC-PHAT between the last second of mic audio and the reference."""
+        self._since_estimate = 0
+        if not self._mic:
+            return
+        mic = np.concatenate(self._mic)
+        n = len(mic)
+        t_mic0 = t_end - n / self.rate
+        pre = self.max_delay
+        ref = self.ref.segment(t_mic0 - pre / self.rate, n + pre)
+        if float(ref @ ref) < (self.ref.silence_level ** 2) * len(ref) * 0.01:
+            return
+
+        size = 1 << int(np.ceil(np.log2(len(ref) + n)))
+        R = np.fft.rfft(ref, size)
+        M = np.fft.rfft(mic, size)
+        cross = M * np.conj(R)
+        cross /= np.abs(cross) + 1e-9
+        cc = np.fft.irfft(cross, size)
+        # mic[m] ≈ ref[m + pre - delay] → قمة عند lag = delay - pre (سالب، دائري)
+        lags = np.concatenate([cc[size - pre:], cc[:1]])     # lags[k] ↔ delay k
+        k = int(np.argmax(lags))
+        peak = float(lags[k])
+        if peak < 6.0 * float(np.mean(np.abs(lags))) + 1e-9:
+            return
+        if not self._delay_known or abs(k - self.delay) > self._margin:
+            if self._delay_known:
+                self.reset()
+            self.delay = k
+            self._delay_known = True
+
+
+# ==================== Quick Test ====================
+
+if __name__ == "__main__":
+    import glob
+    import wave
+
+    rate = 16000
+
+    def load(path):
+        with wave.open(path, "rb") as wf:
+            sr, ch = wf.getframerate(), wf.getnchannels()
+            x = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).reshape(-1, ch)
+        x = downmix(x, 1).astype(np.float32)
+        from resampler import resample
+        return resample(x, sr, rate)[:, 0]
+
+    clips = sorted(glob.glob("Resources/voice_msgs/*.wav"))
+    far = np.concatenate([load(p) for p in clips])[:rate * 6]       # الروبوت يتكلم 6s
+    near = load(clips[-1])[:rate * 2] * 0.8                          # المستخدم يقاطع عند 3s
+
+    rng = np.random.default_rng(1)
+    room = np.zeros(600, dtype=np.float32)
+    room[0] = 0.3
+    room[1:] = rng.normal(0, 0.04, 599) * np.exp(-np.arange(599) / 120.0)
+    acoustic = int(0.045 * rate)                                     # 45ms سماعة → مايك
+    echo = np.convolve(far, room)[:len(far)]
+    mic = np.zeros(len(far) + acoustic, dtype=np.float32)
+    mic[acoustic:] += echo
+    onset = 3 * rate
+    mic[onset:onset + len(near)] += near
+    mic += rng.normal(0, 20, len(mic))
+    mic = mic[:len(far)]
+
+    ref = PlaybackReference(rate=rate, device_rate=rate)
+    ec = EchoCanceller(ref, rate)
+    chunk, block, pushed = 256, 512, 0
+    clean = []
+    cpu = 0.0
+    for i in range(0, len(mic), chunk):
+        # الـ output callback يسبق الالتقاط بـ ~100ms (blocks من 512)
+        while pushed < min(len(far), i + rate // 10):
+            ref.push(far[pushed:pushed + block, None], play_time=100.0 + pushed / rate)
+            pushed += block
+        pcm = np.clip(mic[i:i + chunk], -32768, 32767).astype(np.int16).tobytes()
+        t0 = time.perf_counter()
+        out = ec.process(pcm, 100.0 + i / rate)
+        cpu += time.perf_counter() - t0
+        clean.append(np.frombuffer(out, dtype=np.int16))
+    cpu /= len(mic) / rate
+    clean = np.concatenate(clean).astype(np.float32)
+
+    def rms(a):
+        return float(np.sqrt(np.mean(a ** 2)))
+
+    echo_only = slice(rate * 2, onset)          # بعد ثانية تقارب
+    print(f"delay estimate   : {ec.delay_ms:.1f} ms (true 45.0)")
+    print(f"echo before/after: {rms(mic[echo_only]):.0f} → {rms(clean[echo_only]):.0f} rms "
+          f"({20 * np.log10(rms(mic[echo_only]) / rms(clean[echo_only])):.1f} dB, ERLE {ec.erle_db:.1f} dB)")
+    print(f"near-end kept    : {rms(clean[onset:onset + len(near)]) / rms(mic[onset:onset + len(near)]):.2f} "
+          f"of mic rms during double-talk")
+
+    # RMS VAD الافتراضي (عتبة 150): كم chunk صدى فقط يفتح التسجيل؟
+    def over(a, lo, hi):
+        levels = [rms(a[i:i + chunk]) for i in range(lo, hi, chunk)]
+        return levels, sum(v > 150 for v in levels) / float(len(levels))
+    _, raw_fp = over(mic, rate * 2, onset)
+    _, clean_fp = over(clean, rate * 2, onset)
+    print(f"echo chunks > VAD: {raw_fp:.0%} raw → {clean_fp:.0%} after AEC")
+    levels, _ = over(clean, onset, onset + rate)
+    first = next((k for k, v in enumerate(levels) if v > 150), None)
+    print(f"barge-in onset   : {'-' if first is None else f'{(first + 1) * chunk * 1000 / rate:.0f} ms'} "
+          f"after the user starts speaking")
+    print(f"CPU              : {cpu * 1000:.1f} ms per audio second")
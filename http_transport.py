@@ -0,0 +1,283 @@
+# http_transport.py
+# -------------------------------------------------------------------
+# Shared HTTP transport for STT / TTS / n8n
+# - Session واحدة مع keep-alive pools (لا TCP/TLS handshake جديد كل دور)
+# - timeouts لكل endpoint (connect, read)
+# - retry مع backoff + jitter
+# - pre-warming: فتح الاتصالات مسبقًا عند الإقلاع
+# - CancelScope: إلغاء طلب جارٍ فورًا من ثريد آخر (barge-in)
+# -------------------------------------------------------------------
+
+import socket
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from Config import Config
+
+
+# ==================== Cancellation ====================
+
+class RequestCancelled(Exception):
+    """Raised when a request starts inside an already-cancelled CancelScope."""
+
+
+_scope_local = threading.local()
+
+
+class CancelScope:
+    """
+    Cancels in-flight requests made by the thread(s) that entered it.
+
+    requests/urllib3 has no cancel API, so every connection used inside the
+    scope is recorded and cancel() shuts its socket down: the blocked
+    send()/recv() in the worker thread fails at once instead of waiting for
+    the server or the read timeout. A connection is forgotten as soon as it
+    goes back to the pool, so cancel() never touches a request it doesn't own.
+
+        scope = CancelScope()
+        # worker thread
+        with scope:
+            session.post(...)
+        # any other thread
+        scope.cancel()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conns = set()     # اتصالات مأخوذة من الـ pool حاليًا
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def __enter__(self) -> "CancelScope":
+        stack = getattr(_scope_local, "stack", None)
+        if stack is None:
+            stack = _scope_local.stack = []
+        stack.append(self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _scope_local.stack.remove(self)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            conns = list(self._conns)
+            self._conns.clear()
+        for conn in conns:
+            _shutdown_connection(conn)
+
+    def _attach(self, conn) -> None:
+        with self._lock:
+            if self._cancelled:
+                raise RequestCancelled("request cancelled")
+            self._conns.add(conn)
+        conn._cancel_scope = self
+
+    def _detach(self, conn) -> None:
+        with self._lock:
+            self._conns.discard(conn)
+
+
+def current_cancel_scope() -> Optional[CancelScope]:
+    """Innermost CancelScope entered by this thread (to hand over to helper threads)."""
+    stack = getattr(_scope_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def _shutdown_connection(conn) -> None:
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class _CancellableMixin:
+    def request(self, *args, **kwargs):
+        scope = current_cancel_scope()
+        if scope is not None:
+            scope._attach(self)
+        return super().request(*args, **kwargs)
+
+
+class _CancellableHTTPConnection(_CancellableMixin, HTTPConnection):
+    pass
+
+
+class _CancellableHTTPSConnection(_CancellableMixin, HTTPSConnection):
+    pass
+
+
+class _ReleasingPoolMixin:
+    def _put_conn(self, conn):
+        # الاتصال رجع للـ pool (الـ response انتهى أو أُغلق) → لم يعد ملك الـ scope؛
+        # ثريد آخر (STT / n8n) قد يأخذه، فلا يجب أن يغلقه cancel() لاحقًا
+        scope = getattr(conn, "_cancel_scope", None)
+        if scope is not None:
+            conn._cancel_scope = None
+            scope._detach(conn)
+        return super()._put_conn(conn)
+
+
+class _HTTPPool(_ReleasingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+
+class _HTTPSPool(_ReleasingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+
+# ==================== Adapters ====================
+
+class _EndpointAdapter(HTTPAdapter):
+    """HTTPAdapter that applies the endpoint's (connect, read) timeout by default."""
+
+    def __init__(self, timeout: Tuple[float, float], **kwargs):
+        self.default_timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # اتصالات قابلة للإلغاء (CancelScope)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.default_timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class HttpTransport:
+    """
+    One requests.Session shared by all API clients.
+
+    كل endpoint يُسجَّل بـ register() على URL prefix خاص به، ويحصل على
+    adapter (pool + retry + timeout) مستقل. requests يختار أطول prefix مطابق.
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        self.cfg = config or Config()
+        self.connect_timeout = float(getattr(self.cfg, "HTTP_CONNECT_TIMEOUT", 3.05))
+        self.retries = int(getattr(self.cfg, "RETRIES", 3))
+        self.backoff = float(getattr(self.cfg, "HTTP_BACKOFF", 0.3))
+        self.backoff_jitter = float(getattr(self.cfg, "HTTP_BACKOFF_JITTER", 0.2))
+
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": "AI-Robot/1.0"})
+
+        # Default adapter لأي URL غير مسجّل
+        default = self._make_adapter(float(getattr(self.cfg, "HTTP_TIMEOUT", 60)))
+        self.session.mount("https://", default)
+        self.session.mount("http://", default)
+
+        self._endpoints: Dict[str, str] = {}   # name -> url prefix
+        self._lock = threading.Lock()
+
+    # ---------------- Endpoints ----------------
+
+    def _make_retry(self, retry_status: bool) -> Retry:
+        return Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,                      # لا نعيد طلبًا وصل للسيرفر وانقطع أثناء الرد
+            status=self.retries if retry_status else 0,
+            backoff_factor=self.backoff,            # 0.3s, 0.6s, 1.2s
+            backoff_jitter=self.backoff_jitter,     # + عشوائية لتفادي التزامن
+            status_forcelist=[429, 500, 502, 503, 504] if retry_status else [],
+            allowed_methods=["POST", "GET", "HEAD"],
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+
+    def _make_adapter(self, read_timeout: float, retry_status: bool = True,
+                      pool_maxsize: int = 4) -> _EndpointAdapter:
+        return _EndpointAdapter(
+            timeout=(self.connect_timeout, read_timeout),
+            max_retries=self._make_retry(retry_status),
+            pool_connections=1,          # host واحد لكل endpoint
+            pool_maxsize=pool_maxsize,
+            pool_block=False,
+        )
+
+    def register(self, name: str, url: str, read_timeout: float,
+                 retry_status: bool = True, pool_maxsize: int = 4) -> str:
+        """
+        Register an endpoint URL with its own timeout/retry policy.
+        Use retry_status=False for non-replayable bodies (generators / streams).
+        Returns the URL (convenience).
+        """
+        url = url.rstrip("/")
+        if not url:
+            return url
+        with self._lock:
+            if self._endpoints.get(name) != url:
+                self.session.mount(url, self._make_adapter(read_timeout, retry_status, pool_maxsize))
+                self._endpoints[name] = url
+        return url
+
+    def timeout(self, name: str) -> Tuple[float, float]:
+        """(connect, read) timeout of a registered endpoint."""
+        url = self._endpoints.get(name)
+        adapter = self.session.get_adapter(url) if url else self.session.get_adapter("http://")
+        return adapter.default_timeout
+
+    # ---------------- Pre-warming ----------------
+
+    def warm_up(self, names: Optional[list] = None, background: bool = True):
+        """
+        Open (and keep alive) one connection per endpoint, TLS included,
+        so the first real request after boot skips the handshakes.
+        """
+        if background:
+            t = threading.Thread(target=self._warm_up, args=(names,), name="HttpWarmUp", daemon=True)
+            t.start()
+            return t
+        return self._warm_up(names)
+
+    def _warm_up(self, names: Optional[list]) -> Dict[str, bool]:
+        results = {}
+        for name, url in list(self._endpoints.items()):
+            if names and name not in names:
+                continue
+            try:
+                # HEAD خفيف: أي status (حتى 404/405) يعني أن الاتصال مفتوح وجاهز
+                resp = self.session.head(url, timeout=(self.connect_timeout, 5), allow_redirects=False)
+                resp.close()
+                results[name] = True
+                print(f"🔥 Warmed {name}: {url} ({resp.status_code})")
+            except requests.RequestException as ex:
+                results[name] = False
+                print(f"⚠️  Warm-up failed for {name}: {ex}")
+        return results
+
+    def close(self) -> None:
+        try:
+            self.session.close()
+        except Exception:
+            pass
+
+
+# ==================== Shared Instance ====================
+
+_transport_instance: Optional[HttpTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport(config: Optional[Config] = None) -> HttpTransport:
+    """Shared transport (one keep-alive session for the whole app)."""
+    global _transport_instance
+    with _transport_lock:
+        if _transport_instance is None:
+            _transport_instance = HttpTransport(config)
+        return _transport_instance
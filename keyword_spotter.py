@@ -0,0 +1,665 @@
+# keyword_spotter.py
+# -------------------------------------------------------------------
+# Local (offline) keyword spotting: wake word "Ziko/زيكو" + stop commands
+# - MFCC front end (NumPy فقط) يعمل على frames الميكروفون مباشرة
+# - قوالب (templates) مسجلة بصوت المستخدم + subsequence DTW
+# - الصوت لا يُرسل للسيرفر إلا بعد hit محلي (KeywordGate)
+#
+# Templates:  Resources/kws/<keyword>/*.wav   (16 kHz mono 16-bit)
+#   python keyword_spotter.py enroll zico 5          # تسجيل 5 عينات
+#   python keyword_spotter.py enroll stop 5
+# Corpus harness (labels بصيغة zico_test_results.txt → n:Label):
+#   python keyword_spotter.py corpus <dir_with_n.wav> [labels.txt] [negatives_dir]
+#   (takes من قسم "Execluded" في <dir>/excluded/n.wav)
+# CPU benchmark:
+#   python keyword_spotter.py bench
+# -------------------------------------------------------------------
+
+import os
+import re
+import time
+import wave
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# ==================== MFCC Front End ====================
+
+class MfccFrontEnd:
+    """
+    Streaming MFCC: push() raw int16 PCM, get back the new feature frames.
+    25 ms window / 10 ms hop, 26 mel bands, c1..c12 + log energy.
+    Each frame's log-mel is floored `mel_range` nats (~17 dB) below its
+    peak, so background noise in the weak bands barely moves the cepstrum.
+    """
+
+    def __init__(self, rate: int = 16000, frame_ms: int = 25, hop_ms: int = 10,
+                 n_mels: int = 26, n_ceps: int = 12, preemph: float = 0.97,
+                 mel_range: float = 4.0):
+        self.rate = rate
+        self.frame_len = rate * frame_ms // 1000
+        self.hop = rate * hop_ms // 1000
+        self.nfft = 1 << (self.frame_len - 1).bit_length()
+        self.preemph = preemph
+        self.n_ceps = n_ceps
+        self.mel_range = mel_range
+
+        self._window = np.hamming(self.frame_len).astype(np.float32)
+        self._mel = self._mel_filterbank(n_mels, self.nfft, rate, 20.0, min(7600.0, rate / 2 - 100))
+        # DCT-II (orthonormal) — نأخذ c1..c12 (c0 ≈ الطاقة، تُضاف منفصلة)
+        n = np.arange(n_mels)
+        k = np.arange(1, n_ceps + 1)[:, None]
+        self._dct = (np.sqrt(2.0 / n_mels) * np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels))).astype(np.float32)
+
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._last_sample = 0.0
+
+    @staticmethod
+    def _mel_filterbank(n_mels: int, nfft: int, rate: int, fmin: float, fmax: float) -> np.ndarray:
+        def hz_to_mel(f):
+            return 2595.0 * np.log10(1.0 + f / 700.0)
+
+        def mel_to_hz(m):
+            return 700.0 * (10 ** (m / 2595.0) - 1.0)
+
+        mels = np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2)
+        bins = np.floor((nfft + 1) * mel_to_hz(mels) / rate).astype(int)
+        fb = np.zeros((n_mels, nfft // 2 + 1), dtype=np.float32)
+        for m in range(1, n_mels + 1):
+            lo, c, hi = bins[m - 1], bins[m], bins[m + 1]
+            if c > lo:
+                fb[m - 1, lo:c] = (np.arange(lo, c) - lo) / (c - lo)
+            if hi > c:
+                fb[m - 1, c:hi] = (hi - np.arange(c, hi)) / (hi - c)
+        return fb
+
+    @property
+    def dim(self) -> int:
+        return self.n_ceps + 1
+
+    def reset(self) -> None:
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._last_sample = 0.0
+
+    def push(self, pcm: bytes) -> np.ndarray:
+        """Feed PCM bytes (int16 mono); returns (n_new_frames, dim) features."""
+        x = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        if x.size == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        # pre-emphasis مع استمرارية بين الـ chunks
+        y = np.empty_like(x)
+        y[0] = x[0] - self.preemph * self._last_sample
+        y[1:] = x[1:] - self.preemph * x[:-1]
+        self._last_sample = float(x[-1])
+
+        buf = np.concatenate((self._pending, y)) if self._pending.size else y
+        if buf.size < self.frame_len:
+            self._pending = buf
+            return np.zeros((0, self.dim), dtype=np.float32)
+        n = 1 + (buf.size - self.frame_len) // self.hop
+        idx = np.arange(self.frame_len)[None, :] + self.hop * np.arange(n)[:, None]
+        frames = buf[idx] * self._window
+        self._pending = buf[n * self.hop:]
+        return self._features(frames)
+
+    def _features(self, frames: np.ndarray) -> np.ndarray:
+        spec = np.fft.rfft(frames, n=self.nfft, axis=1)
+        power = (spec.real ** 2 + spec.imag ** 2) / self.nfft
+        mel = np.log(power @ self._mel.T + 1e-6)
+        mel = np.maximum(mel, mel.max(axis=1, keepdims=True) - self.mel_range)
+        ceps = mel @ self._dct.T
+        energy = np.log(power.sum(axis=1) + 1e-6)[:, None]
+        return np.hstack((ceps, energy)).astype(np.float32)
+
+    def compute(self, pcm: bytes) -> np.ndarray:
+        """Whole-clip MFCC (independent of the streaming state)."""
+        fe = MfccFrontEnd.__new__(MfccFrontEnd)
+        fe.__dict__.update(self.__dict__)
+        fe.reset()
+        return fe.push(pcm)
+
+
+# ==================== Templates + DTW ====================
+
+def _normalize(feats: np.ndarray) -> np.ndarray:
+    """
+    Gain-invariant view for DTW: c1..c12 are already level-independent,
+    log energy becomes its frame-to-frame delta. No per-segment statistics,
+    so a template and a streaming window are normalized identically.
+    """
+    out = feats.copy()
+    out[1:, -1] = np.diff(feats[:, -1])
+    out[0, -1] = 0.0
+    return out
+
+
+def _trim_silence(feats: np.ndarray, margin_db: float = 3.5) -> np.ndarray:
+    """Drop leading/trailing frames far below the peak energy (ln scale)."""
+    e = feats[:, -1]
+    keep = np.where(e >= e.max() - margin_db)[0]
+    if keep.size == 0:
+        return feats
+    return feats[max(0, keep[0] - 2): keep[-1] + 3]
+
+
+def subsequence_dtw(template: np.ndarray, seq: np.ndarray) -> np.ndarray:
+    """
+    Subsequence DTW (free start/end in `seq`) with Itakura-style steps
+    (1,1) (1,2) (2,1): warp slope between ½ and 2, so a template can never
+    collapse onto a couple of frames, and each template row is vectorized
+    over `seq`. Returns the length-normalized cost of the best match
+    ending at each frame of `seq`.
+    """
+    t_len = template.shape[0]
+    # Euclidean distances (t_len, s_len)
+    dist = (np.sum(template ** 2, axis=1)[:, None] + np.sum(seq ** 2, axis=1)[None, :]
+            - 2.0 * template @ seq.T)
+    dist = np.sqrt(np.maximum(dist, 0.0))
+
+    inf = np.inf
+    prev2 = np.full(dist.shape[1], inf)
+    prev = dist[0].copy()                # بداية حرة في أي مكان من seq
+    for i in range(1, t_len):
+        best = np.full_like(prev, inf)
+        best[1:] = np.minimum(prev[:-1], prev2[:-1])     # (1,1) و (2,1)
+        best[2:] = np.minimum(best[2:], prev[:-2])       # (1,2)
+        prev2, prev = prev, dist[i] + best
+    return prev / t_len
+
+
+@dataclass
+class KeywordTemplate:
+    keyword: str
+    feats: np.ndarray            # normalized MFCC
+    source: str = ""
+
+
+@dataclass
+class KeywordHit:
+    keyword: str
+    score: float                 # normalized DTW cost (أقل = أقرب)
+    threshold: float
+    at_frame: int                # feature frame index (10 ms) where the match ended
+
+
+# ==================== Spotter ====================
+
+class KeywordSpotter:
+    """
+    Streaming keyword spotter over MFCC frames.
+
+        spotter = KeywordSpotter.from_dir("Resources/kws")
+        hit = spotter.feed(pcm_chunk)      # KeywordHit | None
+
+    DTW يعمل كل `step_frames` (100 ms) على آخر ~1.5× طول القالب فقط،
+    ويتخطى الصمت (energy gate) → أقل بكثير من 5% من نواة Pi 5.
+    """
+
+    def __init__(
+        self,
+        templates: List[KeywordTemplate],
+        rate: int = 16000,
+        thresholds: Optional[Dict[str, float]] = None,
+        default_threshold: float = 2.0,
+        step_frames: int = 10,
+        refractory_sec: float = 1.0,
+        energy_margin: float = 2.5,
+    ):
+        if not templates:
+            raise ValueError("KeywordSpotter needs at least one template")
+        self.templates = templates
+        self.frontend = MfccFrontEnd(rate=rate)
+        self.keywords = sorted({t.keyword for t in templates})
+        self.thresholds = dict(thresholds or {})
+        for kw in self.keywords:
+            self.thresholds.setdefault(kw, self._auto_threshold(kw, default_threshold))
+        self.step_frames = step_frames
+        self.refractory_frames = int(refractory_sec * 100)
+        self.energy_margin = energy_margin
+
+        max_len = max(t.feats.shape[0] for t in templates)
+        self._history_len = int(max_len * 1.5) + step_frames
+        self._hist = np.zeros((self._history_len, self.frontend.dim), dtype=np.float32)
+        self._filled = 0
+        self._frame_no = 0
+        self._since_check = 0
+        self._last_hit_frame = -10 ** 9
+        self._noise_energy: Optional[float] = None
+        self._pending: Optional[KeywordHit] = None   # أفضل مرشح لم يُعلن بعد
+
+    # ---------------- Construction ----------------
+
+    @classmethod
+    def from_dir(cls, path: str, rate: int = 16000, **kwargs) -> "KeywordSpotter":
+        """Load Resources/kws/<keyword>/*.wav as templates."""
+        frontend = MfccFrontEnd(rate=rate)
+        templates = []
+        if os.path.isdir(path):
+            for keyword in sorted(os.listdir(path)):
+                kw_dir = os.path.join(path, keyword)
+                if not os.path.isdir(kw_dir):
+                    continue
+                for name in sorted(os.listdir(kw_dir)):
+                    if name.lower().endswith(".wav"):
+                        wav_path = os.path.join(kw_dir, name)
+                        pcm = _read_wav_pcm(wav_path, rate)
+                        templates.append(make_template(keyword, pcm, frontend, source=wav_path))
+        return cls(templates, rate=rate, **kwargs)
+
+    def _auto_threshold(self, keyword: str, default: float) -> float:
+        """
+        With ≥2 templates: 1.2 × the worst cost between enrolled samples,
+        kept inside [0.6, 1.0] × `default` (near-identical takes → too strict).
+        """
+        feats = [t.feats for t in self.templates if t.keyword == keyword]
+        if len(feats) < 2:
+            return default
+        costs = []
+        for i, a in enumerate(feats):
+            for j, b in enumerate(feats):
+                if i != j:
+                    costs.append(float(subsequence_dtw(a, b).min()))
+        return min(default, max(default * 0.6, max(costs) * 1.2))
+
+    def clone(self) -> "KeywordSpotter":
+        """Same templates/thresholds, independent streaming state (one per consumer)."""
+        return KeywordSpotter(self.templates, rate=self.frontend.rate, thresholds=self.thresholds,
+                              step_frames=self.step_frames,
+                              refractory_sec=self.refractory_frames / 100.0,
+                              energy_margin=self.energy_margin)
+
+    # ---------------- Streaming ----------------
+
+    def reset(self) -> None:
+        self.frontend.reset()
+        self._filled = 0
+        self._since_check = 0
+        self._pending = None
+        self._noise_energy = None
+
+    def feed(self, pcm: bytes) -> Optional[KeywordHit]:
+        """Push a PCM chunk; returns the best hit found in it (or None)."""
+        new = self.frontend.push(pcm)
+        hit = None
+        for start in range(0, new.shape[0], self.step_frames):
+            part = new[start:start + self.step_frames]
+            self._append(part)
+            self._since_check += part.shape[0]
+            if self._since_check >= self.step_frames:
+                self._since_check = 0
+                found = self._check()
+                if found is not None and (hit is None or found.score < hit.score):
+                    hit = found
+        return hit
+
+    def _append(self, feats: np.ndarray) -> None:
+        n = feats.shape[0]
+        if n == 0:
+            return
+        self._hist = np.roll(self._hist, -n, axis=0)
+        self._hist[-n:] = feats
+        self._filled = min(self._history_len, self._filled + n)
+        self._frame_no += n
+        # noise energy: تنزل بسرعة وتصعد ببطء
+        for e in feats[:, -1]:
+            if self._noise_energy is None or e < self._noise_energy:
+                self._noise_energy = float(e)
+            else:
+                self._noise_energy += 0.002 * (float(e) - self._noise_energy)
+
+    def _check(self) -> Optional[KeywordHit]:
+        """
+        Match templates against the newest frames. A candidate is announced
+        one step later, once its cost stops improving (the match's true end),
+        so the start of a keyword cannot fire before the whole keyword is in.
+        """
+        found = self._match()
+        pending = self._pending
+        if found is not None and (pending is None or found.score / found.threshold
+                                  < pending.score / pending.threshold):
+            self._pending = found
+            return None
+        if pending is None:
+            return None
+        self._pending = None
+        self._last_hit_frame = self._frame_no
+        return pending
+
+    def _match(self) -> Optional[KeywordHit]:
+        if self._frame_no - self._last_hit_frame < self.refractory_frames:
+            return None
+        window = self._hist[self._history_len - self._filled:]
+        if window.shape[0] < 10:
+            return None
+        # Energy gate: لا DTW على الصمت
+        recent = window[-self.step_frames:, -1]
+        if self._noise_energy is not None and recent.max() < self._noise_energy + self.energy_margin:
+            return None
+
+        seq = _normalize(window)
+        best = None
+        for tpl in self.templates:
+            if window.shape[0] < tpl.feats.shape[0] // 2:
+                continue
+            # نطابق فقط النهايات الجديدة (آخر step_frames)
+            cost = float(subsequence_dtw(tpl.feats, seq)[-self.step_frames:].min())
+            thr = self.thresholds[tpl.keyword]
+            if cost <= thr and (best is None or cost / thr < best.score / best.threshold):
+                best = KeywordHit(tpl.keyword, cost, thr, self._frame_no)
+        return best
+
+    def detect(self, pcm: bytes) -> List[KeywordHit]:
+        """Offline: all hits in a clip (fresh streaming state, same results as feed())."""
+        self.reset()
+        hits = []
+        step = self.frontend.hop * self.step_frames * 2
+        # + ذيل صامت قصير حتى يُعلن مرشح في آخر المقطع
+        tail = bytes(step * 2)
+        for i in range(0, len(pcm) + len(tail), step):
+            hit = self.feed((pcm + tail)[i:i + step] if i + step > len(pcm) else pcm[i:i + step])
+            if hit is not None:
+                hits.append(hit)
+        self.reset()
+        return hits
+
+
+def make_template(keyword: str, pcm: bytes, frontend: Optional[MfccFrontEnd] = None,
+                  source: str = "") -> KeywordTemplate:
+    frontend = frontend or MfccFrontEnd()
+    feats = _trim_silence(frontend.compute(pcm))
+    return KeywordTemplate(keyword=keyword, feats=_normalize(feats), source=source)
+
+
+# ==================== Gate (server only after a local hit) ====================
+
+class KeywordGate:
+    """
+    Holds recorded audio back from the server until the spotter hits one of
+    `keywords`; then flushes what was held to `downstream` and passes the
+    rest through.
+
+        gate = KeywordGate(spotter, ("zico", "زيكو"), downstream=stt_stream.feed)
+        recorder.record_until_silence(on_frame=gate.feed,
+                                      on_silence_start=gate.guard(speculative.submit))
+        if not gate.opened: → لا STT
+    """
+
+    def __init__(self, spotter: KeywordSpotter, keywords=None,
+                 downstream: Optional[Callable[[bytes], None]] = None):
+        self.spotter = spotter
+        self.keywords = set(keywords) if keywords else None
+        self.downstream = downstream
+        self.hit: Optional[KeywordHit] = None
+        self._held: List[bytes] = []
+        spotter.reset()
+
+    @property
+    def opened(self) -> bool:
+        return self.hit is not None
+
+    def feed(self, pcm: bytes) -> None:
+        if self.hit is None:
+            hit = self.spotter.feed(pcm)
+            if hit is not None and (self.keywords is None or hit.keyword in self.keywords):
+                self.hit = hit
+                print(f"🔑 Local keyword: {hit.keyword} (score {hit.score:.2f} / {hit.threshold:.2f})")
+                if self.downstream is not None:
+                    for held in self._held:
+                        self.downstream(held)
+                self._held.clear()
+            elif self.downstream is not None:
+                self._held.append(pcm)
+                return
+        if self.downstream is not None:
+            self.downstream(pcm)
+
+    def guard(self, fn: Optional[Callable]) -> Optional[Callable]:
+        """Wrap a callback so it only runs once the gate is open."""
+        if fn is None:
+            return None
+
+        def wrapped(*args, **kwargs):
+            if self.hit is not None:
+                return fn(*args, **kwargs)
+        return wrapped
+
+
+# ==================== Shared Instance ====================
+
+def load_spotter(config) -> Optional[KeywordSpotter]:
+    """Spotter from Config (KWS_ENABLED / KWS_DIR / KWS_THRESHOLD), or None."""
+    if not getattr(config, "KWS_ENABLED", False):
+        return None
+    path = getattr(config, "KWS_DIR", "Resources/kws")
+    try:
+        spotter = KeywordSpotter.from_dir(
+            path,
+            rate=int(getattr(config, "REC_SAMPLE_RATE", 16000)),
+            default_threshold=float(getattr(config, "KWS_THRESHOLD", 2.0)),
+        )
+    except ValueError:
+        print(f"⚠️ KWS enabled but no templates in {path} (python keyword_spotter.py enroll zico 5)")
+        return None
+    except Exception as ex:
+        print(f"⚠️ KWS load failed: {ex}")
+        return None
+    print(f"✅ Keyword spotter: {', '.join(f'{k}≤{v:.2f}' for k, v in spotter.thresholds.items())}")
+    return spotter
+
+
+def split_keywords(value: str) -> Tuple[str, ...]:
+    return tuple(w.strip() for w in (value or "").split(",") if w.strip())
+
+
+# ==================== Corpus Harness ====================
+
+def _read_wav_pcm(path: str, rate: int = 16000) -> bytes:
+    """WAV → int16 mono PCM at `rate` (linear resample when needed)."""
+    with wave.open(path, "rb") as wf:
+        sr, ch, width = wf.getframerate(), wf.getnchannels(), wf.getsampwidth()
+        raw = wf.readframes(wf.getnframes())
+    if width != 2:
+        raise ValueError(f"{path}: only 16-bit WAV supported")
+    x = np.frombuffer(raw, dtype=np.int16).astype(np.float32)
+    if ch > 1:
+        x = x.reshape(-1, ch).mean(axis=1)
+    if sr != rate:
+        n_out = int(len(x) * rate / sr)
+        x = np.interp(np.arange(n_out) * (sr / rate), np.arange(len(x)), x)
+    return np.clip(x, -32768, 32767).astype(np.int16).tobytes()
+
+
+def parse_labels(path: str) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """
+    zico_test_results.txt format:
+        n:Label            (what server STT heard for take n)
+        ...
+        Execluded results (...)
+        n:Label            (takes excluded from the score)
+    Returns (included, excluded). Excluded takes have their own numbering
+    (their WAVs live in <corpus>/excluded/).
+    """
+    included, excluded = {}, {}
+    target = included
+    line_re = re.compile(r"^\s*(\d+)\s*:\s*(.*)$")
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            if "xcluded" in line or "xecluded" in line:
+                target = excluded
+                continue
+            m = line_re.match(line)
+            if m:
+                target[int(m.group(1))] = m.group(2).strip()
+            elif line.strip() and not line.strip().startswith("="):
+                # بدون رقم: ترقيم تلقائي حسب الترتيب
+                target[len(target) + 1] = line.strip()
+    return included, excluded
+
+
+def _find_take(corpus_dir: str, n: int) -> Optional[str]:
+    pat = re.compile(rf"^0*{n}(?:\D.*)?\.wav$", re.IGNORECASE)
+    for name in sorted(os.listdir(corpus_dir)):
+        if pat.match(name):
+            return os.path.join(corpus_dir, name)
+    return None
+
+
+def run_corpus(spotter: KeywordSpotter, corpus_dir: str, labels_path: str,
+               negatives_dir: Optional[str] = None, wake_keywords=None) -> dict:
+    """
+    Score the local spotter against the STT labels of each take:
+      - local hit rate on the included takes (all of them said "Ziko")
+      - STT acceptance of the same takes (WakeWordDetector on the label)
+      - false accepts per hour on negatives_dir (no keyword inside)
+    """
+    from utilities import WakeWordDetector
+
+    wake = WakeWordDetector()
+    included, excluded = parse_labels(labels_path)
+    rows = []
+    cpu = audio_sec = 0.0
+    for group, labels in (("included", included), ("excluded", excluded)):
+        take_dir = corpus_dir if group == "included" else os.path.join(corpus_dir, "excluded")
+        for n, label in sorted(labels.items()):
+            path = _find_take(take_dir, n) if os.path.isdir(take_dir) else None
+            if path is None:
+                rows.append((group, n, label, None, None, None))
+                continue
+            pcm = _read_wav_pcm(path, spotter.frontend.rate)
+            t0 = time.process_time()
+            hits = [h for h in spotter.detect(pcm) if not wake_keywords or h.keyword in wake_keywords]
+            cpu += time.process_time() - t0
+            audio_sec += len(pcm) / 2 / spotter.frontend.rate
+            stt_ok = wake.extract_after_wake(label)[0]
+            rows.append((group, n, label, stt_ok, bool(hits), min((h.score for h in hits), default=None)))
+
+    neg_hits = 0
+    neg_sec = 0.0
+    if negatives_dir and os.path.isdir(negatives_dir):
+        for name in sorted(os.listdir(negatives_dir)):
+            if not name.lower().endswith(".wav"):
+                continue
+            pcm = _read_wav_pcm(os.path.join(negatives_dir, name), spotter.frontend.rate)
+            t0 = time.process_time()
+            hits = [h for h in spotter.detect(pcm) if not wake_keywords or h.keyword in wake_keywords]
+            cpu += time.process_time() - t0
+            sec = len(pcm) / 2 / spotter.frontend.rate
+            audio_sec += sec
+            neg_sec += sec
+            neg_hits += len(hits)
+
+    scored = [r for r in rows if r[0] == "included" and r[3] is not None]
+    return {
+        "rows": rows,
+        "local_recall": sum(r[4] for r in scored) / max(1, len(scored)),
+        "stt_recall": sum(r[3] for r in scored) / max(1, len(scored)),
+        "missing": sum(1 for r in rows if r[3] is None),
+        "false_accepts_per_hour": neg_hits / neg_sec * 3600 if neg_sec else None,
+        "cpu_ms_per_sec": cpu / audio_sec * 1000 if audio_sec else 0.0,
+    }
+
+
+# ==================== CLI ====================
+
+def _enroll(keyword: str, count: int, out_dir: str) -> None:
+    from audio_recorder import AudioRecorder
+
+    rec = AudioRecorder()
+    kw_dir = os.path.join(out_dir, keyword)
+    os.makedirs(kw_dir, exist_ok=True)
+    try:
+        for i in range(count):
+            input(f"🎤 [{i + 1}/{count}] Press Enter then say '{keyword}' once...")
+            pcm = rec.record_until_silence(max_duration=3.0, noise_calib_duration=0.5, end_frames=10,
+                                           post_silence_hold=0.1, min_speech_after_start=0.2,
+                                           threshold_boost=3.0)
+            path = os.path.join(kw_dir, f"{int(time.time() * 1000)}.wav")
+            with open(path, "wb") as f:
+                f.write(rec.pcm_to_wav(pcm))
+            print(f"✅ Saved {path} ({len(pcm) / 2 / rec.rate:.2f}s)")
+    finally:
+        rec.close()
+
+
+def _bench() -> None:
+    """CPU per audio second on Resources WAVs, template cut from one of them."""
+    import glob
+
+    res = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Resources")
+    clips = {os.path.relpath(p, res): _read_wav_pcm(p) for p in
+             sorted(glob.glob(os.path.join(res, "**", "*.wav"), recursive=True))}
+    src_name = os.path.join("voice_msgs", "zico_welcome.wav")
+    src = clips[src_name]
+    # قالب تجريبي: 0.6s من المقطع (بدل تسجيل المستخدم)
+    x = np.frombuffer(src, dtype=np.int16)
+    energy = np.convolve(x.astype(np.float32) ** 2, np.ones(1600) / 1600, mode="same")
+    start = int(np.argmax(energy > energy.max() * 0.05))
+    tpl_pcm = x[start:start + 9600].tobytes()
+    spotter = KeywordSpotter([make_template("probe", tpl_pcm)])
+
+    print("=" * 70)
+    print(f"🔑 KWS benchmark — template: 0.6s of {src_name}, "
+          f"threshold {spotter.thresholds['probe']:.2f}")
+    print("=" * 70)
+    cpu = audio = 0.0
+    for name, pcm in clips.items():
+        t0 = time.process_time()
+        hits = spotter.detect(pcm)
+        cpu += time.process_time() - t0
+        audio += len(pcm) / 2 / 16000
+        print(f"   {name:32s} hits={len(hits)}"
+              + (f" best={min(h.score for h in hits):.2f}" if hits else ""))
+    # ضوضاء متواصلة (أسوأ حالة: energy gate مفتوح دائمًا)
+    rng = np.random.default_rng(0)
+    noise = (rng.normal(0, 1500, 16000 * 10)).astype(np.int16).tobytes()
+    t0 = time.process_time()
+    spotter.detect(noise)
+    noise_cpu = time.process_time() - t0
+    spotter.energy_margin = -1e9
+    t0 = time.process_time()
+    spotter.detect(noise)
+    open_cpu = time.process_time() - t0
+    print("-" * 70)
+    print(f"   speech clips : {cpu / audio * 1000:.1f} ms CPU per audio second "
+          f"({cpu / audio * 100:.2f}% of one core)")
+    print(f"   10s noise    : {noise_cpu / 10 * 1000:.1f} ms CPU per audio second "
+          f"({noise_cpu / 10 * 100:.2f}% of one core)")
+    print(f"   gate forced  : {open_cpu / 10 * 1000:.1f} ms CPU per audio second "
+          f"({open_cpu / 10 * 100:.2f}% of one core) — DTW every 100 ms")
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    import sys
+
+    args = sys.argv[1:]
+    base = os.path.dirname(os.path.abspath(__file__))
+    kws_dir = os.path.join(base, "Resources", "kws")
+
+    if args[:1] == ["enroll"] and len(args) >= 2:
+        _enroll(args[1], int(args[2]) if len(args) > 2 else 5, kws_dir)
+    elif args[:1] == ["corpus"] and len(args) >= 2:
+        labels = args[2] if len(args) > 2 else os.path.join(base, "zico_test_results.txt")
+        negatives = args[3] if len(args) > 3 else None
+        spotter = KeywordSpotter.from_dir(kws_dir)
+        report = run_corpus(spotter, args[1], labels, negatives, wake_keywords=("zico", "زيكو", "ziko"))
+        for group, n, label, stt_ok, local, score in report["rows"]:
+            if stt_ok is None:
+                print(f"   {group:8s} #{n:<3d} {label:30s} (no recording)")
+                continue
+            print(f"   {group:8s} #{n:<3d} {label:30s} stt={'✅' if stt_ok else '❌'} "
+                  f"local={'✅' if local else '❌'}" + (f" score={score:.2f}" if score is not None else ""))
+        print("-" * 70)
+        print(f"   local recall : {report['local_recall']:.1%}")
+        print(f"   STT recall   : {report['stt_recall']:.1%}")
+        if report["false_accepts_per_hour"] is not None:
+            print(f"   false accepts: {report['false_accepts_per_hour']:.1f} / hour")
+        print(f"   CPU          : {report['cpu_ms_per_sec']:.1f} ms per audio second")
+        if report["missing"]:
+            print(f"   ⚠️ {report['missing']} labelled takes have no WAV in {args[1]}")
+    elif args[:1] == ["bench"] or not args:
+        _bench()
+    else:
+        print(__doc__ or "usage: python keyword_spotter.py [bench | enroll <kw> [n] | corpus <dir> [labels] [neg_dir]]")
@@ -0,0 +1,229 @@
+# latency_trace.py
+# -------------------------------------------------------------------
+# End-to-end latency tracing per conversation turn
+# - كل حدث = (turn, stage, start, end) بتوقيت time.monotonic()
+# - ring buffer محجوز مسبقًا (NumPy) → التسجيل بدون allocation في المسار الساخن
+# - span:  مدة مرحلة (capture, stt, n8n, tts, playback, ...)
+#   mark:  لحظة (vad_end, playback_start, ...) → تُقاس من vad_end
+# - export_jsonl(): سطر JSON لكل حدث (نفس أسلوب requests.jsonl)
+# - summary(): p50/p95/p99 لكل stage
+# الاستخدام:
+#     from latency_trace import TRACE
+#     TRACE.new_turn(); TRACE.mark("vad_end")
+#     with TRACE.span("stt"): ...
+# معطّل افتراضيًا (TRACE.enabled = False) → كل استدعاء يرجع فورًا.
+# -------------------------------------------------------------------
+
+import json
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+ANCHOR = "vad_end"          # الـ marks تُقاس منه (زمن انتظار المستخدم بعد ما يسكت)
+
+
+class LatencyTrace:
+    """
+    Fixed-capacity event ring. Oldest events are overwritten when full.
+
+    Thread-safe: spans come from the main loop, the TTS producer thread and
+    the n8n/STT calls running in executor threads.
+    """
+
+    def __init__(self, capacity: int = 4096, enabled: bool = False):
+        self.capacity = capacity
+        self.enabled = enabled
+        self._turn = np.zeros(capacity, dtype=np.int64)
+        self._stage = np.zeros(capacity, dtype=np.int16)
+        self._start = np.zeros(capacity, dtype=np.float64)
+        self._end = np.full(capacity, np.nan, dtype=np.float64)   # NaN = mark
+        self._count = 0                     # كل الأحداث منذ البداية (الـ index = count % capacity)
+        self._exported = 0
+        self._stages: List[str] = []
+        self._stage_ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.turn = 0
+
+    # ---------------- Recording ----------------
+
+    @staticmethod
+    def now() -> float:
+        return time.monotonic()
+
+    def new_turn(self) -> int:
+        """Start a new conversation turn; following events belong to it."""
+        with self._lock:
+            self.turn += 1
+            return self.turn
+
+    def record(self, stage: str, start: float, end: Optional[float] = None,
+               turn: Optional[int] = None) -> None:
+        """Store a span (start..end) or, with end=None, a mark at `start`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            sid = self._stage_ids.get(stage)
+            if sid is None:
+                sid = self._stage_ids[stage] = len(self._stages)
+                self._stages.append(stage)
+            i = self._count % self.capacity
+            self._turn[i] = self.turn if turn is None else turn
+            self._stage[i] = sid
+            self._start[i] = start
+            self._end[i] = np.nan if end is None else end
+            self._count += 1
+
+    def mark(self, stage: str) -> None:
+        if self.enabled:
+            self.record(stage, time.monotonic())
+
+    def span(self, stage: str):
+        """with TRACE.span("stt"): ...  (يُسجَّل حتى لو حدث exception)"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._count = 0
+            self._exported = 0
+
+    # ---------------- Reading ----------------
+
+    def events(self, since: int = 0) -> List[Dict]:
+        """Events still in the ring, oldest first (since = absolute event index)."""
+        with self._lock:
+            count = self._count
+            first = max(since, count - self.capacity)
+            idx = np.arange(first, count) % self.capacity
+            turns = self._turn[idx].tolist()
+            stages = [self._stages[s] for s in self._stage[idx].tolist()]
+            starts = self._start[idx].tolist()
+            ends = self._end[idx].tolist()
+
+        anchors: Dict[int, float] = {}
+        for turn, stage, start in zip(turns, stages, starts):
+            if stage == ANCHOR:
+                anchors[turn] = start
+
+        out = []
+        for turn, stage, start, end in zip(turns, stages, starts, ends):
+            ev = {"turn": turn, "stage": stage, "start": round(start, 6)}
+            if end == end:                  # span (NaN ≠ NaN → mark)
+                ev["end"] = round(end, 6)
+                ev["ms"] = round((end - start) * 1000.0, 2)
+            elif turn in anchors:
+                ev["since_vad_ms"] = round((start - anchors[turn]) * 1000.0, 2)
+            out.append(ev)
+        return out
+
+    def export_jsonl(self, path: str) -> int:
+        """Append events not exported yet; returns how many lines were written."""
+        with self._lock:
+            since = self._exported
+            self._exported = self._count
+        evs = self.events(since)
+        if evs:
+            with open(path, "a", encoding="utf-8") as f:
+                for ev in evs:
+                    f.write(json.dumps(ev, ensure_ascii=False) + "\n")
+        return len(evs)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        p50/p95/p99 (ms) per stage over the events in the ring.
+        spans → المدة؛ marks → الزمن منذ vad_end في نفس الـ turn.
+        """
+        values: Dict[str, List[float]] = {}
+        for ev in self.events():
+            v = ev.get("ms", ev.get("since_vad_ms"))
+            if v is not None and ev["stage"] != ANCHOR:
+                values.setdefault(ev["stage"], []).append(v)
+        out = {}
+        for stage, vals in values.items():
+            p50, p95, p99 = np.percentile(vals, [50, 95, 99])
+            out[stage] = {"n": len(vals), "p50": round(float(p50), 1),
+                          "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+        return out
+
+    def print_summary(self) -> None:
+        stats = self.summary()
+        if not stats:
+            return
+        print("⏱️ Latency per stage (ms)")
+        print(f"   {'stage':<18}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for stage, s in stats.items():
+            print(f"   {stage:<18}{s['n']:>6}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}")
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "t0")
+
+    def __init__(self, trace: LatencyTrace, stage: str):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.record(self.stage, self.t0, time.monotonic())
+        return False
+
+
+_NULL_SPAN = nullcontext()
+
+# مشترك بين كل الـ modules (main يفعّله من Config.LATENCY_TRACE)
+TRACE = LatencyTrace()
+
+
+# ==================== Quick Test ====================
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+
+    tr = LatencyTrace(capacity=1024, enabled=True)
+    for _ in range(200):
+        tr.new_turn()
+        t = tr.now()
+        capture = random.uniform(1.0, 4.0)
+        tr.record("capture", t, t + capture)
+        t += capture
+        tr.record("vad_end", t)
+        stt = random.uniform(0.2, 0.6)
+        tr.record("stt", t, t + stt)
+        n8n = random.uniform(0.5, 2.5)
+        tr.record("n8n_first_byte", t + stt, t + stt + n8n * 0.4)
+        tr.record("n8n", t + stt, t + stt + n8n)
+        tr.record("playback_start", t + stt + n8n * 0.4 + 0.3)
+
+    for stage, s in tr.summary().items():
+        print(f"{stage:<16} n={s['n']:<4} p50={s['p50']:8.1f}  p95={s['p95']:8.1f}  p99={s['p99']:8.1f}")
+    print(f"ring keeps last {len(tr.events())} of {tr._count} events")
+
+    path = os.path.join(tempfile.gettempdir(), "latency_trace_test.jsonl")
+    if os.path.exists(path):
+        os.remove(path)
+    print(f"exported {tr.export_jsonl(path)} lines → {path}; again: {tr.export_jsonl(path)}")
+
+    # كلفة التسجيل في المسار الساخن
+    n = 100_000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with tr.span("bench"):
+            pass
+    on = (time.perf_counter() - t0) / n * 1e6
+    tr.enabled = False
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with tr.span("bench"):
+            pass
+    off = (time.perf_counter() - t0) / n * 1e6
+    print(f"span cost: {on:.2f} µs enabled, {off:.2f} µs disabled")
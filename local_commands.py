@@ -6,8 +6,67 @@ Handles greetings, farewells, simple queries, and system control
 import re
 from datetime import datetime
 import random
-from typing import Tuple, Optional, Dict, FrozenSet
-from functools import lru_cache
+from typing import Tuple, Optional, Dict, Iterable, List, NamedTuple
+
+from spoken_phrases import SpokenPhrase, date_fragments, time_fragments
+
+
+class IntentMatch(NamedTuple):
+    """One phrase hit inside the normalized text."""
+    intent: str
+    priority: int       # smaller = checked first in handle()
+    start: int          # char span in the normalized text
+    end: int
+    phrase: str
+
+
+class IntentMatcher:
+    """
+    Word-token trie over all intent phrases (en + ar), built once.
+    
+    match() tokenizes the normalized text once and walks the trie from every
+    token: O(tokens × longest phrase) for ALL intents together, instead of
+    one regex search per intent and language.
+    Token = run of word chars, same boundaries as the old \\b...\\b regexes.
+    """
+    
+    _TOKEN_REGEX = re.compile(r'\w+')
+    
+    def __init__(self, intents: Dict[str, Iterable[str]]):
+        self._root: Dict = {}
+        self.depth = 0
+        self.priorities: Dict[str, int] = {}
+        for priority, (intent, phrases) in enumerate(intents.items()):
+            self.priorities[intent] = priority
+            for phrase in phrases:
+                words = self._TOKEN_REGEX.findall(phrase.lower())
+                if not words:
+                    continue
+                node = self._root
+                for word in words:
+                    node = node.setdefault(word, {})
+                node.setdefault(None, []).append((intent, priority, phrase))
+                self.depth = max(self.depth, len(words))
+    
+    def match(self, norm_text: str) -> List[IntentMatch]:
+        """All phrase hits, ordered by start then length."""
+        tokens = [(m.group(), m.start(), m.end()) for m in self._TOKEN_REGEX.finditer(norm_text)]
+        root, depth, n = self._root, self.depth, len(tokens)
+        out = []
+        for i in range(n):
+            node = root.get(tokens[i][0])
+            j = i
+            while node is not None:
+                hits = node.get(None)
+                if hits:
+                    start, end = tokens[i][1], tokens[j][2]
+                    for intent, priority, phrase in hits:
+                        out.append(IntentMatch(intent, priority, start, end, phrase))
+                j += 1
+                if j >= n or j - i >= depth:
+                    break
+                node = node.get(tokens[j][0])
+        return out
 
 
 class LocalCommandHandler:
@@ -15,11 +74,11 @@ class LocalCommandHandler:
     Ultra-fast local command handler optimized for Raspberry Pi Zero.
     
     Features:
-    - Lazy initialization (patterns compiled only when needed)
+    - Lazy initialization (intent trie built only when needed)
     - Singleton pattern support
     - State tracking (pause/resume counts, last command, etc.)
     - Configurable responses
-    - Pre-compiled regex for maximum speed
+    - Single-pass intent matching (one normalization, one trie walk)
     """
     
     # ==================== Class-level Constants ====================
@@ -92,8 +151,8 @@ class LocalCommandHandler:
             'resume_count': 0,
         } if enable_stats else None
         
-        # Lazy-loaded patterns (compiled on first use)
-        self._patterns_compiled = None
+        # Lazy-loaded intent trie (built on first use)
+        self._matcher = None
         self._responses = self._init_responses()
     
     def _init_responses(self) -> Dict:
@@ -191,47 +250,25 @@ class LocalCommandHandler:
     
     # ==================== Pattern Compilation (Lazy) ====================
     
-    def _compile_patterns(self) -> Dict:
-        """Lazy compilation of regex patterns (called only once, on first use)."""
-        if self._patterns_compiled is not None:
-            return self._patterns_compiled
-        
-        def compile_pattern_set(patterns_en: FrozenSet, patterns_ar: FrozenSet) -> Dict:
-            """Compile patterns for both languages."""
-            compiled = {}
-            
-            for lang, patterns in [('en', patterns_en), ('ar', patterns_ar)]:
-                sorted_patterns = sorted(patterns, key=len, reverse=True)
-                parts = []
-                
-                for phrase in sorted_patterns:
-                    phrase_norm = phrase.lower().strip()
-                    words = phrase_norm.split()
-                    
-                    if len(words) > 1:
-                        pattern = r'\b' + r'\s+'.join(re.escape(w) for w in words) + r'\b'
-                    else:
-                        pattern = r'\b' + re.escape(phrase_norm) + r'\b'
-                    
-                    parts.append(pattern)
-                
-                compiled[lang] = re.compile('|'.join(parts), re.IGNORECASE)
-            
-            return compiled
-        
-        self._patterns_compiled = {
-            'greeting': compile_pattern_set(self.GREETING_EN, self.GREETING_AR),
-            'goodbye': compile_pattern_set(self.GOODBYE_EN, self.GOODBYE_AR),
-            'thank_you': compile_pattern_set(self.THANK_YOU_EN, self.THANK_YOU_AR),
-            'time': compile_pattern_set(self.TIME_EN, self.TIME_AR),
-            'date': compile_pattern_set(self.DATE_EN, self.DATE_AR),
-            'pause': compile_pattern_set(self.PAUSE_EN, self.PAUSE_AR),
-            'resume': compile_pattern_set(self.RESUME_EN, self.RESUME_AR),
-            'how_are_you': compile_pattern_set(self.HOW_ARE_YOU_EN, self.HOW_ARE_YOU_AR),
-            'help': compile_pattern_set(self.HELP_EN, self.HELP_AR),
-        }
-        
-        return self._patterns_compiled
+    def _intent_matcher(self) -> IntentMatcher:
+        """Lazy build of the intent trie (called only once, on first use)."""
+        if self._matcher is not None:
+            return self._matcher
+        
+        # الترتيب = أولوية handle() (الأوامر أولًا)
+        self._matcher = IntentMatcher({
+            'pause': self.PAUSE_EN | self.PAUSE_AR,
+            'goodbye': self.GOODBYE_EN | self.GOODBYE_AR,
+            'resume': self.RESUME_EN | self.RESUME_AR,
+            'greeting': self.GREETING_EN | self.GREETING_AR,
+            'thank_you': self.THANK_YOU_EN | self.THANK_YOU_AR,
+            'how_are_you': self.HOW_ARE_YOU_EN | self.HOW_ARE_YOU_AR,
+            'help': self.HELP_EN | self.HELP_AR,
+            'time': self.TIME_EN | self.TIME_AR,
+            'date': self.DATE_EN | self.DATE_AR,
+        })
+        
+        return self._matcher
     
     # ==================== Utility Methods ====================
     
@@ -256,17 +293,15 @@ class LocalCommandHandler:
         
         return 'arabic' if (arabic_count / total_count) > 0.3 else 'english'
     
+    def match_intents(self, text: str) -> Tuple[str, List[IntentMatch]]:
+        """Normalize once and return (normalized_text, all intent matches)."""
+        norm_text = self.normalize_text(text)
+        return norm_text, self._intent_matcher().match(norm_text)
+    
     def has_pattern(self, text: str, pattern_name: str) -> bool:
         """Check if text matches any pattern."""
-        patterns = self._compile_patterns()
-        norm_text = self.normalize_text(text)
-        
-        pattern_dict = patterns.get(pattern_name, {})
-        for regex in pattern_dict.values():
-            if regex.search(norm_text):
-                return True
-        
-        return False
+        _, matches = self.match_intents(text)
+        return any(m.intent == pattern_name for m in matches)
     
     def pick_response(self, response_type: str, text: str) -> str:
         """Pick appropriate response based on language."""
@@ -283,31 +318,33 @@ class LocalCommandHandler:
         return responses
     
     @staticmethod
-    @lru_cache(maxsize=1)
-    def get_local_time() -> str:
-        """Get current time (cached for 1 second)."""
-        return datetime.now().strftime("%I:%M %p")
+    def get_local_time(now: Optional[datetime] = None) -> str:
+        """Get current time."""
+        return (now or datetime.now()).strftime("%I:%M %p")
     
     @staticmethod
-    def get_local_date() -> str:
+    def get_local_date(now: Optional[datetime] = None) -> str:
         """Get current date."""
-        return datetime.now().strftime("%A, %B %d, %Y")
+        return (now or datetime.now()).strftime("%A, %B %d, %Y")
     
     # ==================== Greeting Detection ====================
     
     def split_greeting_and_remainder(self, text: str) -> Tuple[Optional[str], str]:
         """Fast greeting detection and separation."""
-        norm = self.normalize_text(text)
-        patterns = self._compile_patterns()
-        
-        for regex in patterns['greeting'].values():
-            m = regex.match(norm)
-            if m:
-                greeting_found = m.group(0)
-                remainder = norm[m.end():].strip()
-                return greeting_found, remainder
-        
-        return None, norm
+        return self._split_greeting(*self.match_intents(text))
+    
+    @staticmethod
+    def _split_greeting(norm: str, matches: List[IntentMatch]) -> Tuple[Optional[str], str]:
+        """Longest greeting at the very start of `norm` + the rest."""
+        best = None
+        for m in matches:
+            if m.start > 0:
+                break
+            if m.intent == 'greeting' and (best is None or m.end > best.end):
+                best = m
+        if best is None:
+            return None, norm
+        return norm[:best.end], norm[best.end:].strip()
     
     def looks_like_question_or_command(self, text: str) -> bool:
         """Detect if text has actionable content."""
@@ -374,23 +411,25 @@ class LocalCommandHandler:
             self._stats['total_commands'] += 1
         
         original_text = text
+        norm, matches = self.match_intents(original_text)
+        intents = {m.intent for m in matches}
         
         # 1) Control commands (highest priority)
-        if self.has_pattern(original_text, 'pause'):
+        if 'pause' in intents:
             self._is_paused = True
             if self._stats:
                 self._stats['pause_count'] += 1
                 self._stats['local_handled'] += 1
             return False, self.pick_response('pause', original_text), 'pause', ""
         
-        if self.has_pattern(original_text, 'goodbye'):
+        if 'goodbye' in intents:
             self._is_paused = True
             if self._stats:
                 self._stats['pause_count'] += 1
                 self._stats['local_handled'] += 1
             return False, self.pick_response('goodbye', original_text), 'pause', ""
         
-        if self.has_pattern(original_text, 'resume'):
+        if 'resume' in intents:
             self._is_paused = False
             if self._stats:
                 self._stats['resume_count'] += 1
@@ -398,7 +437,7 @@ class LocalCommandHandler:
             return False, self.pick_response('resume', original_text), 'resume', ""
         
         # 2) Greetings with passthrough
-        greeting_phrase, remainder = self.split_greeting_and_remainder(original_text)
+        greeting_phrase, remainder = self._split_greeting(norm, matches)
         
         if greeting_phrase is not None:
             if not remainder or not self.looks_like_question_or_command(remainder):
@@ -414,34 +453,39 @@ class LocalCommandHandler:
             return True, self.pick_response('greeting', original_text), 'resume', remainder
         
         # 3) Simple local queries
-        if self.has_pattern(original_text, 'thank_you'):
+        if 'thank_you' in intents:
             if self._stats:
                 self._stats['local_handled'] += 1
             return False, self.pick_response('thank_you', original_text), None, ""
         
-        if self.has_pattern(original_text, 'how_are_you'):
+        if 'how_are_you' in intents:
             if self._stats:
                 self._stats['local_handled'] += 1
             return False, self.pick_response('how_are_you', original_text), None, ""
         
-        if self.has_pattern(original_text, 'help'):
+        if 'help' in intents:
             lang = self.detect_language(original_text)
             if self._stats:
                 self._stats['local_handled'] += 1
             return False, self._responses['help'][lang], None, ""
         
-        if self.has_pattern(original_text, 'time'):
-            current_time = self.get_local_time()
+        if 'time' in intents:
+            now = datetime.now()
+            current_time = self.get_local_time(now)
             lang = self.detect_language(original_text)
             resp = f"الوقت الآن {current_time}" if lang == 'arabic' else f"The current time is {current_time}"
+            # SpeechPipeline ينطقها من fragments جاهزة (بدون طلب TTS)
+            resp = SpokenPhrase(resp, time_fragments(now, lang))
             if self._stats:
                 self._stats['local_handled'] += 1
             return False, resp, None, ""
         
-        if self.has_pattern(original_text, 'date'):
-            current_date = self.get_local_date()
+        if 'date' in intents:
+            now = datetime.now()
+            current_date = self.get_local_date(now)
             lang = self.detect_language(original_text)
             resp = f"التاريخ اليوم {current_date}" if lang == 'arabic' else f"Today is {current_date}"
+            resp = SpokenPhrase(resp, date_fragments(now, lang))
             if self._stats:
                 self._stats['local_handled'] += 1
             return False, resp, None, ""
@@ -563,9 +607,87 @@ if __name__ == "__main__":
         print(f"  Throughput: {iterations/elapsed:.0f} calls/sec")
         print()
     
+    # Microbenchmark: old path (normalize + 2 regex per intent, up to 9×) vs trie
+    print("🔬 Intent matching: per-intent regex vs single-pass trie:")
+    print("-" * 70)
+    
+    def compile_legacy(h):
+        def pattern_set(*sets):
+            out = []
+            for patterns in sets:
+                parts = []
+                for phrase in sorted(patterns, key=len, reverse=True):
+                    words = phrase.lower().strip().split()
+                    parts.append(r'\b' + r'\s+'.join(re.escape(w) for w in words) + r'\b')
+                out.append(re.compile('|'.join(parts), re.IGNORECASE))
+            return out
+        return {
+            'pause': pattern_set(h.PAUSE_EN, h.PAUSE_AR),
+            'goodbye': pattern_set(h.GOODBYE_EN, h.GOODBYE_AR),
+            'resume': pattern_set(h.RESUME_EN, h.RESUME_AR),
+            'greeting': pattern_set(h.GREETING_EN, h.GREETING_AR),
+            'thank_you': pattern_set(h.THANK_YOU_EN, h.THANK_YOU_AR),
+            'how_are_you': pattern_set(h.HOW_ARE_YOU_EN, h.HOW_ARE_YOU_AR),
+            'help': pattern_set(h.HELP_EN, h.HELP_AR),
+            'time': pattern_set(h.TIME_EN, h.TIME_AR),
+            'date': pattern_set(h.DATE_EN, h.DATE_AR),
+        }
+    
+    legacy = compile_legacy(handler)
+    
+    def classify_legacy(text):
+        """Same order as handle() before the trie (normalizes on every check)."""
+        def has(name):
+            norm = LocalCommandHandler.normalize_text(text)
+            return any(r.search(norm) for r in legacy[name])
+        for name in ('pause', 'goodbye', 'resume'):
+            if has(name):
+                return name
+        norm = LocalCommandHandler.normalize_text(text)
+        for r in legacy['greeting']:
+            if r.match(norm):
+                return 'greeting'
+        for name in ('thank_you', 'how_are_you', 'help', 'time', 'date'):
+            if has(name):
+                return name
+        return None
+    
+    def classify_trie(text):
+        norm, matches = handler.match_intents(text)
+        intents = {m.intent for m in matches}
+        for name in ('pause', 'goodbye', 'resume'):
+            if name in intents:
+                return name
+        if handler._split_greeting(norm, matches)[0] is not None:
+            return 'greeting'
+        for name in ('thank_you', 'how_are_you', 'help', 'time', 'date'):
+            if name in intents:
+                return name
+        return None
+    
+    corpus = [
+        "hello", "مرحبا كيف حالك", "what time is it", "كم الساعة الان؟",
+        "explain how a transformer neural network works in simple words please",
+        "اشرح لي كيف تعمل الشبكات العصبية بطريقة بسيطة من فضلك",
+        "thank you very much", "good night ziko", "ما التاريخ اليوم", "tell me a story",
+    ]
+    mismatches = [t for t in corpus if classify_legacy(t) != classify_trie(t)]
+    print(f"Same intent on {len(corpus) - len(mismatches)}/{len(corpus)} samples {mismatches or ''}")
+    
+    iterations = 2000
+    for label, fn in (("regex", classify_legacy), ("trie", classify_trie)):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for t in corpus:
+                fn(t)
+        per_call = (time.perf_counter() - start) / (iterations * len(corpus)) * 1_000_000
+        print(f"  {label:<6} {per_call:8.2f}μs per utterance")
+    print("  (Pi Zero ≈ 10-15× slower than a desktop core; compare the ratio)")
+    print()
+    
     print("=" * 70)
     print("✨ Class-based advantages:")
-    print("  • Lazy pattern compilation (faster startup)")
+    print("  • Lazy intent trie (faster startup)")
     print("  • State management (pause/resume tracking)")
     print("  • Statistics tracking (optional)")
     print("  • Singleton support (memory efficient)")
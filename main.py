@@ -6,13 +6,11 @@
 # ------------------- Import Libraries -------------------
 import time
 import numpy as np
-import sounddevice as sd
 import io
 import wave
-from typing import Tuple
 
 from audio_recorder import AudioRecorder
-from speech_to_text import SpeechToText
+from speech_to_text import SpeechToText, SpeculativeTranscriber
 from text_to_speech import TextToSpeech
 from ai_n8n import N8nClient
 
@@ -26,7 +24,14 @@ import argparse
 from Config import Config
 from utilities import WakeWordDetector, StopCommandDetector
 from local_commands import LocalCommandHandler
-from audio_player import AudioPlayer
+from audio_player import AudioPlayer, CHANNEL_SPEECH, barge_in_ducker
+from echo_canceller import EchoCanceller
+from speech_pipeline import SpeechPipeline
+from assistant_async import AsyncAssistant, run_async_assistant
+from keyword_spotter import KeywordGate, load_spotter, split_keywords
+from latency_trace import TRACE
+from tts_cache import response_texts, warm_up
+from spoken_phrases import FragmentBank
 
 
 # ================= System State Manager =================
@@ -89,12 +94,8 @@ class SystemState:
         with self.lock:
             print("\n⚠️ INTERRUPT: User is speaking - stopping all processes...")
             try:
-                sd.stop()
-            except:
-                pass
-            try:
-                audio_player.stop_current()   # <-- مهم لإيقاف أي صوت جارٍ
-                audio_player.flush_queue()    # اختياري لمسح أي أصوات انتظار
+                speech.stop()                 # يلغي TTS المتبقي
+                audio_player.stop_current()   # <-- يوقف كل الأصوات (cues + كلام TTS) ويمسح الانتظار
             except:
                 pass
             self.clear_all_queues()           # لو عندك طوابير أخرى أضفها هنا
@@ -126,16 +127,24 @@ stt = SpeechToText()
 tts = TextToSpeech()
 n8n = N8nClient()
 config = Config()
+# 🔑 Keyword spotting محلي (wake word + stop) — None لو KWS_ENABLED=False أو لا توجد قوالب
+kws = load_spotter(config)
+kws_wake_words = split_keywords(config.KWS_WAKE_WORDS)
+kws_stop_words = split_keywords(config.KWS_STOP_WORDS)
 # ===================== Global Variables =====================
 allow_interruption = False
 allow_wake_word = True
+async_loop = False
 device = "raspi5"
 # ------------------- Queues for Thread Communication -------------------
 audio_queue = Queue(maxsize=3)
 system_state = SystemState()
 stopCommandDetector = StopCommandDetector()
 wakewordDetector = WakeWordDetector()
-audio_player = AudioPlayer(sample_rate=16000, channels=1, frames_per_buffer=512)
+# stream إخراج دائم بـ 22050Hz mono (صيغة أغلب الـ cues وصوت TTS → بدون resample)
+audio_player = AudioPlayer(sample_rate=22050, channels=1, frames_per_buffer=512)
+# TTS يُشغّل عبر audio_player (نفس الـ stream ونفس مسار الإيقاف)
+speech = SpeechPipeline(tts, audio_player)
 
 #localCommandHandler = get_handler(enable_stats=True)
 localCommandHandler = LocalCommandHandler(language_preference='english ', enable_stats = False)
@@ -163,32 +172,11 @@ def np_int16_to_wav_bytes(arr: np.ndarray, sample_rate: int, channels: int = 1)
     return buf.getvalue()
 
 
-def wav_bytes_to_np_int16(wav_bytes: bytes) -> Tuple[np.ndarray, int]:
-    """
-    Parse WAV bytes to (int16 mono numpy array, sample_rate).
-    If source is stereo, average to mono.
-    """
-    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
-        sr = wf.getframerate()
-        ch = wf.getnchannels()
-        sw = wf.getsampwidth()
-        frames = wf.readframes(wf.getnframes())
-
-    if sw != 2:
-        raise ValueError("Only 16-bit WAV supported")
-    arr = np.frombuffer(frames, dtype=np.int16)
-    if ch == 2:
-        arr = arr.reshape(-1, 2).mean(axis=1).astype(np.int16)  # mono
-
-    return arr, sr
-
-
 def play_wav_bytes(wav_bytes: bytes) -> None:
     """
-    Play WAV bytes fully in-memory using sounddevice.
+    Play WAV bytes fully in-memory through audio_player (blocking).
     """
-    audio, sr = wav_bytes_to_np_int16(wav_bytes)
-    sd.play(audio, samplerate=sr, blocking=True)
+    audio_player.play_wav_bytes(wav_bytes, blocking=True)
     
 
 
@@ -200,6 +188,8 @@ def parse_args():
 
     parser.add_argument("--allow_wake_word", type=lambda v: v.lower() == "true", default=None)
 
+    parser.add_argument("--async_loop", type=lambda v: v.lower() == "true", default=None)
+
     parser.add_argument(
         "--device",
         type=str,
@@ -212,8 +202,8 @@ def parse_args():
 
 def stop_speaking():
     try:
+        speech.stop()
         audio_player.stop_current()
-        sd.stop()
     except Exception:
         pass
 
@@ -223,27 +213,24 @@ def speak_safe(text: str):
     # first stop speaking
     stop_speaking()
 
-    # تحويل النص إلى صوت (TTS)
-    try:
-        wav_reply = tts.tts(text, as_fmt="wav")
-        
-        if not wav_reply:
-            print("❌ No audio generated")
-            return
-            
-    except Exception as ex:
-        print(f"❌ TTS error: {ex}")
-        return
-
-    # 5) تشغيل الصوت من الذاكرة مباشرة
+    # TTS جملة بجملة: الجملة التالية تُحوَّل أثناء تشغيل الحالية
     try:
         print("🔊 Playing response...")
-        play_wav_bytes(wav_reply)
-        print("✅ Playback finished\n")
+        if speech.speak(text):
+            print("✅ Playback finished\n")
+        else:
+            print("⏹️ Playback stopped\n")
     except Exception as ex:
         print(f"❌ Playback error: {ex}")
 
 
+def ai_sentences(prompt_text: str):
+    """Stream the n8n reply sentence by sentence (printed as they arrive)."""
+    for sentence in n8n.chat_sentences("123456", prompt_text):
+        print(f"🤖 AI: {sentence}")
+        yield sentence
+
+
 def safe_put(q, item):
     try:
         q.put_nowait(item)
@@ -254,12 +241,13 @@ def safe_put(q, item):
 # ------------------- Utility Methods END-------------------
 # ===================== Initialize Global Settings =====================
 def initialize_settings():
-    global allow_interruption, allow_wake_word, device
+    global allow_interruption, allow_wake_word, async_loop, device
 
     args = parse_args()
 
     allow_interruption = (args.allow_interruption if args.allow_interruption is not None else config.ALLOW_INTERRUPTION)
     allow_wake_word = (args.allow_wake_word if args.allow_wake_word is not None else config.ALLOW_WAKE_WORD )
+    async_loop = (args.async_loop if args.async_loop is not None else config.ASYNC_LOOP)
 
     device = args.device or config.DEVICE
 
@@ -268,6 +256,7 @@ def initialize_settings():
     print("\n========= CONFIGURATION =========")
     print(f"allow_interruption = {allow_interruption}")
     print(f"allow_wake_word    = {allow_wake_word}")
+    print(f"async_loop         = {async_loop}")
     print(f"device             = {device}")
     print("=================================\n")
 
@@ -276,7 +265,8 @@ def initialize_settings():
 def cleanup():
     print("\n🧹 Cleaning up resources...")
     try:
-        sd.stop()
+        speech.stop()
+        audio_player.stop_current()
         print("✅ Audio stopped")
     except Exception as ex:
         print(f"⚠️  Audio stop error: {ex}")
@@ -295,7 +285,7 @@ def cleanup():
 
     try:
         recorder.close()
-        print("✅ Recorder closed")
+        print(f"✅ Recorder closed ({recorder.capture_stats()})")
     except Exception as ex:
         print(f"⚠️  Recorder close error: {ex}")
 
@@ -305,6 +295,20 @@ def cleanup():
     except Exception as ex:
         print(f"⚠️  audio_player close error: {ex}")
 
+    if n8n.cache is not None:
+        n8n.cache.flush()   # الحفظ على القرص مؤجل — اكتب الباقي قبل الخروج
+        print(f"✅ n8n answer cache: {n8n.cache.stats()}")
+    if tts.cache is not None:
+        print(f"✅ TTS audio cache: {tts.cache.stats()}")
+
+    if TRACE.enabled:
+        try:
+            n = TRACE.export_jsonl(config.LATENCY_TRACE_PATH)
+            print(f"✅ Latency trace: {n} events → {config.LATENCY_TRACE_PATH}")
+            TRACE.print_summary()
+        except Exception as ex:
+            print(f"⚠️  Latency trace export error: {ex}")
+
 
 
     print("\n" + "="*60)
@@ -323,10 +327,15 @@ def interruption_thread():
     - If detected, triggers SystemState.interrupt() immediately and plays a short 'cancelled' chime.
     - Keeps CPU usage reasonable by sleeping briefly between empty windows.
     """
+    if kws is not None:
+        interruption_thread_kws()
+        return
+
     while system_state.is_active:
         if system_state.allow_listening_to_user:
             try:
                 # Small capture window: fast turnaround and low latency.
+                # (صوت الروبوت يُلغى في الالتقاط لو AEC_ENABLED → الـ VAD يسمع المستخدم فقط)
                 audio_buf = recorder.record_until_silence(
                     max_duration=1.3,          # small window (tune 1.0–1.5s)
                     noise_calib_duration=0.0,  # no calibration per window to keep latency low
@@ -335,7 +344,11 @@ def interruption_thread():
                     post_silence_hold=0.0,
                     pre_roll_ms=200,
                     min_speech_after_start=0.2,
-                    threshold_boost=0.0
+                    threshold_boost=0.0,
+                    # بدون AEC صدى الروبوت نفسه يشغّل الـ ducker → لا ducking
+                    on_frame=barge_in_ducker(audio_player, config.BARGE_IN_DUCK_GAIN,
+                                             config.BARGE_IN_DUCK_RMS)
+                             if recorder.echo is not None else None
                 )
                 if not audio_buf:
                     # No voice activity detected in this small window.
@@ -344,11 +357,13 @@ def interruption_thread():
 
                 # Transcribe the small window. Use the same STT engine.
                 try:
-                    partial = stt.transcribe(audio_buf)
+                    partial = stt.transcribe(recorder.pcm_to_wav(audio_buf))
                 except Exception:
                     # If STT fails for a tiny chunk, just skip silently.
                     continue
 
+                if isinstance(partial, dict):
+                    partial = partial.get('text', '')
                 if not partial:
                     continue
 
@@ -365,6 +380,66 @@ def interruption_thread():
             except Exception:
                 # Soft-fail to keep the barge-in listener robust.
                 time.sleep(0.1)
+            finally:
+                # ليس "stop" (أو انتهى الكلام) → أرجع صوت الروبوت
+                audio_player.set_channel_gain(CHANNEL_SPEECH, 1.0)
+
+def interruption_thread_kws():
+    """
+    Barge-in with the local keyword spotter: frames are read from the
+    capture ring and matched on-device. A stop keyword interrupts at once;
+    a wake keyword sends only the short window around it to STT.
+    """
+    spotter = kws.clone()
+    reader = recorder.reader()
+    chunk_bytes = recorder.bytes_per_chunk
+    while system_state.is_active:
+        if not system_state.allow_listening_to_user:
+            reader.skip_to_now()
+            spotter.reset()
+            time.sleep(0.05)
+            continue
+        try:
+            data = reader.read(chunk_bytes, timeout=0.5)
+            if not data:
+                continue
+            hit = spotter.feed(data)
+            if hit is None:
+                continue
+
+            stop = hit.keyword in kws_stop_words
+            if not stop and hit.keyword in kws_wake_words:
+                # "زيكو ..." → نافذة قصيرة (تشمل كلمة النداء) إلى STT
+                audio_buf = recorder.record_until_silence(
+                    max_duration=1.5,
+                    noise_calib_duration=0.0,
+                    start_frames=2,
+                    end_frames=8,
+                    post_silence_hold=0.0,
+                    pre_roll_ms=1000,
+                    min_speech_after_start=0.2,
+                    threshold_boost=0.0
+                )
+                reader.skip_to_now()
+                if not audio_buf:
+                    continue
+                try:
+                    partial = stt.transcribe(recorder.pcm_to_wav(audio_buf))
+                except Exception:
+                    continue
+                if isinstance(partial, dict):
+                    partial = partial.get('text', '')
+                stop = bool(partial) and stopCommandDetector.is_stop_with_optional_wake(partial)
+
+            if stop:
+                system_state.interrupt()
+                print("🛑 BARGE-IN: stop detected (local keyword spotter).")
+                audio_player.play_blocking("Resources/voice_msgs/listening.wav")
+                system_state.resume_listening()
+                reader.skip_to_now()
+                spotter.reset()
+        except Exception:
+            time.sleep(0.1)
 
 # ------------------- Main Function -------------------
 def main_thread():
@@ -396,7 +471,40 @@ def main_thread():
                 continue
 
             print("ℹ️ Listening...")
+            # Streaming STT: الرفع يبدأ مع أول chunk بدل انتظار نهاية الكلام
+            stt_session = None
+            if config.STT_STREAMING:
+                stt_session = stt.open_stream(
+                    sample_rate=recorder.rate,
+                    sample_width=recorder.width,
+                    channels=recorder.channels
+                )
+
+            # Speculative STT: يبدأ مع أول صمت، ويُلغى لو المستخدم أكمل الكلام
+            speculative = None
+            if stt_session is None and config.STT_SPECULATIVE:
+                speculative = SpeculativeTranscriber(
+                    stt,
+                    sample_rate=recorder.rate,
+                    sample_width=recorder.width,
+                    channels=recorder.channels
+                )
+
+            # الصوت أثناء التسجيل: stream STT، أو ترميز الرفع المضغوط للـ speculative STT
+            downstream = stt_session.feed if stt_session else (speculative.feed if speculative else None)
+
+            # Local wake word: لا يُرسل شيء للسيرفر قبل hit محلي (wake أو stop)
+            gate = None
+            if kws is not None and allow_wake_word:
+                gate = KeywordGate(
+                    kws,
+                    kws_wake_words + kws_stop_words,
+                    downstream=downstream
+                )
+
             # 1) تسجيل الصوت (PCM خام)
+            TRACE.new_turn()
+            t_capture = TRACE.now()
             audio_pcm = recorder.record_until_silence(
                 max_duration=25.0,
                 noise_calib_duration=0.8,
@@ -405,31 +513,49 @@ def main_thread():
                 post_silence_hold=0.35,
                 pre_roll_ms=350,
                 min_speech_after_start=1.8,
-                threshold_boost=3.0 # قللها لو ما بيلتقطش أصوات منخفضة
+                threshold_boost=3.0, # قللها لو ما بيلتقطش أصوات منخفضة
+                on_frame=gate.feed if gate else downstream,
+                on_silence_start=(gate.guard(speculative.submit) if gate else speculative.submit) if speculative else None,
+                on_speech_resume=speculative.discard if speculative else None
             )
+            t_vad_end = TRACE.now()
+
+            if audio_pcm and gate is not None and not gate.opened:
+                print("⏭️ Ignored (no local wake word).")
+                audio_pcm = b""
 
             if not audio_pcm:
                 print("⚠️  No audio recorded")
+                if stt_session:
+                    stt_session.abort()
+                if speculative:
+                    speculative.discard()
                 continue
-            
-             # 🔧 الإصلاح: تحويل PCM إلى WAV قبل الإرسال
-            print("🔄 Converting PCM to WAV...")
-            audio_wav = recorder.pcm_to_wav(audio_pcm)
-            
-            if not audio_wav:
-                print("❌ Failed to convert PCM to WAV")
-                continue
-
-            print(f"✅ Audio ready: {len(audio_wav)} bytes")
-
-
-
-
+            TRACE.record("capture", t_capture, t_vad_end)
+            TRACE.record("vad_end", t_vad_end)
+
+            audio_wav = None
+            if stt_session is None and speculative is None:
+                # 🔧 الإصلاح: تحويل PCM إلى WAV قبل الإرسال
+                print("🔄 Converting PCM to WAV...")
+                with TRACE.span("wav_encode"):
+                    audio_wav = recorder.pcm_to_wav(audio_pcm)
+
+                if not audio_wav:
+                    print("❌ Failed to convert PCM to WAV")
+                    continue
 
+                print(f"✅ Audio ready: {len(audio_wav)} bytes")
 
             # 2) تحويل الصوت إلى نص (STT)
             try:
-                user_input = stt.transcribe(audio_wav)
+                with TRACE.span("stt"):
+                    if stt_session is not None:
+                        user_input = stt_session.finish()
+                    elif speculative is not None:
+                        user_input = speculative.result(audio_pcm)
+                    else:
+                        user_input = stt.transcribe(audio_wav)
                 
                 # التحقق من صيغة الرد
                 if isinstance(user_input, dict):
@@ -486,7 +612,8 @@ def main_thread():
             #-----------------------------------------------------------       
             # 5) Local commands THEN AI (using the remainder only)
             try:
-                should_continue, local_response, action, pass_text = localCommandHandler.handle(user_message)
+                with TRACE.span("local_command"):
+                    should_continue, local_response, action, pass_text = localCommandHandler.handle(user_message)
                 print(f"should_continue:{should_continue} / local_response:{local_response} / action:{action}")
             except Exception as ex:
                 print(f"❌ Local command error: {ex}")
@@ -517,6 +644,12 @@ def main_thread():
 
                     # NOTE: pass_text (if greetings trimmed) else remainder
                     prompt_text = pass_text if pass_text else user_message
+                    if config.N8N_STREAM:
+                        # كل جملة تذهب للـ TTS فور اكتمالها، قبل انتهاء توليد الرد
+                        speak_safe(ai_sentences(prompt_text))
+                        system_state.pause_interruption()
+                        continue
+
                     ai_response = n8n.chat("123456", prompt_text)
                     if ai_response and ai_response.strip():
                         print(f"🤖 AI Response: {ai_response}")
@@ -547,7 +680,66 @@ def main_thread():
 def main():
 
     initialize_settings()
+    # ⏱️ spans لكل دور (capture → STT → n8n → TTS → playback)
+    TRACE.enabled = config.LATENCY_TRACE
     audio_player.start()
+    # 🔔 فك ترميز cues مرة واحدة (bell / thinking / got_it ... من الذاكرة)
+    audio_player.preload("Resources/voice_msgs")
+
+    # 🔇 إلغاء الصدى: ما يخرج من السماعة يُطرح من المايك قبل VAD/STT/KWS
+    if config.AEC_ENABLED:
+        recorder.set_echo_canceller(
+            EchoCanceller(audio_player.attach_reference(recorder.rate), recorder.rate, taps=config.AEC_TAPS)
+        )
+        print("✅ Echo canceller enabled")
+
+    # 🔥 فتح اتصالات STT/TTS/n8n مسبقًا (أول STT بعد الإقلاع بنفس سرعة البقية)
+    if config.HTTP_PREWARM:
+        stt.transport.warm_up()
+
+    # 🗜️ صيغ الرفع المضغوط على /stt (handshake في الخلفية، لا ينتظر)
+    stt.upload_codec(recorder.rate, recorder.width, recorder.channels, wait=False)
+
+    # 🔥 توليد ردود LocalCommandHandler مسبقًا → الردود المحلية تُشغّل من القرص فورًا
+    if tts.cache is not None and config.TTS_CACHE_WARMUP:
+        threading.Thread(
+            target=lambda: warm_up(tts, response_texts(localCommandHandler._init_responses())),
+            name="TtsWarmUp", daemon=True
+        ).start()
+
+    # 🕒 مقاطع الوقت/التاريخ (أرقام، أيام، شهور) → "كم الساعة" بدون انتظار TTS
+    if config.TTS_PHRASE_FRAGMENTS:
+        speech.phrases = FragmentBank(tts)
+        threading.Thread(target=speech.phrases.prepare, name="PhraseFragments", daemon=True).start()
+
+    # 🎙️ ثريد التقاط واحد دائم → ring buffer (main + barge-in يقرآن بـ cursors منفصلة)
+    try:
+        recorder.start_capture()
+    except Exception as ex:
+        print(f"❌ Microphone capture failed to start: {ex}")
+
+    # ⚡ asyncio loop: الإلغاء الحقيقي للمهام بدل flags + threads
+    if async_loop:
+        assistant = AsyncAssistant(
+            recorder=recorder,
+            stt=stt,
+            n8n=n8n,
+            speech=speech,
+            audio_player=audio_player,
+            local_handler=localCommandHandler,
+            wake_detector=wakewordDetector,
+            stop_detector=stopCommandDetector,
+            config=config,
+            allow_wake_word=allow_wake_word,
+            allow_interruption=allow_interruption,
+            spotter=kws,
+            wake_keywords=kws_wake_words,
+            stop_keywords=kws_stop_words,
+        )
+        run_async_assistant(assistant)
+        system_state.stop_system()
+        cleanup()
+        return
 
 
     # Create and start threads
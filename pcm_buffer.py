@@ -0,0 +1,240 @@
+# pcm_buffer.py
+# -------------------------------------------------------------------
+# Zero-copy PCM path: capture ring → utterance buffer → HTTP upload
+# - PcmBuffer: bytearray محجوز مسبقًا (max_duration) + 44 بايت فارغة في البداية
+#   لهيدر WAV → wav() يكتب الهيدر في مكانه ويرجع memoryview بدون نسخ الصوت
+# - الـ ring يُنسخ مباشرة داخل الـ buffer (RingReader.read_into) → نسخة واحدة فقط
+# - chunks / snapshots = memoryview على نفس الذاكرة (append-only → لا تتغيّر؛
+#   discard_head يحرّك بداية الصوت فقط ولا ينقل البايتات)
+# - MultipartBody: multipart/form-data كـ iterable بطول معروف → requests يرسل
+#   الأجزاء كما هي (Content-Length، بدون b"".join ولا encode_multipart_formdata)
+#
+#   python pcm_buffer.py          # benchmark: 25s utterance, memory + CPU
+# -------------------------------------------------------------------
+
+import struct
+import uuid
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+WAV_HEADER_BYTES = 44
+
+
+def wav_header(data_bytes: int, rate: int, width: int = 2, channels: int = 1) -> bytes:
+    """Canonical 44-byte PCM WAV header for `data_bytes` of audio."""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_bytes, b"WAVE",
+        b"fmt ", 16, 1, channels, rate, rate * channels * width, channels * width, width * 8,
+        b"data", data_bytes,
+    )
+
+
+class PcmBuffer:
+    """
+    Growable PCM buffer with a reserved WAV header.
+
+        buf = PcmBuffer(16000, 2, 1, capacity_sec=26)
+        view = buf.reserve(n); ...fill view...; buf.commit(n)   # أو buf.append(data)
+        buf.pcm()      # memoryview على الصوت فقط
+        buf.wav()      # memoryview: هيدر + صوت (نفس الذاكرة)
+
+    Views handed out stay valid: the buffer is append-only, and when it must
+    grow a new array is allocated (the old one lives on under existing views).
+    discard_head() only advances the start offset; the header reserved by
+    wav() then sits on the last 44 discarded bytes, so views of the dropped
+    head must not be used after wav().
+    """
+
+    def __init__(self, rate: int = 16000, width: int = 2, channels: int = 1, capacity_sec: float = 30.0):
+        self.rate = rate
+        self.width = width
+        self.channels = channels
+        self.frame_bytes = width * channels
+        capacity = int(rate * max(0.0, capacity_sec)) * self.frame_bytes
+        self._buf = bytearray(WAV_HEADER_BYTES + capacity)
+        self._start = WAV_HEADER_BYTES  # أول بايت صوت (الهيدر قبله مباشرة)
+        self._end = WAV_HEADER_BYTES
+        self.grows = 0                  # كم مرة تجاوز التسجيل الحجم المحجوز
+
+    # ---------------- Writing ----------------
+
+    def reserve(self, n: int) -> memoryview:
+        """Writable view of the next `n` bytes (not part of the audio until commit)."""
+        self._ensure(n)
+        return memoryview(self._buf)[self._end:self._end + n]
+
+    def commit(self, n: int) -> memoryview:
+        """Accept `n` bytes written into reserve(); returns them as a view."""
+        start = self._end
+        self._end += n
+        return memoryview(self._buf)[start:self._end]
+
+    def append(self, data: BytesLike) -> memoryview:
+        n = len(data)
+        self._ensure(n)
+        self._buf[self._end:self._end + n] = data
+        return self.commit(n)
+
+    def discard_head(self, n: int) -> None:
+        """Drop the oldest `n` audio bytes (pre-roll trimming; no bytes are moved)."""
+        n = min(max(0, n - n % self.frame_bytes), len(self))
+        self._start += n
+
+    def _ensure(self, n: int) -> None:
+        need = self._end + n
+        if need <= len(self._buf):
+            return
+        # الجزء المحذوف من البداية لا يُنقل للـ array الجديد
+        head = self._start - WAV_HEADER_BYTES
+        grown = bytearray(max(need - head, 2 * len(self._buf)))
+        grown[:self._end - head] = memoryview(self._buf)[head:self._end]
+        self._buf = grown
+        self._start -= head
+        self._end -= head
+        self.grows += 1
+
+    # ---------------- Reading ----------------
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __bool__(self) -> bool:
+        return self._end > self._start
+
+    def __bytes__(self) -> bytes:
+        return bytes(self.pcm())
+
+    @property
+    def duration(self) -> float:
+        return len(self) / float(self.rate * self.frame_bytes)
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buf) - self._start
+
+    def pcm(self, start: int = 0, end: Optional[int] = None) -> memoryview:
+        """Audio bytes [start:end] (offsets inside the PCM, header excluded)."""
+        stop = self._end if end is None else min(self._end, self._start + end)
+        return memoryview(self._buf)[self._start + start:stop]
+
+    def wav(self) -> memoryview:
+        """Header written in place + audio: a complete WAV file without copying the PCM."""
+        head = self._start - WAV_HEADER_BYTES
+        self._buf[head:self._start] = wav_header(len(self), self.rate, self.width, self.channels)
+        return memoryview(self._buf)[head:self._end]
+
+    def wav_parts(self) -> Tuple[bytes, memoryview]:
+        """(header, pcm) for a snapshot that must not change when the buffer grows later."""
+        pcm = self.pcm()
+        return wav_header(len(pcm), self.rate, self.width, self.channels), pcm
+
+
+def as_wav_parts(audio, rate: int = 16000, width: int = 2, channels: int = 1) -> Tuple[BytesLike, ...]:
+    """PcmBuffer / raw PCM / (header, pcm) → WAV pieces, without joining them."""
+    if isinstance(audio, PcmBuffer):
+        return (audio.wav(),)
+    if isinstance(audio, (tuple, list)):
+        return tuple(audio)
+    return wav_header(len(audio), rate, width, channels), audio
+
+
+# ==================== Streaming multipart body ====================
+
+class MultipartBody:
+    """
+    multipart/form-data with one file field, streamed part by part.
+
+        body = MultipartBody("file", "audio.wav", "audio/wav", buf.wav_parts())
+        session.post(url, data=body, headers={"Content-Type": body.content_type})
+
+    __len__ → requests sends Content-Length (no chunked encoding) and urllib3
+    writes every piece straight to the socket (memoryviews are not copied).
+    Iterable again on each __iter__, so a retried request resends the same body.
+    """
+
+    def __init__(self, field: str, filename: str, content_type: str, parts: Sequence[BytesLike],
+                 boundary: Optional[str] = None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self._head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+        self._parts = [p for p in parts if len(p)]
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self._head) + sum(len(p) for p in self._parts) + len(self._tail)
+
+    def __iter__(self) -> Iterator[BytesLike]:
+        yield self._head
+        yield from self._parts
+        yield self._tail
+
+
+# ==================== Benchmark ====================
+
+if __name__ == "__main__":
+    import io
+    import time
+    import tracemalloc
+    import wave
+
+    from requests.models import RequestEncodingMixin
+
+    from audio_recorder import AudioRingBuffer
+
+    rate, width, channels, chunk = 16000, 2, 1, 256
+    seconds = 25.0
+    n_chunks = int(rate * seconds) // chunk
+    bpc = chunk * width * channels
+    ring = AudioRingBuffer(int(rate * (seconds + 5)) * width * channels, align=width * channels)
+    noise = bytes(range(256)) * (bpc // 256)
+    for _ in range(n_chunks):
+        ring.write(noise)
+
+    def old_path():
+        """reader.read → list → b"".join → wave/BytesIO → requests multipart encoder."""
+        reader = ring.reader(n_chunks * bpc)
+        frames = [reader.read(bpc) for _ in range(n_chunks)]
+        pcm = b"".join(frames)
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as wf:
+            wf.setnchannels(channels)
+            wf.setsampwidth(width)
+            wf.setframerate(rate)
+            wf.writeframes(pcm)
+        wav = buf.getvalue()
+        body, _ctype = RequestEncodingMixin._encode_files({"file": ("audio.wav", wav, "audio/wav")}, None)
+        return len(body)
+
+    def new_path():
+        """reader.read_into(PcmBuffer) → header in place → MultipartBody (ما يُكتب على الـ socket)."""
+        reader = ring.reader(n_chunks * bpc)
+        pb = PcmBuffer(rate, width, channels, capacity_sec=seconds + 1.0)
+        for _ in range(n_chunks):
+            pb.commit(reader.read_into(pb.reserve(bpc)))
+        body = MultipartBody("file", "audio.wav", "audio/wav", (pb.wav(),))
+        return sum(len(p) for p in body)
+
+    print(f"📦 {seconds:.0f}s utterance @ {rate} Hz, {n_chunks} chunks of {bpc} bytes "
+          f"(PCM {n_chunks * bpc / 1e6:.2f} MB)")
+    for label, fn in (("list+join+BytesIO+multipart", old_path), ("PcmBuffer+MultipartBody", new_path)):
+        fn()
+        tracemalloc.start()
+        size = fn()
+        _cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        runs = 20
+        t0 = time.process_time()
+        for _ in range(runs):
+            fn()
+        cpu = (time.process_time() - t0) / runs * 1000
+        print(f"   {label:<30} peak {peak / 1e6:6.2f} MB ({peak / (n_chunks * bpc):4.1f}× PCM)   "
+              f"CPU {cpu:6.2f} ms   body {size} B")
@@ -0,0 +1,449 @@
+# replay_bench.py
+# -------------------------------------------------------------------
+# Offline replay benchmark for the full voice pipeline (headless)
+# - الميكروفون: ملفات WAV مسجّلة تُقرأ بسرعة الزمن الحقيقي عبر stream وهمي
+#   → نفس منطق AudioRecorder (callback أو capture thread + ring + VAD) بدون hardware
+# - السماعة: output stream وهمي يستهلك الصوت بسرعة الزمن الحقيقي
+# - STT / TTS / n8n: StubApiServer في process منفصل (latency قابلة للضبط)
+#   → CPU و RSS المقاسة هنا للـ client فقط
+# - التقرير: توزيع زمن كل مرحلة (p50/p95/p99 من latency_trace)
+#   + CPU time و peak RSS لكل مرحلة
+#
+#   python replay_bench.py                      # Resources/voice_msgs كأصوات مستخدم
+#   python replay_bench.py --wavs "rec/*.wav" --turns 20 --n8n sse --stt stream
+#   python replay_bench.py --n8n-latency 1.2 --tts-latency 0.3 --trace bench.jsonl
+# -------------------------------------------------------------------
+
+import argparse
+import glob
+import multiprocessing as mp
+import resource
+import threading
+import time
+import wave
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from Config import Config
+from audio_recorder import AudioRecorder
+from audio_player import AudioPlayer
+from speech_to_text import SpeechToText
+from text_to_speech import TextToSpeech
+from ai_n8n import N8nClient
+from local_commands import LocalCommandHandler
+from speech_pipeline import SpeechPipeline
+from latency_trace import TRACE
+from resampler import downmix, resample
+from stub_server import StubApiServer
+
+
+# ==================== Fake audio devices ====================
+
+class ReplayInput:
+    """
+    Blocking input stream that plays queued utterances in real time.
+    بين الجمل: ضوضاء خفيفة (مثل غرفة هادئة) حتى تعمل معايرة الـ VAD.
+    """
+
+    def __init__(self, rate: int = 16000, noise_rms: float = 30.0, seed: int = 0):
+        self.rate = rate
+        self.noise_rms = noise_rms
+        self._rng = np.random.default_rng(seed)
+        self._pending: deque = deque()      # (start_pos, int16 samples)
+        self._lock = threading.Lock()
+        self._pos = 0
+        self._t0: Optional[float] = None
+        self._closed = False
+
+    def play(self, samples: np.ndarray, lead: float) -> float:
+        """Queue an utterance `lead` seconds from now; returns its end (monotonic)."""
+        with self._lock:
+            start = self._pos + int(lead * self.rate)
+            if self._pending:
+                last_start, last = self._pending[-1]
+                start = max(start, last_start + len(last))
+            self._pending.append((start, samples))
+            t0 = self._t0 if self._t0 is not None else time.monotonic()
+        return t0 + (start + len(samples)) / self.rate
+
+    # ---- PyAudio stream API (ما يستخدمه AudioRecorder) ----
+
+    def read(self, frames: int, exception_on_overflow: bool = True) -> bytes:
+        if self._closed:
+            raise IOError("stream closed")
+        if self._t0 is None:
+            self._t0 = time.monotonic()
+        # مثل الجهاز الحقيقي: الـ chunk جاهز بعد مرور زمنه
+        wait = self._t0 + (self._pos + frames) / self.rate - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        out = self._rng.normal(0.0, self.noise_rms, frames).astype(np.float32)
+        with self._lock:
+            pos, end = self._pos, self._pos + frames
+            while self._pending:
+                start, samples = self._pending[0]
+                if start >= end:
+                    break
+                a, b = max(start, pos), min(start + len(samples), end)
+                out[a - pos:b - pos] += samples[a - start:b - start]
+                if start + len(samples) <= end:
+                    self._pending.popleft()
+                else:
+                    break
+            self._pos = end
+        return np.clip(out, -32768, 32767).astype(np.int16).tobytes()
+
+    def get_input_latency(self) -> float:
+        return 0.0
+
+    def stop_stream(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._closed = True
+
+
+class ReplayCallbackInput:
+    """Callback input stream: a thread pulls real-time chunks from ReplayInput into the callback."""
+
+    def __init__(self, source: ReplayInput, callback, frames_per_buffer: int):
+        self.source = source
+        self.callback = callback
+        self.frames = frames_per_buffer
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start_stream(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ReplayInput", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                data = self.source.read(self.frames)
+            except IOError:
+                break
+            self.callback(data, self.frames, {}, 0)
+
+    def get_input_latency(self) -> float:
+        return 0.0
+
+    def stop_stream(self) -> None:
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def close(self) -> None:
+        self.stop_stream()
+        self.source.close()
+
+
+class ReplayPyAudio:
+    """Just enough of pyaudio.PyAudio for AudioRecorder."""
+
+    def __init__(self, source: ReplayInput):
+        self.source = source
+
+    def get_format_from_width(self, width: int) -> int:
+        return width
+
+    def open(self, **kwargs):
+        callback = kwargs.get("stream_callback")
+        if callback is not None:
+            return ReplayCallbackInput(self.source, callback, kwargs.get("frames_per_buffer", 1024))
+        return self.source
+
+    def terminate(self) -> None:
+        pass
+
+
+class ClockedOutput:
+    """Callback output stream driven by a thread at the device sample rate."""
+
+    def __init__(self, callback, rate: int, frames_per_buffer: int):
+        self.callback = callback
+        self.rate = rate
+        self.frames = frames_per_buffer
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start_stream(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="ReplayOutput", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        t0 = time.monotonic()
+        k = 0
+        while not self._stop.is_set():
+            self.callback(None, self.frames, {}, 0)
+            k += 1
+            wait = t0 + k * self.frames / self.rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+    def get_output_latency(self) -> float:
+        return 0.0
+
+    def stop_stream(self) -> None:
+        self._stop.set()
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+class ReplayRecorder(AudioRecorder):
+    def __init__(self, source: ReplayInput, config: Optional[Config] = None):
+        self.source = source
+        super().__init__(config)
+
+    def _init_backend(self):
+        self._pa = ReplayPyAudio(self.source)
+
+
+class ReplayPlayer(AudioPlayer):
+    def _open_stream(self) -> None:
+        self._stream = ClockedOutput(self._callback, self._sample_rate, self._frames_per_buffer)
+        self._stream.start_stream()
+
+
+# ==================== Measurement ====================
+
+def peak_rss_mb() -> float:
+    # Linux: ru_maxrss بالـ KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class StageMeter:
+    """
+    Per-stage CPU time (كل threads الـ process: capture + mixer + HTTP)
+    و peak RSS (high-water mark بعد المرحلة، والزيادة التي حدثت أثناءها).
+    """
+
+    def __init__(self):
+        self.cpu_ms: Dict[str, List[float]] = {}
+        self.wall_ms: Dict[str, List[float]] = {}
+        self.rss_peak: Dict[str, float] = {}
+        self.rss_growth: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str, trace: bool = True):
+        """trace=False: الـ client يسجّل الـ span بنفسه (n8n) — لا نكرره."""
+        cpu0 = time.process_time()
+        wall0 = time.perf_counter()
+        rss0 = peak_rss_mb()
+        with TRACE.span(name) if trace else nullcontext():
+            yield
+        self.cpu_ms.setdefault(name, []).append((time.process_time() - cpu0) * 1000.0)
+        self.wall_ms.setdefault(name, []).append((time.perf_counter() - wall0) * 1000.0)
+        rss = peak_rss_mb()
+        self.rss_peak[name] = max(self.rss_peak.get(name, 0.0), rss)
+        self.rss_growth[name] = self.rss_growth.get(name, 0.0) + (rss - rss0)
+
+    def print_report(self) -> None:
+        print(f"   {'stage':<14}{'n':>5}{'cpu p50':>10}{'cpu p95':>10}{'cpu/wall':>10}"
+              f"{'peak RSS':>11}{'RSS +':>9}")
+        for name, cpu in self.cpu_ms.items():
+            p50, p95 = np.percentile(cpu, [50, 95])
+            share = sum(cpu) / max(1e-9, sum(self.wall_ms[name]))
+            print(f"   {name:<14}{len(cpu):>5}{p50:>8.1f}ms{p95:>8.1f}ms{share:>9.0%}"
+                  f"{self.rss_peak[name]:>8.1f} MB{self.rss_growth[name]:>6.1f} MB")
+
+
+# ==================== Stand-in servers ====================
+
+def _serve(kwargs: dict, url_q, stop) -> None:
+    srv = StubApiServer(**kwargs).start()
+    url_q.put(srv.url)
+    stop.wait()
+    srv.stop()
+
+
+@contextmanager
+def stub_servers(**kwargs):
+    """StubApiServer in its own process → CPU/RSS of the servers not counted."""
+    url_q = mp.Queue()
+    stop = mp.Event()
+    proc = mp.Process(target=_serve, args=(kwargs, url_q, stop), name="StubApiServer", daemon=True)
+    proc.start()
+    try:
+        yield url_q.get(timeout=10)
+    finally:
+        stop.set()
+        proc.join(timeout=3)
+
+
+# ==================== Utterances ====================
+
+def load_utterance(path: str, rate: int) -> np.ndarray:
+    """WAV → float32 mono at the recorder rate."""
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit WAV supported")
+        sr, ch = wf.getframerate(), wf.getnchannels()
+        x = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).reshape(-1, ch)
+    x = downmix(x, 1).astype(np.float32)
+    return resample(x, sr, rate)[:, 0]
+
+
+# ==================== One turn ====================
+
+def run_turn(args, source, recorder, stt, n8n, local, speech, meter, samples) -> Dict[str, float]:
+    turn = TRACE.new_turn()
+    # المعايرة تقرأ 0.8s من الضوضاء أولًا، ثم يبدأ "المستخدم"
+    speech_end = source.play(samples, lead=1.0)
+
+    stt_session = None
+    if args.stt == "stream":
+        stt_session = stt.open_stream(sample_rate=recorder.rate, sample_width=recorder.width,
+                                      channels=recorder.channels)
+
+    with meter.stage("capture"):
+        pcm = recorder.record_until_silence(
+            max_duration=25.0,
+            noise_calib_duration=0.8,
+            start_frames=3,
+            end_frames=18,
+            post_silence_hold=0.35,
+            pre_roll_ms=350,
+            min_speech_after_start=min(1.8, len(samples) / recorder.rate * 0.8),
+            threshold_boost=3.0,
+            on_frame=stt_session.feed if stt_session else None,
+        )
+    vad_end = TRACE.now()
+    TRACE.record("vad_end", vad_end)
+    # من آخر عيّنة كلام حقيقية حتى قرار الـ VAD
+    TRACE.record("endpoint", speech_end, vad_end)
+    if not pcm:
+        if stt_session:
+            stt_session.abort()
+        return {"turn": turn, "ok": 0}
+
+    if stt_session is not None:
+        with meter.stage("stt"):
+            text = stt_session.finish()
+    else:
+        with meter.stage("wav_encode"):
+            wav = recorder.pcm_to_wav(pcm)
+        with meter.stage("stt"):
+            text = stt.transcribe(wav)
+    text = text.get("text", "") if isinstance(text, dict) else str(text)
+
+    with meter.stage("local_command"):
+        should_continue, local_response, _action, pass_text = local.handle(text)
+
+    if local_response:
+        with meter.stage("speak"):
+            speech.speak(local_response)
+    if should_continue:
+        prompt = pass_text or text
+        if args.n8n == "json":
+            with meter.stage("n8n", trace=False):
+                reply = n8n.chat("bench", prompt)
+            with meter.stage("speak"):
+                speech.speak(reply)
+        else:
+            # n8n + TTS متداخلان: مرحلة واحدة
+            with meter.stage("n8n+speak"):
+                speech.speak(n8n.chat_sentences("bench", prompt))
+
+    for ev in TRACE.events():
+        if ev["turn"] == turn and ev["stage"] == "playback_start":
+            TRACE.record("turn", speech_end, ev["start"], turn)
+            break
+    return {"turn": turn, "ok": 1}
+
+
+# ==================== Main ====================
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Offline replay benchmark (no mic, no server)")
+    ap.add_argument("--wavs", default="Resources/voice_msgs/*.wav", help="glob of recorded utterances")
+    ap.add_argument("--turns", type=int, default=0, help="number of turns (0 = one per WAV)")
+    ap.add_argument("--stt", choices=("batch", "stream"), default="batch")
+    ap.add_argument("--n8n", choices=("json", "sse", "n8n"), default="json")
+    ap.add_argument("--tts", choices=("stream", "whole"), default="stream")
+    ap.add_argument("--capture", choices=("callback", "blocking"), default="",
+                    help="recorder capture mode (default: REC_CAPTURE_MODE)")
+    ap.add_argument("--stt-text", default="what is the weather like in cairo today")
+    ap.add_argument("--reply", default="It is sunny in Cairo today. The temperature is about thirty degrees. "
+                                       "Do you want the forecast for tomorrow as well?")
+    ap.add_argument("--stt-latency", type=float, default=0.15)
+    ap.add_argument("--n8n-latency", type=float, default=0.6)
+    ap.add_argument("--token-delay", type=float, default=0.02)
+    ap.add_argument("--tts-latency", type=float, default=0.12)
+    ap.add_argument("--tts-rtf", type=float, default=0.2, help="TTS seconds per audio second")
+    ap.add_argument("--trace", default="", help="append JSONL spans to this file")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    paths = [p for p in sorted(glob.glob(args.wavs)) if not p.endswith("bell.wav")]
+    if not paths:
+        raise SystemExit(f"no WAV files match {args.wavs}")
+
+    server = dict(stt_text=args.stt_text, stt_latency=args.stt_latency,
+                  n8n_reply=args.reply, n8n_mode=args.n8n, n8n_latency=args.n8n_latency,
+                  n8n_token_delay=args.token_delay, tts_latency=args.tts_latency,
+                  tts_realtime_factor=args.tts_rtf)
+
+    with stub_servers(**server) as url:
+        cfg = Config()
+        cfg.SERVER_API_URL = url
+        cfg.N8N_URL = f"{url}/webhook/MultiAgentChat"
+        if args.capture:
+            cfg.REC_CAPTURE_MODE = args.capture
+
+        TRACE.enabled = True
+        rss_start = peak_rss_mb()
+        source = ReplayInput(rate=cfg.REC_SAMPLE_RATE)
+        recorder = ReplayRecorder(source, cfg)
+        stt = SpeechToText(cfg)
+        tts = TextToSpeech(cfg)
+        n8n = N8nClient(cfg)
+        local = LocalCommandHandler()
+        player = ReplayPlayer(sample_rate=22050, channels=1, frames_per_buffer=512)
+        player.start()
+        speech = SpeechPipeline(tts, player, stream=args.tts == "stream")
+        stt.transport.warm_up(background=False)
+        recorder.start_capture()
+
+        utterances = [load_utterance(p, recorder.rate) for p in paths]
+        turns = args.turns or len(utterances)
+        meter = StageMeter()
+        print(f"🧪 Replay: {turns} turns from {len(paths)} WAVs against {url} "
+              f"(stt={args.stt}, n8n={args.n8n}, tts={args.tts})")
+
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        ok = 0
+        for i in range(turns):
+            res = run_turn(args, source, recorder, stt, n8n, local, speech, meter,
+                           utterances[i % len(utterances)])
+            ok += res["ok"]
+            print(f"   turn {i + 1}/{turns} {'✅' if res['ok'] else '⚠️ no speech detected'}")
+        cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+
+        recorder.close()
+        player.shutdown()
+        n8n.close()
+
+    print("\n" + "=" * 68)
+    TRACE.print_summary()
+    print("   (turn = end of user speech → first robot audio; endpoint = speech end → VAD end)")
+    print("\n⚙️ CPU / memory per stage")
+    meter.print_report()
+    print(f"\n   total: {ok}/{turns} turns, {cpu:.2f}s CPU in {wall:.1f}s wall "
+          f"({cpu / max(wall, 1e-9):.1%}), peak RSS {peak_rss_mb():.1f} MB "
+          f"(startup {rss_start:.1f} MB), playback underflows {player.underflows}")
+    print(f"   {recorder.capture_stats()}")
+    if args.trace:
+        print(f"   trace: {TRACE.export_jsonl(args.trace)} events → {args.trace}")
+    print("=" * 68)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# speech_pipeline.py
+# -------------------------------------------------------------------
+# Sentence-level TTS pipeline with gapless playback
+# - يقسم الرد إلى جمل (علامات ترقيم عربية + إنجليزية)
+# - يحوّل الجملة N+1 إلى صوت أثناء تشغيل الجملة N
+# - التشغيل عبر AudioPlayer (channel "speech" في نفس output stream الخاص بالـ cues)
+# - صوت TTS يُشغّل أثناء تحميله من الـ HTTP response (tts_stream → play_stream)
+# زمن أول صوت = زمن أول chunk من TTS للجملة الأولى
+# -------------------------------------------------------------------
+
+import io
+import time
+import wave
+import threading
+from collections import deque
+from queue import Queue, Empty
+from typing import Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+from utilities import split_sentences
+from http_transport import current_cancel_scope
+from audio_player import CHANNEL_SPEECH, AudioJob
+from latency_trace import TRACE
+from resampler import downmix
+from spoken_phrases import FragmentBank, SpokenPhrase
+
+
+def wav_bytes_to_np_int16(wav_bytes: bytes) -> Tuple[np.ndarray, int]:
+    """
+    Parse WAV bytes to (int16 mono numpy array, sample_rate).
+    If source is stereo, average to mono.
+    """
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        sr = wf.getframerate()
+        ch = wf.getnchannels()
+        sw = wf.getsampwidth()
+        frames = wf.readframes(wf.getnframes())
+
+    if sw != 2:
+        raise ValueError("Only 16-bit WAV supported")
+    arr = np.frombuffer(frames, dtype=np.int16)
+    if ch > 1:
+        arr = downmix(arr.reshape(-1, ch), 1).reshape(-1)  # mono (int32 sum, بدون float)
+
+    return arr, sr
+
+
+class SpeechPipeline:
+    """
+    Pipelined TTS + playback.
+    - speak(text):  يقسم النص ويشغّله جملة جملة (blocking حتى النهاية أو الإلغاء)
+    - speak(iterable): نفس الشيء لكن الجمل تأتي من مولّد (مثلاً رد n8n متدفق)
+    - stop():       إلغاء فوري (TTS المتبقي + التشغيل)
+
+    التشغيل يتم عبر AudioPlayer، لذلك audio_player.stop_current() يوقف الكلام أيضًا.
+    """
+
+    def __init__(self, tts, player, lookahead: int = 2, as_fmt: str = "wav", stream: bool = True,
+                 phrases: Optional[FragmentBank] = None):
+        self.tts = tts
+        self.player = player
+        self.lookahead = max(1, lookahead)   # كم جملة جاهزة مسبقًا
+        self.as_fmt = as_fmt
+        self.stream = stream                 # False → تحميل الرد كاملًا ثم التشغيل
+        self.phrases = phrases               # SpokenPhrase (وقت/تاريخ) → لصق fragments بدل TTS
+
+        # Event خاص بكل speak(): worker الرد المُقاطع يبقى ملغى حتى لو بدأ رد جديد
+        self._cancel = threading.Event()
+
+    # ---------------- Public API ----------------
+
+    def speak(self, text: Union[str, Iterable[str]]) -> bool:
+        """
+        Speak `text` (a full reply or an iterable of sentences).
+        Returns True if playback finished, False if it was stopped.
+        """
+        if isinstance(text, SpokenPhrase):
+            sentences = [text]               # لا تقسيم: الـ fragments تغطي النص كاملًا
+        else:
+            sentences = split_sentences(text) if isinstance(text, str) else text
+        cancel = threading.Event()
+        self._cancel = cancel
+
+        jobs_q: "Queue[Optional[AudioJob]]" = Queue()
+        t_start = time.time()
+        # طلبات TTS تتبع CancelScope الخاص بالمستدعي (إلغاء فوري عند barge-in)
+        worker = threading.Thread(
+            target=self._synthesize, args=(sentences, jobs_q, cancel, current_cancel_scope()),
+            name="TTSPipeline", daemon=True
+        )
+        worker.start()
+
+        first_audio = True
+        play_start = None
+        try:
+            while not cancel.is_set():
+                try:
+                    job = jobs_q.get(timeout=0.1)
+                except Empty:
+                    if not worker.is_alive() and jobs_q.empty():
+                        break
+                    continue
+                if job is None:
+                    break
+
+                while True:
+                    finished = job.done.wait(timeout=0.05)
+                    if first_audio and job.started.is_set():
+                        print(f"🔊 First audio after {time.time() - t_start:.2f}s")
+                        first_audio = False
+                        play_start = job.started_at
+                        TRACE.record("playback_start", play_start)
+                    if finished or cancel.is_set():
+                        break
+                if job.canceled.is_set():
+                    # أُوقف من الخارج (مثلاً audio_player.stop_current عند المقاطعة)
+                    cancel.set()
+        finally:
+            if play_start is not None:
+                TRACE.record("playback", play_start, TRACE.now())
+            if cancel.is_set():
+                try:
+                    while True:
+                        job = jobs_q.get_nowait()
+                        if job is not None:
+                            job.canceled.set()
+                except Empty:
+                    pass
+
+        return not cancel.is_set()
+
+    def stop(self) -> None:
+        """Cancel pending synthesis and cut playback immediately."""
+        self._cancel.set()
+        self.player.stop_current(CHANNEL_SPEECH)
+
+    # ---------------- Internal ----------------
+
+    def _synthesize(self, sentences: Iterable[str], jobs_q: Queue, cancel: threading.Event,
+                    scope=None) -> None:
+        """Producer: TTS each sentence while the previous one is playing."""
+        if scope is not None:
+            with scope:
+                self._synthesize(sentences, jobs_q, cancel)
+            return
+        pending = deque()
+        try:
+            for sentence in sentences:
+                if cancel.is_set():
+                    break
+                if not sentence or not sentence.strip():
+                    continue
+
+                # lookahead: الجملة الجارية + lookahead جمل جاهزة
+                while pending and pending[0].done.is_set():
+                    pending.popleft()
+                while len(pending) > self.lookahead and not cancel.is_set():
+                    if pending[0].done.wait(timeout=0.1):
+                        pending.popleft()
+                if cancel.is_set():
+                    break
+
+                try:
+                    job = self._submit(sentence)
+                except Exception as ex:
+                    print(f"❌ TTS error: {ex}")
+                    continue
+                if job is None:
+                    continue
+                if cancel.is_set():
+                    job.canceled.set()
+                    break
+                pending.append(job)
+                jobs_q.put(job)
+        finally:
+            jobs_q.put(None)
+
+    def _submit(self, sentence: str) -> Optional[AudioJob]:
+        """Start the TTS request and hand its audio to the player's speech channel."""
+        if self.phrases is not None and isinstance(sentence, SpokenPhrase):
+            spliced = self.phrases.splice(sentence.fragments)
+            if spliced is not None:
+                pcm, rate = spliced
+                return self.player.play_pcm(pcm, rate, channel=CHANNEL_SPEECH)
+            # fragments لم تجهز بعد → TTS عادي للنص
+
+        tts_stream = getattr(self.tts, "tts_stream", None)
+        if self.stream and tts_stream is not None:
+            st = tts_stream(sentence, as_fmt=self.as_fmt)
+            return self.player.play_stream(st.chunks, st.sample_rate, st.channels, channel=CHANNEL_SPEECH)
+
+        wav = self.tts.tts(sentence, as_fmt="wav")
+        if not wav:
+            return None
+        return self.player.play_wav_bytes(wav, channel=CHANNEL_SPEECH)
+
+
+# ==================== Quick Test ====================
+
+if __name__ == "__main__":
+    samples = [
+        "Hello! I am Ziko. The answer is 3.5 meters, roughly. Want to know more?",
+        "مرحبا! أنا زيكو. كيف يمكنني مساعدتك اليوم؟ اسألني أي شيء؛ أنا هنا.",
+        "Hi!\n• Say 'bye' to pause me\n• Ask 'what time is it' for current time",
+    ]
+    for s in samples:
+        print(f"'{s[:40]}...'")
+        for i, sentence in enumerate(split_sentences(s), 1):
+            print(f"   {i}. {sentence}")
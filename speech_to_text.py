@@ -1,7 +1,12 @@
 ﻿# speech_to_text.py (مُحسّن)
 import requests
-from typing import Optional, Union, Dict
+import threading
+from queue import Queue, Empty
+from typing import Optional, Union, Dict, Iterator, Sequence, Tuple
 from Config import Config
+from audio_codecs import AudioEncoder, EncodedAudio, choose_codec, create_encoder, split_wav
+from http_transport import HttpTransport, CancelScope, current_cancel_scope, get_transport
+from pcm_buffer import BytesLike, MultipartBody, PcmBuffer, as_wav_parts
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,24 +16,36 @@ class SpeechToText:
     """
     Speech-to-Text class using API endpoint
     """
-    def __init__(self, config: Optional[Config] = None):
+    def __init__(self, config: Optional[Config] = None, transport: Optional[HttpTransport] = None):
         self.config = config or Config()
         self.api_base =self.config.SERVER_API_URL
+        # ✅ Session مشتركة (keep-alive) بدل requests.post لكل دور
+        self.transport = transport or get_transport(self.config)
+        self.session = self.transport.session
+        self._register_endpoints(self.api_base)
+        # يصبح False لو السيرفر لا يدعم /stt/stream (نرجع للرفع الكامل)
+        self._stream_supported = True
+        # صيغ الرفع المقبولة على /stt (GET /stt/formats) — None = لم نسأل بعد
+        self._server_formats: Optional[Tuple[str, ...]] = None
+        self._formats_lock = threading.Lock()
 
     def transcribe(
         self, 
-        wav_bytes: bytes, 
+        wav_bytes: Union[BytesLike, Sequence[BytesLike], EncodedAudio], 
         language: Optional[str] = None,
-        timeout: int = 120
+        timeout: Optional[float] = None
     ) -> Union[str, Dict]:
         """
         Send WAV bytes to /stt endpoint.
         
         Args:
             api_base: Base URL of the API (e.g., "http://127.0.0.1:5055")
-            wav_bytes: WAV audio bytes (must have valid WAV header)
+            wav_bytes: WAV audio bytes (must have valid WAV header); bytes, memoryview
+                       (PcmBuffer.wav()) or (header, pcm) pieces — uploaded without joining.
+                       Compressed with the negotiated codec (STT_UPLOAD_CODEC) unless it
+                       is already an EncodedAudio (prepare_upload / capture encoder)
             language: Optional language code (e.g., "ar", "en")
-            timeout: Request timeout in seconds
+            timeout: Request timeout in seconds (None = endpoint (connect, read) default)
             
         Returns:
             Transcribed text as string, or full JSON dict if needed
@@ -38,35 +55,43 @@ class SpeechToText:
         """
         api_base = self.config.SERVER_API_URL 
 
-        if not wav_bytes:
+        if isinstance(wav_bytes, EncodedAudio):
+            upload = wav_bytes
+        else:
+            parts = tuple(wav_bytes) if isinstance(wav_bytes, (tuple, list)) else (wav_bytes,)
+            if not sum(len(p) for p in parts):
+                raise ValueError("Empty audio data provided")
+
+            # التحقق من أن البيانات WAV صحيحة
+            if bytes(parts[0][:4]) != b"RIFF":
+                raise ValueError(
+                    "Audio data must be in WAV format (starting with RIFF header). "
+                    "Use recorder.pcm_to_wav() to convert PCM to WAV first."
+                )
+            upload = self._compress(parts)
+        if not upload.pcm_bytes:
             raise ValueError("Empty audio data provided")
         
-        # التحقق من أن البيانات WAV صحيحة
-        if not wav_bytes.startswith(b"RIFF"):
-            raise ValueError(
-                "Audio data must be in WAV format (starting with RIFF header). "
-                "Use recorder.pcm_to_wav() to convert PCM to WAV first."
-            )
-        
-        api_url = f"{api_base.rstrip('/')}/stt"
+        api_url = self._register_endpoints(api_base)
         
         # إضافة معامل اللغة إذا وُجد
         params = {}
         if language:
             params["language"] = language
         
-        files = {"file": ("audio.wav", wav_bytes, "audio/wav")}
-        
         logger.info(f"📤 Sending audio to STT: {api_url}")
-        logger.debug(f"   Audio size: {len(wav_bytes)} bytes")
+        logger.debug(f"   Audio size: {upload.size} bytes ({upload.codec}, "
+                     f"{100.0 * upload.size / max(1, upload.pcm_bytes):.0f}% of PCM)")
         
         try:
-            resp = requests.post(
-                api_url, 
-                files=files, 
-                params=params,
-                timeout=timeout
-            )
+            resp = self._post_upload(api_url, upload, params, timeout)
+            if resp.status_code == 415 and upload.codec != "wav" and upload.wav:
+                # السيرفر أعلن الـ codec ثم رفضه → WAV الآن وفي الأدوار القادمة
+                logger.warning(f"⚠️  STT server rejected {upload.codec}, resending as WAV")
+                self._reject_codec(upload.codec)
+                resp = self._post_upload(api_url, upload._replace(
+                    codec="wav", parts=upload.wav, filename="audio.wav", content_type="audio/wav"),
+                    params, timeout)
             resp.raise_for_status()
             
             result = resp.json()
@@ -84,6 +109,10 @@ class SpeechToText:
             raise
             
         except requests.exceptions.ConnectionError as ex:
+            scope = current_cancel_scope()
+            if scope is not None and scope.cancelled:
+                logger.debug("STT request cancelled")
+                raise
             logger.error(f"❌ Connection Error: {ex}")
             logger.error(f"   Is the API server running at {api_base}?")
             raise
@@ -96,7 +125,393 @@ class SpeechToText:
             logger.error(f"❌ Unexpected Error: {ex}")
             raise
 
+    # ---------------- Compressed upload ----------------
+
+    def server_formats(self, wait: bool = True) -> Optional[Tuple[str, ...]]:
+        """
+        Upload formats accepted by /stt (capability handshake, asked once).
+        GET /stt/formats → {"formats": ["flac", "adpcm", "wav", ...]}; a server
+        without the endpoint (404/405) takes WAV only. wait=False never blocks:
+        returns None and runs the handshake in the background if not done yet.
+        """
+        if self._server_formats is not None:
+            return self._server_formats
+        if not wait:
+            if not self._formats_lock.locked():
+                threading.Thread(target=self._handshake, name="STTFormats", daemon=True).start()
+            return None
+        return self._handshake()
+
+    def upload_codec(self, sample_rate: int = 16000, sample_width: int = 2, channels: int = 1,
+                     wait: bool = True) -> str:
+        """Codec for the next /stt upload: STT_UPLOAD_CODEC ∩ server formats ∩ local encoders."""
+        preferred = str(getattr(self.config, "STT_UPLOAD_CODEC", "wav")).strip().lower()
+        if preferred in ("", "wav"):
+            return "wav"     # بدون handshake
+        formats = self.server_formats(wait=wait)
+        if not formats:
+            return "wav"
+        return choose_codec(preferred, formats, sample_rate, sample_width, channels)
+
+    def capture_encoder(self, sample_rate: int = 16000, sample_width: int = 2,
+                        channels: int = 1) -> Optional[AudioEncoder]:
+        """
+        Encoder to feed from on_frame while recording (None = plain WAV).
+        Never blocks on the handshake: before it finishes, this turn uploads WAV.
+        """
+        codec = self.upload_codec(sample_rate, sample_width, channels, wait=False)
+        if codec == "wav":
+            return None
+        return create_encoder(codec, sample_rate, sample_width, channels)
+
+    def prepare_upload(self, pcm: Union[PcmBuffer, BytesLike], sample_rate: int = 16000,
+                       sample_width: int = 2, channels: int = 1,
+                       encoder: Optional[AudioEncoder] = None) -> EncodedAudio:
+        """Raw PCM → upload for transcribe(); `encoder` reuses what was encoded while recording."""
+        if encoder is None:
+            encoder = create_encoder(self.upload_codec(sample_rate, sample_width, channels),
+                                     sample_rate, sample_width, channels)
+        return encoder.encode(pcm)
+
+    def _compress(self, parts: Tuple[BytesLike, ...]) -> EncodedAudio:
+        size = sum(len(p) for p in parts)
+        fmt = split_wav(parts)
+        if fmt is not None:
+            rate, width, channels, pcm = fmt
+            if self.upload_codec(rate, width, channels) != "wav":
+                return self.prepare_upload(pcm, rate, width, channels)
+        # WAV غير قياسي أو بدون ضغط → يُرسل كما هو
+        return EncodedAudio("wav", parts, "audio.wav", "audio/wav", size, parts)
+
+    def _post_upload(self, api_url: str, upload: EncodedAudio, params: Dict,
+                     timeout: Optional[float]) -> requests.Response:
+        # multipart يُرسل قطعة قطعة (بدون نسخ الصوت داخل body واحد)
+        body = MultipartBody("file", upload.filename, upload.content_type, upload.parts)
+        if upload.codec != "wav":
+            params = dict(params, format=upload.codec)
+        return self.session.post(
+            api_url,
+            data=body,
+            headers={"Content-Type": body.content_type},
+            params=params,
+            timeout=timeout
+        )
+
+    def _handshake(self) -> Tuple[str, ...]:
+        with self._formats_lock:
+            if self._server_formats is not None:
+                return self._server_formats
+            url = f"{self.config.SERVER_API_URL.rstrip('/')}/stt/formats"
+            try:
+                resp = self.session.get(url, timeout=(self.transport.connect_timeout, 5))
+            except requests.RequestException as ex:
+                # السيرفر غير متاح الآن — WAV لهذا الدور ونسأل مرة أخرى لاحقًا
+                logger.warning(f"⚠️  STT format handshake failed: {ex}")
+                return ("wav",)
+            formats: Tuple[str, ...] = ("wav",)
+            if resp.ok:
+                try:
+                    body = resp.json()
+                    items = body.get("formats", []) if isinstance(body, dict) else body
+                    formats = tuple(str(f).strip().lower() for f in items) or ("wav",)
+                except ValueError:
+                    pass
+            elif resp.status_code >= 500:
+                return ("wav",)
+            self._server_formats = formats
+            logger.info(f"🗜️ STT upload formats: {', '.join(formats)}")
+            return formats
+
+    def _reject_codec(self, codec: str) -> None:
+        with self._formats_lock:
+            remaining = tuple(f for f in (self._server_formats or ()) if f != codec)
+            self._server_formats = remaining or ("wav",)
+
+    def open_stream(
+        self,
+        sample_rate: int = 16000,
+        sample_width: int = 2,
+        channels: int = 1,
+        language: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> "StreamingTranscription":
+        """
+        Start a streaming STT session (chunked upload to /stt/stream).
+        Feed raw PCM with `feed()` while recording, then call `finish()`.
+        Falls back to a normal /stt request if the server has no stream endpoint.
+        """
+        session = StreamingTranscription(
+            self,
+            sample_rate=sample_rate,
+            sample_width=sample_width,
+            channels=channels,
+            language=language,
+            timeout=timeout,
+            use_stream=self._stream_supported
+        )
+        session.start()
+        return session
+
+    def _register_endpoints(self, api_base: str) -> str:
+        """Register /stt and /stt/stream on the shared transport; returns the /stt URL."""
+        base = api_base.rstrip('/')
+        self.transport.register("stt", f"{base}/stt", read_timeout=self.config.STT_TIMEOUT)
+        # جسم الطلب generator — لا يمكن إعادة إرساله بعد رد من السيرفر
+        self.transport.register("stt_stream", f"{base}/stt/stream",
+                                read_timeout=self.config.STT_TIMEOUT, retry_status=False)
+        return f"{base}/stt"
+
     def cleanup(self):
         """Cleanup resources (if any)"""
         logger.debug("STT cleanup called")
-        pass
\ No newline at end of file
+        pass
+
+
+class StreamingTranscription:
+    """
+    One streaming STT session.
+    - feed(pcm):  يضيف PCM خام للرفع فورًا (لا يحجب ثريد التسجيل)
+    - finish():   يغلق الرفع وينتظر النص النهائي
+    - abort():    يلغي الجلسة بدون انتظار
+
+    Protocol: POST {SERVER_API_URL}/stt/stream with `Transfer-Encoding: chunked`
+    and `Content-Type: audio/L16; rate=...; channels=...`. The server transcribes
+    incrementally and answers with the same JSON as /stt once the body ends.
+    """
+
+    # Status codes meaning "this server has no streaming endpoint"
+    _UNSUPPORTED = (404, 405, 501)
+
+    def __init__(
+        self,
+        stt: SpeechToText,
+        sample_rate: int = 16000,
+        sample_width: int = 2,
+        channels: int = 1,
+        language: Optional[str] = None,
+        timeout: Optional[float] = None,
+        use_stream: bool = True
+    ):
+        self._stt = stt
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.language = language
+        self.timeout = timeout
+        self.use_stream = use_stream
+
+        self._queue: "Queue[Optional[bytes]]" = Queue()
+        self._pcm = bytearray()          # نسخة محلية للـ fallback على /stt
+        self._thread: Optional[threading.Thread] = None
+        self._done = threading.Event()
+        self._aborted = threading.Event()
+        self._scope = CancelScope()      # abort() يقطع الطلب الجاري فورًا
+        self._closed = False
+        self._result: Union[str, Dict, None] = None
+        self._error: Optional[BaseException] = None
+
+    # ---------------- Public API ----------------
+
+    def start(self) -> None:
+        if not self.use_stream:
+            return
+        self._thread = threading.Thread(target=self._upload, name="STTStream", daemon=True)
+        self._thread.start()
+
+    def feed(self, pcm: bytes) -> None:
+        """Queue one PCM chunk for upload."""
+        if self._closed or not pcm:
+            return
+        self._pcm += pcm
+        if self.use_stream:
+            self._queue.put(bytes(pcm))
+
+    def finish(self, timeout: Optional[float] = None) -> Union[str, Dict]:
+        """Close the upload and return the transcript (same shape as transcribe())."""
+        self._close_body()
+        if not self._pcm:
+            raise ValueError("Empty audio data provided")
+
+        if self.use_stream and self._thread is not None:
+            wait = timeout if timeout is not None else (self.timeout or self._stt.config.STT_TIMEOUT)
+            self._done.wait(timeout=wait)
+            if self._done.is_set() and self._error is None:
+                return self._result
+            logger.warning(f"⚠️  STT stream failed ({self._error}), falling back to /stt")
+
+        # _pcm لا يتغيّر بعد الإغلاق → memoryview بدل نسخة
+        wav_bytes = _pcm_to_wav(memoryview(self._pcm), self.sample_rate, self.sample_width, self.channels)
+        return self._stt.transcribe(wav_bytes, language=self.language, timeout=self.timeout)
+
+    def abort(self) -> None:
+        """Drop the session (e.g. nothing was recorded, or barge-in)."""
+        self._aborted.set()
+        self._close_body()
+        self._scope.cancel()
+
+    @property
+    def bytes_fed(self) -> int:
+        return len(self._pcm)
+
+    # ---------------- Internal ----------------
+
+    def _close_body(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+
+    def _body(self) -> Iterator[bytes]:
+        """Chunk generator for requests (each yield = one HTTP chunk)."""
+        while True:
+            item = self._queue.get()
+            if item is None or self._aborted.is_set():
+                return
+            # دمج أي chunks متراكمة لتقليل عدد الـ writes
+            parts = [item]
+            end = False
+            while True:
+                try:
+                    nxt = self._queue.get_nowait()
+                except Empty:
+                    break
+                if nxt is None:
+                    end = True
+                    break
+                parts.append(nxt)
+            yield b"".join(parts)
+            if end:
+                return
+
+    def _upload(self) -> None:
+        api_url = f"{self._stt.config.SERVER_API_URL.rstrip('/')}/stt/stream"
+        params = {
+            "rate": self.sample_rate,
+            "width": self.sample_width,
+            "channels": self.channels,
+        }
+        if self.language:
+            params["language"] = self.language
+        headers = {
+            "Content-Type": f"audio/L{8 * self.sample_width}; rate={self.sample_rate}; channels={self.channels}"
+        }
+
+        logger.info(f"📤 Streaming audio to STT: {api_url}")
+        try:
+            with self._scope:
+                resp = self._stt.session.post(
+                    api_url,
+                    data=self._body(),
+                    params=params,
+                    headers=headers,
+                    timeout=self.timeout
+                )
+            if resp.status_code in self._UNSUPPORTED:
+                # السيرفر لا يدعم البث — لا تحاول مرة أخرى في الجلسات القادمة
+                self._stt._stream_supported = False
+            resp.raise_for_status()
+
+            result = resp.json()
+            logger.info(f"✅ STT stream response: {result}")
+            if isinstance(result, dict) and "text" in result:
+                result = result["text"]
+            self._result = result
+        except Exception as ex:
+            if not self._aborted.is_set():
+                logger.error(f"❌ STT stream error: {ex}")
+            self._error = ex
+        finally:
+            self._done.set()
+
+
+class SpeculativeTranscriber:
+    """
+    Speculative STT during the end-of-speech hangover.
+
+    The recorder calls `submit(pcm)` when silence begins (before it has
+    waited `end_frames` + `post_silence_hold`), and `discard()` if the user
+    resumes speaking. `result(final_pcm)` then returns the speculative
+    transcript when it is still valid — the only audio added since the
+    snapshot is trailing silence — or transcribes `final_pcm` normally.
+    """
+
+    def __init__(
+        self,
+        stt: SpeechToText,
+        sample_rate: int = 16000,
+        sample_width: int = 2,
+        channels: int = 1,
+        language: Optional[str] = None
+    ):
+        self._stt = stt
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.language = language
+
+        self._lock = threading.Lock()
+        self._job: Optional[Dict] = None      # {"done", "scope", "result", "error"}
+        self.hits = 0
+        self.discards = 0
+        # الرفع المضغوط يُرمَّز أثناء التسجيل (feed = on_frame) — None = WAV
+        self.encoder = stt.capture_encoder(sample_rate, sample_width, channels)
+
+    # ---------------- Recorder callbacks ----------------
+
+    def feed(self, pcm: bytes) -> None:
+        """on_frame hook: encode the capture for upload while the user speaks."""
+        if self.encoder is not None:
+            self.encoder.feed(pcm)
+
+    def submit(self, pcm: bytes) -> None:
+        """Start STT on a snapshot (replaces any previous one)."""
+        self.discard()
+        job = {"done": threading.Event(), "scope": CancelScope(), "result": None, "error": None}
+        with self._lock:
+            self._job = job
+        threading.Thread(target=self._run, args=(job, pcm), name="STTSpeculative", daemon=True).start()
+
+    def discard(self) -> None:
+        """Speech resumed: drop the snapshot and cancel its request."""
+        with self._lock:
+            job, self._job = self._job, None
+        if job is not None:
+            self.discards += 1
+            job["scope"].cancel()
+
+    # ---------------- Final result ----------------
+
+    def result(self, final_pcm: bytes, timeout: Optional[float] = None) -> Union[str, Dict]:
+        with self._lock:
+            job, self._job = self._job, None
+
+        if job is not None:
+            job["done"].wait(timeout=timeout if timeout is not None else self._stt.config.STT_TIMEOUT)
+            if job["done"].is_set() and job["error"] is None:
+                self.hits += 1
+                logger.info("⚡ Speculative STT result used")
+                return job["result"]
+            logger.warning(f"⚠️  Speculative STT failed ({job['error']}), transcribing final audio")
+
+        return self._stt.transcribe(self._upload(final_pcm), language=self.language)
+
+    def _upload(self, pcm) -> Union[EncodedAudio, tuple]:
+        if self.encoder is None:
+            return _pcm_to_wav(pcm, self.sample_rate, self.sample_width, self.channels)
+        return self._stt.prepare_upload(pcm, self.sample_rate, self.sample_width, self.channels,
+                                        encoder=self.encoder)
+
+    def _run(self, job: Dict, pcm: bytes) -> None:
+        try:
+            upload = self._upload(pcm)
+            with job["scope"]:
+                job["result"] = self._stt.transcribe(upload, language=self.language)
+        except Exception as ex:
+            job["error"] = ex
+        finally:
+            job["done"].set()
+
+
+def _pcm_to_wav(pcm_bytes: Union[PcmBuffer, BytesLike], sample_rate: int, sample_width: int,
+                channels: int) -> tuple:
+    """WAV pieces for transcribe(): (header, pcm) — the PCM itself is not copied."""
+    return as_wav_parts(pcm_bytes, sample_rate, sample_width, channels)
\ No newline at end of file
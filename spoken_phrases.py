@@ -0,0 +1,314 @@
+# spoken_phrases.py
+# -------------------------------------------------------------------
+# Time/date answers spoken from pre-synthesized fragments (no /tts per query)
+# - الوقت والتاريخ يتغيّران كل دقيقة → لا يستفيدان من cache الجمل الكاملة
+# - بدلًا من ذلك: كلمات ثابتة (أرقام، AM/PM، أيام، شهور) تُولَّد مرة واحدة
+#   ثم تُلصق محليًا في PCM واحد متصل (قص الصمت + fade قصير + فاصل ثابت)
+# - SpokenPhrase: نص العرض (str) + مفاتيح الـ fragments التي تنطقه
+#   SpeechPipeline يلصقها محليًا لو كل الـ fragments جاهزة، وإلا يرسل النص لـ TTS
+# -------------------------------------------------------------------
+
+import io
+import threading
+import wave
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class SpokenPhrase(str):
+    """A display string that also knows the fragment keys which speak it."""
+
+    fragments: Tuple[str, ...]
+
+    def __new__(cls, text: str, fragments: Sequence[str]):
+        obj = super().__new__(cls, text)
+        obj.fragments = tuple(fragments)
+        return obj
+
+
+# ==================== Fragment vocabulary ====================
+
+_EN_NUM = ["", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+           "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen",
+           "eighteen", "nineteen"]
+_EN_TENS = {20: "twenty", 30: "thirty", 40: "forty", 50: "fifty", 60: "sixty", 70: "seventy",
+            80: "eighty", 90: "ninety"}
+_EN_ORD = ["", "first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth",
+           "tenth", "eleventh", "twelfth", "thirteenth", "fourteenth", "fifteenth", "sixteenth",
+           "seventeenth", "eighteenth", "nineteenth"]
+_EN_WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+_EN_MONTHS = ["", "January", "February", "March", "April", "May", "June", "July", "August",
+              "September", "October", "November", "December"]
+
+_AR_NUM = ["", "واحد", "اثنان", "ثلاثة", "أربعة", "خمسة", "ستة", "سبعة", "ثمانية", "تسعة", "عشرة",
+           "أحد عشر", "اثنا عشر", "ثلاثة عشر", "أربعة عشر", "خمسة عشر", "ستة عشر", "سبعة عشر",
+           "ثمانية عشر", "تسعة عشر"]
+_AR_TENS = {20: "عشرون", 30: "ثلاثون", 40: "أربعون", 50: "خمسون", 60: "ستون", 70: "سبعون",
+            80: "ثمانون", 90: "تسعون"}
+# الساعة بالعربي = عدد ترتيبي مؤنث
+_AR_HOURS = ["", "الواحدة", "الثانية", "الثالثة", "الرابعة", "الخامسة", "السادسة", "السابعة",
+             "الثامنة", "التاسعة", "العاشرة", "الحادية عشرة", "الثانية عشرة"]
+_AR_WEEKDAYS = ["الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
+_AR_MONTHS = ["", "يناير", "فبراير", "مارس", "أبريل", "مايو", "يونيو", "يوليو", "أغسطس",
+              "سبتمبر", "أكتوبر", "نوفمبر", "ديسمبر"]
+
+
+def _build_fragments() -> Dict[str, str]:
+    f = {
+        "en.time_is": "The current time is",
+        "en.today_is": "Today is",
+        "en.oh": "oh",
+        "en.oclock": "o'clock",
+        "en.am": "A M",
+        "en.pm": "P M",
+        "en.two_thousand": "two thousand",
+        "en.hundred": "hundred",
+        "ar.time_is": "الوقت الآن",
+        "ar.today_is": "التاريخ اليوم",
+        "ar.sharp": "تماما",
+        "ar.am": "صباحا",
+        "ar.pm": "مساء",
+        "ar.min_1": "ودقيقة واحدة",
+        "ar.min_2": "ودقيقتان",
+        "ar.minutes": "دقائق",
+        "ar.minute": "دقيقة",
+        "ar.two_thousand": "ألفين",
+    }
+    for n in range(1, 20):
+        f[f"en.n.{n}"] = _EN_NUM[n]
+        f[f"en.ord.{n}"] = _EN_ORD[n]
+        f[f"ar.n.{n}"] = _AR_NUM[n]
+        # "و" ملتصقة بالكلمة: نطق طبيعي بدل "واو" منفصلة
+        f[f"ar.w.{n}"] = "و" + _AR_NUM[n]
+    for n in _EN_TENS:
+        f[f"en.n.{n}"] = _EN_TENS[n]
+        f[f"ar.n.{n}"] = _AR_TENS[n]
+        f[f"ar.w.{n}"] = "و" + _AR_TENS[n]
+    f["en.ord.20"] = "twentieth"
+    f["en.ord.30"] = "thirtieth"
+    for h in range(1, 13):
+        f[f"ar.hour.{h}"] = "الساعة " + _AR_HOURS[h]
+    for d in range(7):
+        f[f"en.wd.{d}"] = _EN_WEEKDAYS[d]
+        f[f"ar.wd.{d}"] = _AR_WEEKDAYS[d]
+    for m in range(1, 13):
+        f[f"en.mon.{m}"] = _EN_MONTHS[m]
+        f[f"ar.mon.{m}"] = _AR_MONTHS[m]
+    return f
+
+
+FRAGMENTS: Dict[str, str] = _build_fragments()
+
+
+# ==================== Phrase → fragment keys ====================
+
+def _en_number(n: int) -> List[str]:
+    """0 < n < 100."""
+    if n < 20 or n % 10 == 0:
+        return [f"en.n.{n}"]
+    return [f"en.n.{n - n % 10}", f"en.n.{n % 10}"]
+
+
+def _ar_number(n: int, joined: bool = False) -> List[str]:
+    """0 < n < 100 ("خمسة وعشرون" = [خمسة, وعشرون]); joined → "و" على أول كلمة أيضًا."""
+    first = "ar.w" if joined else "ar.n"
+    if n < 20 or n % 10 == 0:
+        return [f"{first}.{n}"]
+    return [f"{first}.{n % 10}", f"ar.w.{n - n % 10}"]
+
+
+def time_fragments(now: datetime, lang: str = "english") -> List[str]:
+    hour = now.hour % 12 or 12
+    minute = now.minute
+    if lang == "arabic":
+        keys = ["ar.time_is", f"ar.hour.{hour}"]
+        if minute == 0:
+            keys.append("ar.sharp")
+        elif minute == 1:
+            keys.append("ar.min_1")
+        elif minute == 2:
+            keys.append("ar.min_2")
+        else:
+            keys += _ar_number(minute, joined=True)
+            keys.append("ar.minutes" if minute <= 10 else "ar.minute")
+        keys.append("ar.am" if now.hour < 12 else "ar.pm")
+        return keys
+
+    keys = ["en.time_is", f"en.n.{hour}"]
+    if minute == 0:
+        keys.append("en.oclock")
+    elif minute < 10:
+        keys += ["en.oh", f"en.n.{minute}"]
+    else:
+        keys += _en_number(minute)
+    keys.append("en.am" if now.hour < 12 else "en.pm")
+    return keys
+
+
+def date_fragments(now: datetime, lang: str = "english") -> List[str]:
+    year2 = now.year % 100
+    if lang == "arabic":
+        keys = ["ar.today_is", f"ar.wd.{now.weekday()}"]
+        keys += _ar_number(now.day)
+        keys.append(f"ar.mon.{now.month}")
+        keys.append("ar.two_thousand")
+        if year2:
+            keys += _ar_number(year2, joined=True)
+        return keys
+
+    day = now.day
+    if day < 20 or day % 10 == 0:
+        ordinal = [f"en.ord.{day}"]
+    else:
+        ordinal = [f"en.n.{day - day % 10}", f"en.ord.{day % 10}"]
+    keys = ["en.today_is", f"en.wd.{now.weekday()}", f"en.mon.{now.month}"] + ordinal
+    if now.year < 2010:
+        keys.append("en.two_thousand")
+        if year2:
+            keys.append(f"en.n.{year2}")
+    else:
+        # 2026 → "twenty twenty six"
+        keys += _en_number(now.year // 100)
+        if year2 >= 10:
+            keys += _en_number(year2)
+        elif year2:
+            keys += ["en.oh", f"en.n.{year2}"]
+        else:
+            keys.append("en.hundred")
+    return keys
+
+
+def fragment_text(keys: Sequence[str]) -> str:
+    return " ".join(FRAGMENTS[k] for k in keys)
+
+
+# ==================== Audio ====================
+
+class FragmentBank:
+    """
+    Pre-rendered fragment audio (int16 mono) + splicing.
+
+        bank = FragmentBank(tts)
+        bank.prepare()                       # مرة عند الإقلاع (TTS_CACHE → من القرص بعدها)
+        pcm, rate = bank.splice(keys)        # None لو fragment ناقص
+    """
+
+    def __init__(self, tts, gap_ms: int = 60, fade_ms: int = 6, silence_ratio: float = 0.03):
+        self.tts = tts
+        self.gap_ms = gap_ms
+        self.fade_ms = fade_ms
+        self.silence_ratio = silence_ratio   # عتبة قص الصمت نسبةً لأعلى قيمة
+        self.rate: Optional[int] = None
+        self._audio: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return len(self._audio) == len(FRAGMENTS)
+
+    def has(self, keys: Sequence[str]) -> bool:
+        return all(k in self._audio for k in keys)
+
+    def prepare(self, keys: Optional[Sequence[str]] = None) -> int:
+        """Synthesize missing fragments (via tts.tts → TtsCache when enabled)."""
+        done = 0
+        for key in (keys or list(FRAGMENTS)):
+            if key in self._audio:
+                continue
+            try:
+                wav = self.tts.tts(FRAGMENTS[key], as_fmt="wav")
+                self.add(key, wav)
+                done += 1
+            except Exception as ex:
+                print(f"⚠️ Phrase fragment '{key}' failed: {ex}")
+        return done
+
+    def add(self, key: str, wav: bytes) -> None:
+        from resampler import downmix, resample
+
+        with wave.open(io.BytesIO(wav), "rb") as wf:
+            if wf.getsampwidth() != 2:
+                raise ValueError("Only 16-bit WAV supported")
+            sr, ch = wf.getframerate(), wf.getnchannels()
+            x = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16).reshape(-1, ch)
+        x = downmix(x, 1)[:, 0]
+        with self._lock:
+            if self.rate is None:
+                self.rate = sr
+        if sr != self.rate:
+            x = np.clip(resample(x[:, None].astype(np.float32), sr, self.rate)[:, 0],
+                        -32768, 32767).astype(np.int16)
+        x = self._trim(x)
+        with self._lock:
+            self._audio[key] = x
+
+    def splice(self, keys: Sequence[str]) -> Optional[Tuple[bytes, int]]:
+        """One continuous PCM buffer for `keys` (None if any fragment is missing)."""
+        with self._lock:
+            parts = [self._audio.get(k) for k in keys]
+        if not parts or any(p is None for p in parts):
+            return None
+        gap = np.zeros(int(self.rate * self.gap_ms / 1000), dtype=np.int16)
+        out = []
+        for p in parts:
+            out.append(p)
+            out.append(gap)
+        return np.concatenate(out[:-1]).tobytes(), self.rate
+
+    def _trim(self, x: np.ndarray) -> np.ndarray:
+        """Cut leading/trailing silence, keep a few ms, fade the edges (no clicks)."""
+        if not len(x):
+            return x
+        a = np.abs(x.astype(np.int32))
+        loud = np.flatnonzero(a > max(1, int(a.max() * self.silence_ratio)))
+        if not len(loud):
+            return x[:0]
+        pad = int(self.rate * 0.01)
+        y = x[max(0, loud[0] - pad):loud[-1] + pad + 1].astype(np.float32)
+        n = min(len(y) // 2, int(self.rate * self.fade_ms / 1000))
+        if n:
+            ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+            y[:n] *= ramp
+            y[-n:] *= ramp[::-1]
+        return y.astype(np.int16)
+
+
+# ==================== Quick Test ====================
+
+if __name__ == "__main__":
+    import time
+
+    samples = [datetime(2026, 10, 16, 15, 42), datetime(2026, 1, 1, 0, 0), datetime(2009, 3, 21, 9, 5),
+               datetime(2026, 7, 2, 12, 1), datetime(2026, 7, 2, 11, 25)]
+    for when in samples:
+        print(f"{when:%Y-%m-%d %H:%M}")
+        print(f"   {fragment_text(time_fragments(when))} | {fragment_text(date_fragments(when))}")
+        print(f"   {fragment_text(time_fragments(when, 'arabic'))} | "
+              f"{fragment_text(date_fragments(when, 'arabic'))}")
+
+    # Stand-in TTS (بدون شبكة): نغمة بطول النص مع صمت في الطرفين
+    class _FakeTts:
+        def tts(self, text, as_fmt="wav"):
+            rate = 22050
+            body = np.sin(np.arange(int(len(text) * 0.06 * rate)) * 0.1) * 8000
+            pcm = np.concatenate([np.zeros(2000), body, np.zeros(3000)]).astype(np.int16)
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(rate)
+                wf.writeframes(pcm.tobytes())
+            return buf.getvalue()
+
+    bank = FragmentBank(_FakeTts())
+    t0 = time.perf_counter()
+    print(f"\nprepared {bank.prepare()} fragments in {time.perf_counter() - t0:.2f}s (ready={bank.ready})")
+    keys = time_fragments(datetime.now(), "arabic") + date_fragments(datetime.now(), "arabic")
+    t0 = time.perf_counter()
+    n = 1000
+    for _ in range(n):
+        pcm, rate = bank.splice(keys)
+    print(f"splice {len(keys)} fragments → {len(pcm) / 2 / rate:.2f}s audio in "
+          f"{(time.perf_counter() - t0) / n * 1000:.3f} ms")
@@ -0,0 +1,405 @@
+# stub_server.py
+# -------------------------------------------------------------------
+# Local stand-in for the robot API server (SERVER_API_URL).
+# Used for offline checks of the HTTP clients without the real models.
+#
+#   GET  /stt/formats  upload codecs accepted by /stt  -> {"formats": [...]}
+#   POST /stt          multipart upload (field "file") -> {"text": ...}
+#                      (WAV / FLAC / Ogg-Opus / IMA-ADPCM / μ-law → مدة الصوت الحقيقية)
+#   POST /stt/stream   chunked raw PCM upload          -> {"text": ...}
+#   POST /tts          {"text", "as": wav|pcm}        -> audio paced like real synthesis
+#   POST /webhook/...  n8n webhook stand-in (json | sse | n8n streaming)
+#
+# Run directly for a quick streaming-vs-batch comparison (STT + n8n):
+#   python stub_server.py
+# -------------------------------------------------------------------
+
+import io
+import json
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from audio_codecs import decode
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive مثل السيرفر الحقيقي
+
+    # ---------------- Routing ----------------
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/stt":
+            self._handle_stt()
+        elif path == "/stt/stream":
+            self._handle_stt_stream()
+        elif path == "/tts":
+            self._handle_tts()
+        elif path.startswith("/webhook"):
+            self._handle_n8n()
+        else:
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        formats = self.server.stub.stt_formats
+        if path == "/stt/formats" and formats is not None:
+            self._send_json(200, {"formats": list(formats)})
+        else:
+            # سيرفر قديم: لا handshake → العميل يرفع WAV
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def do_HEAD(self):
+        # يستخدمه HttpTransport.warm_up لفتح الاتصال فقط
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    # ---------------- Endpoints ----------------
+
+    def _handle_stt(self):
+        body = self._read_body()
+        cfg = self.server.stub
+        codec = (parse_qs(urlparse(self.path).query).get("format") or ["wav"])[0].lower()
+        if codec not in (cfg.stt_formats or ("wav",)):
+            self._send_json(415, {"error": f"unsupported format {codec}"})
+            return
+        audio = _multipart_file(body, self.headers.get("Content-Type", ""))
+        try:
+            samples, rate = decode(audio)
+            seconds = len(samples) / float(rate)
+        except Exception:
+            seconds = cfg.audio_seconds(len(audio))
+        cfg.last_stt = {"format": codec, "bytes": len(audio), "seconds": seconds}
+        # محاكاة "رفع كامل ثم استنتاج": زمن المعالجة يتناسب مع طول الصوت
+        time.sleep(cfg.stt_latency + seconds * cfg.stt_realtime_factor)
+        cfg.stt_requests += 1
+        self._send_json(200, {"text": cfg.stt_text, "bytes": len(audio)})
+
+    def _handle_stt_stream(self):
+        cfg = self.server.stub
+        if not cfg.stream_enabled:
+            self._read_body()
+            self._send_json(404, {"error": "streaming not supported"})
+            return
+        # الاستنتاج يتم أثناء وصول الـ chunks، فلا يبقى بعد النهاية إلا الذيل
+        received = 0
+        for chunk in self._iter_body():
+            received += len(chunk)
+            time.sleep(cfg.audio_seconds(len(chunk)) * cfg.stt_realtime_factor)
+        time.sleep(cfg.stt_latency)
+        cfg.stt_requests += 1
+        self._send_json(200, {"text": cfg.stt_text, "bytes": received})
+
+    def _handle_tts(self):
+        try:
+            payload = json.loads(self._read_body() or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+        text = str(payload.get("text", "")).strip()
+        if not text:
+            self._send_json(400, {"error": "empty text"})
+            return
+        cfg = self.server.stub
+        fmt = str(payload.get("as", "wav")).lower()
+        pcm = cfg.tts_audio(text)
+        time.sleep(cfg.tts_latency)
+        cfg.tts_requests += 1
+
+        self.send_response(200)
+        if fmt == "pcm":
+            body = pcm
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("x-sample-rate", str(cfg.tts_rate))
+            self.send_header("x-sample-format", "s16le")
+            self.send_header("x-channels", "1")
+        else:
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(cfg.tts_rate)
+                wf.writeframes(pcm)
+            body = buf.getvalue()
+            self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # الصوت يُولَّد تدريجيًا: كل ~100ms صوت يحتاج 100ms·realtime_factor
+        step = cfg.tts_rate // 10 * 2
+        try:
+            for i in range(0, len(body), step):
+                self.wfile.write(body[i:i + step])
+                self.wfile.flush()
+                time.sleep(0.1 * cfg.tts_realtime_factor)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # العميل أوقف التشغيل
+
+    def _handle_n8n(self):
+        self._read_body()
+        cfg = self.server.stub
+        time.sleep(cfg.n8n_latency)
+        tokens = cfg.n8n_tokens()
+
+        if cfg.n8n_mode == "json":
+            time.sleep(cfg.n8n_token_delay * len(tokens))
+            self._send_json(200, {"output": cfg.n8n_reply})
+            return
+
+        # Streaming: chunked response, token by token
+        self.send_response(200)
+        if cfg.n8n_mode == "sse":
+            self.send_header("Content-Type", "text/event-stream")
+        else:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def emit(text: str):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        if cfg.n8n_mode == "n8n":
+            emit(json.dumps({"type": "begin"}) + "\n")
+        for tok in tokens:
+            time.sleep(cfg.n8n_token_delay)
+            if cfg.n8n_mode == "sse":
+                emit("data: " + json.dumps({"choices": [{"delta": {"content": tok}}]}, ensure_ascii=False) + "\n\n")
+            else:
+                emit(json.dumps({"type": "item", "content": tok}, ensure_ascii=False) + "\n")
+        if cfg.n8n_mode == "sse":
+            emit("data: [DONE]\n\n")
+        else:
+            emit(json.dumps({"type": "end"}) + "\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # ---------------- Body helpers ----------------
+
+    def _iter_body(self):
+        """Yield request body pieces (chunked or Content-Length), paced by upload_bytes_per_sec."""
+        bps = self.server.stub.upload_bytes_per_sec
+        for piece in self._iter_raw_body():
+            if bps:
+                # Wi-Fi بطيء: القطعة "تصل" بعد len / bps ثانية
+                time.sleep(len(piece) / bps)
+            yield piece
+
+    def _iter_raw_body(self):
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            while True:
+                size_line = self.rfile.readline().strip()
+                size = int(size_line.split(b";")[0] or b"0", 16)
+                if size == 0:
+                    # trailer headers حتى سطر فارغ
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                data = self.rfile.read(size)
+                self.rfile.readline()  # CRLF بعد كل chunk
+                yield data
+        else:
+            length = int(self.headers.get("Content-Length", "0") or 0)
+            while length > 0:
+                data = self.rfile.read(min(length, 64 * 1024))
+                if not data:
+                    return
+                length -= len(data)
+                yield data
+
+    def _read_body(self) -> bytes:
+        return b"".join(self._iter_body())
+
+    def _send_json(self, status: int, obj) -> None:
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # العميل ألغى الطلب (CancelScope)
+
+    def log_message(self, format, *args):
+        # صامت افتراضيًا
+        pass
+
+
+def _multipart_file(body: bytes, content_type: str) -> bytes:
+    """Payload of the first file part of a multipart/form-data body (else the body itself)."""
+    marker = "boundary="
+    if marker not in content_type:
+        return body
+    boundary = content_type.split(marker, 1)[1].split(";")[0].strip().strip('"').encode("ascii")
+    for part in body.split(b"--" + boundary):
+        head, sep, payload = part.partition(b"\r\n\r\n")
+        if sep and b"filename=" in head:
+            return payload[:-2] if payload.endswith(b"\r\n") else payload
+    return body
+
+
+class StubApiServer:
+    """
+    Threaded local HTTP server that imitates the robot API.
+
+    Usage:
+        with StubApiServer(stt_text="hello") as srv:
+            cfg.SERVER_API_URL = srv.url
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        stt_text: str = "hello ziko",
+        stt_latency: float = 0.15,
+        stt_realtime_factor: float = 0.1,
+        stream_enabled: bool = True,
+        n8n_reply: str = "Hello! I am Ziko. How can I help you today?",
+        n8n_mode: str = "json",
+        n8n_latency: float = 0.3,
+        n8n_token_delay: float = 0.02,
+        tts_latency: float = 0.1,
+        tts_realtime_factor: float = 0.2,
+        tts_rate: int = 22050,
+        tts_chars_per_sec: float = 15.0,
+        sample_rate: int = 16000,
+        sample_width: int = 2,
+        stt_formats: Optional[tuple] = ("wav", "flac", "opus", "adpcm", "ulaw"),
+        upload_bytes_per_sec: Optional[float] = None,
+    ):
+        self.stt_text = stt_text
+        self.stt_latency = stt_latency                  # ثابت لكل طلب (ثواني)
+        self.stt_realtime_factor = stt_realtime_factor  # ثواني معالجة لكل ثانية صوت
+        self.stream_enabled = stream_enabled
+        self.n8n_reply = n8n_reply
+        self.n8n_mode = n8n_mode                        # json | sse | n8n
+        self.n8n_latency = n8n_latency                  # زمن قبل أول token
+        self.n8n_token_delay = n8n_token_delay          # زمن كل token
+        self.tts_latency = tts_latency                  # قبل أول byte
+        self.tts_realtime_factor = tts_realtime_factor  # ثواني توليد لكل ثانية صوت
+        self.tts_rate = tts_rate
+        self.tts_chars_per_sec = tts_chars_per_sec      # طول الصوت ∝ طول النص
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.stt_formats = stt_formats                  # None = سيرفر بدون /stt/formats (WAV فقط)
+        self.upload_bytes_per_sec = upload_bytes_per_sec  # None = بدون حد (localhost)
+        self.last_stt: Optional[dict] = None            # {"format", "bytes", "seconds"} لآخر /stt
+        self.stt_requests = 0
+        self.tts_requests = 0
+
+        self._httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def audio_seconds(self, nbytes: int) -> float:
+        return nbytes / float(self.sample_rate * self.sample_width)
+
+    def tts_audio(self, text: str) -> bytes:
+        """Speech-like stand-in: syllable-rate AM tone, length ∝ len(text)."""
+        n = max(1, int(len(text) / self.tts_chars_per_sec * self.tts_rate))
+        t = np.arange(n) / self.tts_rate
+        env = 0.55 + 0.45 * np.sin(2 * np.pi * 4.0 * t)
+        sig = np.sin(2 * np.pi * 180.0 * t) + 0.4 * np.sin(2 * np.pi * 720.0 * t)
+        return (sig * env * 6000).astype(np.int16).tobytes()
+
+    def n8n_tokens(self) -> list:
+        """Split the canned reply into word tokens (keeps the spaces)."""
+        words = self.n8n_reply.split(" ")
+        return [w + " " for w in words[:-1]] + words[-1:]
+
+    def start(self) -> "StubApiServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="StubApiServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ==================== Quick Check ====================
+
+if __name__ == "__main__":
+    from Config import Config
+    from speech_to_text import SpeechToText, _pcm_to_wav
+
+    rate, chunk = 16000, 320
+    seconds = 3.0
+    frame = b"\x00\x01" * chunk
+    n_frames = int(seconds * rate / chunk)
+
+    with StubApiServer(stt_text="ziko what time is it") as srv:
+        cfg = Config()
+        cfg.SERVER_API_URL = srv.url
+        stt = SpeechToText(cfg)
+
+        print("=" * 60)
+        print(f"🧪 STT stand-in at {srv.url} ({seconds:.1f}s of audio)")
+        print("=" * 60)
+
+        # Batch: التسجيل كامل ثم رفع + استنتاج
+        pcm = frame * n_frames
+        t0 = time.perf_counter()
+        text = stt.transcribe(_pcm_to_wav(pcm, rate, 2, 1))
+        batch_ms = (time.perf_counter() - t0) * 1000
+        print(f"batch   : '{text}' → {batch_ms:.0f} ms after end of speech")
+
+        # Streaming: الرفع يتم بالتوازي مع التسجيل (محاكاة 20ms لكل chunk)
+        session = stt.open_stream(sample_rate=rate)
+        for _ in range(n_frames):
+            session.feed(frame)
+            time.sleep(chunk / rate)
+        t0 = time.perf_counter()
+        text = session.finish()
+        stream_ms = (time.perf_counter() - t0) * 1000
+        print(f"stream  : '{text}' → {stream_ms:.0f} ms after end of speech")
+
+        # Fallback: سيرفر بدون /stt/stream
+        srv.stream_enabled = False
+        session = stt.open_stream(sample_rate=rate)
+        session.feed(pcm)
+        text = session.finish()
+        print(f"fallback: '{text}' (stream supported now: {stt._stream_supported})")
+        print("=" * 60)
+
+        # Keep-alive: كل الطلبات السابقة على نفس الـ pool
+        print(f"warm-up : {stt.transport.warm_up(background=False)}")
+
+        # n8n: أول جملة متاحة قبل انتهاء التوليد
+        from ai_n8n import N8nClient
+        cfg.N8N_URL = f"{srv.url}/webhook/MultiAgentChat"
+        client = N8nClient(cfg)
+        for mode in ("json", "sse", "n8n"):
+            srv.n8n_mode = mode
+            t0 = time.perf_counter()
+            first = None
+            sentences = []
+            for sentence in client.chat_sentences("test", "hello"):
+                if first is None:
+                    first = (time.perf_counter() - t0) * 1000
+                sentences.append(sentence)
+            total = (time.perf_counter() - t0) * 1000
+            print(f"n8n {mode:4s}: first sentence {first:.0f} ms / total {total:.0f} ms → {sentences}")
+        client.close()
+        print("=" * 60)
@@ -1,28 +1,57 @@
 # text_to_speech.py (مُحسّن)
 import requests
 import json
-from typing import Optional
+from dataclasses import dataclass
+from typing import Iterator, Optional
 from Config import Config
+from http_transport import HttpTransport, get_transport
+from latency_trace import TRACE
+from tts_cache import TtsCache
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class TtsStream:
+    """
+    Streamed /tts response.
+    chunks: bytes كما تصل من الشبكة (WAV كامل بالـ header، أو PCM خام)
+    sample_rate/channels: للـ PCM من headers السيرفر؛ None مع WAV (الـ header داخل الـ stream)
+    """
+    chunks: Iterator[bytes]
+    fmt: str = "wav"
+    sample_rate: Optional[int] = None
+    channels: int = 1
+
+
 class TextToSpeech:
     """
     Text-to-Speech class using API endpoint
     Converts text to audio bytes (WAV or PCM format)
     """
-    def __init__(self, config: Optional[Config] = None):
+    def __init__(self, config: Optional[Config] = None, transport: Optional[HttpTransport] = None):
         self.config = config or Config()
         self.api_base = self.config.SERVER_API_URL
+        # ✅ Session مشتركة (keep-alive) بدل requests.post لكل جملة
+        self.transport = transport or get_transport(self.config)
+        self.session = self.transport.session
+        self._register_endpoint(self.api_base)
+
+        # ✅ Cache على القرص: نفس (النص، الصوت، الصيغة) لا يُولَّد مرتين (TTS_CACHE)
+        self.cache: Optional[TtsCache] = None
+        if getattr(self.config, "TTS_CACHE", False):
+            self.cache = TtsCache(
+                folder=self.config.TTS_CACHE_DIR,
+                max_bytes=int(self.config.TTS_CACHE_MAX_MB * 1024 * 1024)
+            )
 
     def tts(
         self, 
         text: str, 
         as_fmt: str = "wav",
         voice: Optional[str] = None,
-        timeout: int = 120
+        timeout: Optional[float] = None
     ) -> bytes:
         """
         Send text to /tts endpoint and get audio bytes.
@@ -32,7 +61,7 @@ class TextToSpeech:
             text: Text to convert to speech
             as_fmt: Output format - "wav" or "pcm" (default: "wav")
             voice: Optional voice name (e.g., "en_US-lessac-medium")
-            timeout: Request timeout in seconds
+            timeout: Request timeout in seconds (None = endpoint (connect, read) default)
             
         Returns:
             Audio bytes (WAV or PCM format)
@@ -48,8 +77,14 @@ class TextToSpeech:
             raise ValueError("Empty text provided")
         
         text = text.strip()
+
+        if self.cache is not None:
+            cached = self.cache.get(text, voice, as_fmt)
+            if cached is not None:
+                logger.info(f"⚡ TTS cache hit: {len(cached)} bytes")
+                return cached
         
-        api_url = f"{api_base.rstrip('/')}/tts"
+        api_url = self._register_endpoint(api_base)
         
         # إعداد البيانات
         payload = {
@@ -66,8 +101,9 @@ class TextToSpeech:
         logger.debug(f"   Text: {text[:100]}{'...' if len(text) > 100 else ''}")
         logger.debug(f"   Format: {as_fmt}")
         
+        t0 = TRACE.now()
         try:
-            resp = requests.post(
+            resp = self.session.post(
                 api_url,
                 data=json.dumps(payload),
                 headers=headers,
@@ -76,12 +112,17 @@ class TextToSpeech:
             resp.raise_for_status()
             
             audio_bytes = resp.content
+            # resp.elapsed = حتى وصول الـ headers (≈ أول byte)
+            TRACE.record("tts_first_byte", t0, t0 + resp.elapsed.total_seconds())
+            TRACE.record("tts", t0, TRACE.now())
             
             if not audio_bytes:
                 logger.warning("⚠️  Empty audio response")
                 return b""
             
             logger.info(f"✅ TTS response: {len(audio_bytes)} bytes")
+            if self.cache is not None:
+                self.cache.put(text, voice, as_fmt, audio_bytes)
             
             # معلومات إضافية للـ PCM format
             if as_fmt.lower() == "pcm":
@@ -119,6 +160,90 @@ class TextToSpeech:
             logger.error(f"❌ Unexpected Error: {ex}")
             raise
 
+    def tts_stream(
+        self,
+        text: str,
+        as_fmt: str = "wav",
+        voice: Optional[str] = None,
+        timeout: Optional[float] = None,
+        chunk_bytes: int = 4096
+    ) -> TtsStream:
+        """
+        Like tts(), but returns as soon as the response headers arrive.
+        الصوت يُقرأ من الـ socket أثناء التشغيل (AudioPlayer.play_stream) بدل انتظار الرد كاملًا.
+        أغلق الـ chunks (close()) لتحرير الاتصال لو توقف التشغيل مبكرًا.
+        """
+        if not text or not text.strip():
+            raise ValueError("Empty text provided")
+
+        api_url = self._register_endpoint(self.config.SERVER_API_URL)
+        fmt = as_fmt.lower()
+        text = text.strip()
+        # PCM الخام يحتاج sample rate من الـ headers → الـ cache للـ WAV فقط هنا
+        cache = self.cache if fmt == "wav" else None
+        if cache is not None:
+            cached = cache.get(text, voice, fmt)
+            if cached is not None:
+                logger.info(f"⚡ TTS cache hit: {len(cached)} bytes")
+                return TtsStream(chunks=iter([cached]), fmt=fmt)
+
+        payload = {"text": text, "as": fmt}
+        if voice:
+            payload["voice"] = voice
+
+        logger.info(f"📤 Streaming TTS: {api_url}")
+        t0 = TRACE.now()
+        turn = TRACE.turn
+        resp = self.session.post(
+            api_url,
+            data=json.dumps(payload),
+            headers={"Content-Type": "application/json"},
+            timeout=timeout,
+            stream=True
+        )
+        try:
+            resp.raise_for_status()
+        except requests.exceptions.HTTPError as ex:
+            logger.error(f"❌ HTTP Error: {ex}")
+            resp.close()
+            raise
+
+        sample_rate = None
+        channels = 1
+        if fmt == "pcm":
+            try:
+                sample_rate = int(resp.headers["x-sample-rate"])
+                channels = int(resp.headers.get("x-channels", "1"))
+            except (KeyError, ValueError):
+                resp.close()
+                raise ValueError("PCM stream without x-sample-rate header")
+
+        def chunks() -> Iterator[bytes]:
+            first = True
+            parts = []
+            try:
+                for chunk in resp.iter_content(chunk_size=chunk_bytes):
+                    if chunk:
+                        if first:
+                            TRACE.record("tts_first_byte", t0, TRACE.now(), turn)
+                            first = False
+                        if cache is not None:
+                            parts.append(chunk)
+                        yield chunk
+                TRACE.record("tts", t0, TRACE.now(), turn)
+                # الرد وصل كاملًا (إيقاف التشغيل مبكرًا لا يصل إلى هنا)
+                if cache is not None:
+                    cache.put(text, voice, fmt, b"".join(parts))
+            finally:
+                resp.close()
+
+        return TtsStream(chunks=chunks(), fmt=fmt, sample_rate=sample_rate, channels=channels)
+
+    def _register_endpoint(self, api_base: str) -> str:
+        """Register /tts on the shared transport; returns its URL."""
+        return self.transport.register("tts", f"{api_base.rstrip('/')}/tts",
+                                       read_timeout=self.config.TTS_TIMEOUT)
+
     def cleanup(self):
         """Cleanup resources (if any)"""
         logger.debug("TTS cleanup called")
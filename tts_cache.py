@@ -0,0 +1,222 @@
+# tts_cache.py
+# -------------------------------------------------------------------
+# Persistent TTS audio cache (content-addressed)
+# - اسم الملف = sha256(format | voice | text) → نفس الجملة = نفس الملف
+# - الكتابة ذرية: ملف مؤقت في نفس المجلد ثم os.replace (لا ملفات نصف مكتوبة)
+# - القراءة bytes عادية: المستهلكون (clip_from_wav_bytes / WavStreamParser) ينسخون على أي حال
+# - LRU تحت ميزانية بايت: آخر استخدام = mtime (يبقى بعد إعادة التشغيل)
+# - warm_up(): توليد كل ردود LocalCommandHandler مسبقًا (جملة بجملة مثل SpeechPipeline)
+#
+#   python tts_cache.py            # warm-up لكل الردود المحلية ثم إحصائيات
+# -------------------------------------------------------------------
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+
+class TtsCache:
+    """
+    Disk cache of synthesized audio keyed by (text, voice, format).
+
+        cache = TtsCache("cache/tts", max_bytes=64 * 1024 * 1024)
+        audio = cache.get(text, voice, "wav")     # bytes أو None
+        cache.put(text, voice, "wav", audio_bytes)
+    """
+
+    def __init__(self, folder: str = "cache/tts", max_bytes: int = 64 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()    # name → size (الأقدم أولًا)
+        self._bytes = 0
+        os.makedirs(folder, exist_ok=True)
+        self._scan()
+
+    # ---------------- Keys ----------------
+
+    @staticmethod
+    def key(text: str, voice: Optional[str], fmt: str) -> str:
+        raw = f"{fmt.lower()}\x00{voice or ''}\x00{text.strip()}".encode("utf-8")
+        return f"{hashlib.sha256(raw).hexdigest()}.{fmt.lower()}"
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    # ---------------- Public API ----------------
+
+    def get(self, text: str, voice: Optional[str] = None, fmt: str = "wav") -> Optional[bytes]:
+        """Cached audio bytes, or None."""
+        name = self.key(text, voice, fmt)
+        with self._lock:
+            if name not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(name)
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            if not audio:
+                raise ValueError("empty cache file")
+            os.utime(path)      # آخر استخدام → ترتيب LRU بعد إعادة التشغيل
+        except (OSError, ValueError):
+            # حُذف من الخارج أو ملف فارغ
+            with self._lock:
+                self._bytes -= self._index.pop(name, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return audio
+
+    def put(self, text: str, voice: Optional[str], fmt: str, audio: bytes) -> None:
+        if not audio or not text or not text.strip():
+            return
+        name = self.key(text, voice, fmt)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.folder, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(tmp, self._path(name))
+        except OSError as e:
+            print(f"⚠️ TTS cache write failed: {e}")
+            try:
+                os.remove(tmp)
+            except (OSError, UnboundLocalError):
+                pass
+            return
+        with self._lock:
+            self._bytes += len(audio) - self._index.pop(name, 0)
+            self._index[name] = len(audio)
+            victims = self._evict()
+        for victim in victims:
+            try:
+                os.remove(self._path(victim))
+            except OSError:
+                pass
+
+    def __contains__(self, item) -> bool:
+        text, voice, fmt = item
+        return self.key(text, voice, fmt) in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0.0
+        return (f"{len(self._index)} clips, {self._bytes / 1e6:.1f}/{self.max_bytes / 1e6:.0f} MB, "
+                f"{self.hits} hits / {self.misses} misses ({rate:.0f}%)")
+
+    # ---------------- Internal ----------------
+
+    def _evict(self) -> List[str]:
+        victims = []
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            name, size = self._index.popitem(last=False)
+            self._bytes -= size
+            victims.append(name)
+        return victims
+
+    def _scan(self) -> None:
+        """Rebuild the LRU index from the folder (mtime = last use)."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_file():
+                continue
+            if entry.name.startswith(".tmp-"):
+                # بقايا كتابة انقطعت
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, entry.name, st.st_size))
+        for _mtime, name, size in sorted(entries):
+            self._index[name] = size
+            self._bytes += size
+        for victim in self._evict():
+            try:
+                os.remove(self._path(victim))
+            except OSError:
+                pass
+
+
+# ==================== Warm-up ====================
+
+def response_texts(responses: Dict) -> List[str]:
+    """All strings inside LocalCommandHandler._init_responses() (nested dict/list)."""
+    out: List[str] = []
+    stack = [responses]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+        elif isinstance(item, dict):
+            stack.extend(reversed(list(item.values())))
+        elif isinstance(item, (list, tuple)):
+            stack.extend(reversed(item))
+    return out
+
+
+def warm_up(tts, texts: Iterable[str], as_fmt: str = "wav", voice: Optional[str] = None) -> int:
+    """
+    Pre-render `texts` sentence by sentence (نفس تقسيم SpeechPipeline → نفس المفاتيح).
+    Returns how many sentences were synthesized (الموجود مسبقًا يُتخطّى).
+    """
+    from utilities import split_sentences
+
+    cache = getattr(tts, "cache", None)
+    if cache is None:
+        return 0
+    rendered = 0
+    for text in texts:
+        for sentence in split_sentences(text):
+            if (sentence, voice, as_fmt) in cache:
+                continue
+            try:
+                tts.tts(sentence, as_fmt=as_fmt, voice=voice)
+                rendered += 1
+            except Exception as ex:
+                print(f"⚠️ TTS warm-up failed for '{sentence[:30]}': {ex}")
+    return rendered
+
+
+# ==================== Quick Test / Warm-up command ====================
+
+if __name__ == "__main__":
+    import sys
+    from Config import Config
+    from local_commands import LocalCommandHandler
+    from text_to_speech import TextToSpeech
+
+    cfg = Config()
+    cfg.TTS_CACHE = True
+    if len(sys.argv) > 1 and sys.argv[1] == "--stub":
+        # بدون سيرفر: StubApiServer محلي
+        from stub_server import StubApiServer
+        srv = StubApiServer().start()
+        cfg.SERVER_API_URL = srv.url
+
+    tts = TextToSpeech(cfg)
+    texts = response_texts(LocalCommandHandler()._init_responses())
+    t0 = time.perf_counter()
+    n = warm_up(tts, texts)
+    print(f"🔥 warm-up: {n} sentences rendered in {time.perf_counter() - t0:.2f}s → {tts.cache.stats()}")
+
+    sentence = "Hello! How can I help you?"
+    t0 = time.perf_counter()
+    audio = tts.tts(sentence)
+    print(f"⚡ cached '{sentence}': {len(audio)} bytes in {(time.perf_counter() - t0) * 1000:.2f} ms")
@@ -1,5 +1,22 @@
 import re
 from typing import Tuple, Iterable
+
+_AR_DIACRITICS = re.compile(r'[\u0617-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]')
+_AR_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه', 'ى': 'ي', 'ـ': ''
+})
+
+
+def normalize_arabic(text: str) -> str:
+    """
+    تطبيع عربي خفيف وسريع (مشترك: wake word / stop / مفاتيح الـ cache):
+    lowercase + strip، حذف التشكيل والتطويل، أإآٱ → ا، ة → ه، ى → ي
+    """
+    if not text:
+        return ""
+    return _AR_DIACRITICS.sub('', text.strip().lower()).translate(_AR_LETTERS)
+
 # -------------------------------------------------------------------
 # Ultra-optimized Wake-word Detector (Class Version) - NO Levenshtein!
 # -------------------------------------------------------------------
@@ -68,14 +85,7 @@ class WakeWordDetector:
     # ---------------- Normalization (Arabic) ----------------
     def _normalize_ar(self, text: str) -> str:
         """تطبيع عربي خفيف وسريع."""
-        if not text:
-            return ""
-        text = self._AR_DIACRITICS.sub('', text.strip().lower())
-        text = text.translate(str.maketrans({
-            'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
-            'ة': 'ه', 'ى': 'ي', 'ـ': ''
-        }))
-        return text
+        return normalize_arabic(text)
 
     # ---------------- English Wake Token Check ----------------
     def _is_english_wake_token(self, tok: str) -> bool:
@@ -286,16 +296,7 @@ class StopCommandDetector:
         - Remove diacritics and elongations
         - Convert letter variants (أإآٱ → ا, ة → ه, ى → ي)
         """
-        if not text:
-            return ""
-        text = text.strip().lower()
-        text = self._AR_DIACRITICS.sub('', text)
-        text = text.replace('ـ', '')  # remove kashida
-        for src in 'أإآٱ':
-            text = text.replace(src, 'ا')
-        text = text.replace('ة', 'ه')
-        text = text.replace('ى', 'ي')
-        return text
+        return normalize_arabic(text)
 
     # -----------------------------------------------------------------
     #                     Core Detection Logic
@@ -332,3 +333,70 @@ class StopCommandDetector:
 
 
 
+
+
+# -------------------------------------------------------------------
+# Sentence splitting for TTS (full text or incremental token stream)
+# -------------------------------------------------------------------
+
+class SentenceBuffer:
+    """
+    Incremental sentence splitter (Arabic + English punctuation).
+    - feed(delta): يضيف نصًا جديدًا ويعيد الجمل المكتملة فقط
+    - flush():     يعيد ما تبقى في النهاية
+
+    Fragments shorter than `min_chars` are merged with the next one
+    (avoids one TTS round trip for "Hi!" or a bullet marker).
+    """
+
+    # نهاية الجملة: . ! ? … وعلامة الاستفهام العربية ؟ والفاصلة المنقوطة ؛ + مسافة، أو سطر جديد
+    # (المسافة بعد النقطة شرط حتى لا نقطع أرقامًا مثل 3.5)
+    _SENTENCE_END = re.compile(r'(?<=[.!?…؟؛;])\s+|\s*\n+\s*')
+
+    def __init__(self, min_chars: int = 12):
+        self.min_chars = min_chars
+        self._tail = ""      # نص لم تظهر نهايته بعد
+        self._pending = ""   # جملة مكتملة لكن قصيرة، تنتظر الدمج
+
+    def feed(self, delta: str) -> list[str]:
+        if not delta:
+            return []
+        self._tail += delta
+        pieces = self._SENTENCE_END.split(self._tail)
+        # آخر قطعة لم تنتهِ بعلامة + مسافة بعد — تبقى في الـ buffer
+        self._tail = pieces.pop()
+        return self._collect(pieces)
+
+    def flush(self) -> list[str]:
+        pieces = [self._tail]
+        self._tail = ""
+        out = self._collect(pieces)
+        if self._pending:
+            out.append(self._pending)
+            self._pending = ""
+        return out
+
+    def _collect(self, pieces: list[str]) -> list[str]:
+        out = []
+        for piece in pieces:
+            piece = piece.strip()
+            if not piece:
+                continue
+            self._pending = f"{self._pending} {piece}" if self._pending else piece
+            if len(self._pending) >= self.min_chars:
+                out.append(self._pending)
+                self._pending = ""
+        return out
+
+
+def split_sentences(text: str, min_chars: int = 12) -> list[str]:
+    """Split a full reply into sentences for TTS."""
+    if not text or not text.strip():
+        return []
+    buf = SentenceBuffer(min_chars=min_chars)
+    sentences = buf.feed(text.strip()) + buf.flush()
+    # ذيل قصير في النص الكامل يُدمج مع الجملة السابقة
+    if len(sentences) > 1 and len(sentences[-1]) < min_chars:
+        tail = sentences.pop()
+        sentences[-1] = f"{sentences[-1]} {tail}"
+    return sentences